@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmark suite for simulation, recognition and file I/O.
+
+All benchmarks use fixed random seeds and run offline. Usage:
+    
+    python benchmarks/bench.py run [--output results.json] [--quick]
+    python benchmarks/bench.py compare baseline.json results.json
+    python benchmarks/bench.py check-imports
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from erdbeermet.simulation import simulate, random_history, Scenario
+from erdbeermet.recognition import recognize, is_pseudometric
+from erdbeermet.tools.Condensed import condense
+from erdbeermet.tools.Tree import Tree, TreeNode
+import erdbeermet.tools.FileIO as FileIO
+
+
+__author__ = 'David Schaller'
+
+
+SEED = 42
+
+# modules that must not be imported by the pure simulation/recognition
+# modules (plotting and file output are imported lazily)
+LAZY_MODULES = ('matplotlib', 'scipy', 'erdbeermet.tools.FileIO',
+                'erdbeermet.visualize.RecognitionVis',
+                'erdbeermet.visualize.SVGExport')
+
+CORE_MODULES = ('erdbeermet.simulation', 'erdbeermet.recognition')
+
+
+def _time(func, repeat):
+    """Run func repeat times and return the individual run times."""
+    
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    
+    return times
+
+
+def _seeded(setup):
+    """Call setup() with a fixed seed so every run uses the same input."""
+    
+    np.random.seed(SEED)
+    return setup()
+
+
+def bench_simulation(quick):
+    
+    Ns = (10, 50) if quick else (10, 50, 200)
+    
+    for N in Ns:
+        for branching_prob in (0.0, 0.3):
+            for circular in (False, True):
+                for clocklike in (False, True):
+                    name = (f'simulate/N={N}/branching_prob={branching_prob}'
+                            f'/circular={circular}/clocklike={clocklike}')
+                    kwargs = dict(branching_prob=branching_prob,
+                                  circular=circular, clocklike=clocklike)
+                    
+                    def run(N=N, kwargs=kwargs):
+                        np.random.seed(SEED)
+                        simulate(N, **kwargs).D
+                    
+                    yield name, run
+                    
+                    history = _seeded(lambda: random_history(N, **kwargs))
+                    
+                    def build(history=history):
+                        Scenario(history)._build_matrix()
+                    
+                    yield name.replace('simulate/', '_build_matrix/'), build
+
+
+def bench_recognition(quick):
+    
+    exhaustive = (6, 7) if quick else (6, 7, 8)
+    greedy = (6, 8) if quick else (6, 8, 10, 12)
+    
+    for first_candidate_only, ns in ((False, exhaustive), (True, greedy)):
+        for n in ns:
+            D = _seeded(lambda: simulate(n).D)
+            name = (f'recognize/n={n}/'
+                    f'first_candidate_only={first_candidate_only}')
+            
+            def run(D=D, first_candidate_only=first_candidate_only):
+                recognize(D, first_candidate_only=first_candidate_only)
+            
+            yield name, run
+
+
+def bench_pseudometric(quick):
+    
+    for n in ((10, 50) if quick else (10, 50, 100)):
+        D = _seeded(lambda: simulate(n).D)
+        
+        def run(D=D):
+            is_pseudometric(D)
+        
+        yield f'is_pseudometric/n={n}', run
+        
+        def run_condensed(C=condense(D)):
+            is_pseudometric(C)
+        
+        yield f'is_pseudometric/condensed/n={n}', run_condensed
+
+
+def bench_io(quick, tmpdir):
+    
+    for N in ((100,) if quick else (100, 1000)):
+        history = _seeded(lambda: random_history(N))
+        filename = os.path.join(tmpdir, f'history_{N}')
+        
+        def write(history=history, filename=filename):
+            FileIO.write_history(filename, history)
+        
+        yield f'write_history/N={N}', write
+        
+        FileIO.write_history(filename, history)
+        
+        def parse(filename=filename):
+            FileIO.parse_history(filename)
+        
+        yield f'parse_history/N={N}', parse
+    
+    for n in ((7,) if quick else (7, 8)):
+        tree = recognize(_seeded(lambda: simulate(n).D))
+        filename = os.path.join(tmpdir, f'recognition_{n}')
+        
+        def write_rec(tree=tree, filename=filename):
+            FileIO.write_recognition(filename, tree)
+        
+        yield f'write_recognition/n={n}', write_rec
+
+
+def _synthetic_tree(nodes, n=12, children=6):
+    """Recognition tree (without matrices) with the given number of nodes.
+    
+    Every inner node has `children` children, which are built level by
+    level until the number of nodes is reached.
+    """
+    
+    root = TreeNode(n, list(range(n)))
+    frontier = [root]
+    count = 1
+    
+    while count < nodes:
+        next_frontier = []
+        for v in frontier:
+            for z in v.V[:children]:
+                if count == nodes:
+                    break
+                V = v.V.copy()
+                V.remove(z)
+                child = TreeNode(v.n-1, V, R_step=(0, 1, z, 0.5))
+                v.add_child(child)
+                next_frontier.append(child)
+                count += 1
+        frontier = next_frontier
+    
+    return Tree(root)
+
+
+def bench_tree_io(quick, tmpdir):
+    
+    nodes = 100000 if quick else 1000000
+    filename = os.path.join(tmpdir, f'tree_{nodes}.npz')
+    _synthetic_tree(nodes).save(filename, matrices=False)
+    
+    def load(filename=filename):
+        Tree.load(filename)
+    
+    yield f'load_recognition/nodes={nodes}', load
+    
+    def load_eager(filename=filename):
+        Tree.load(filename, lazy=False)
+    
+    yield f'load_recognition/lazy=False/nodes={nodes}', load_eager
+
+
+def _import_command(modules):
+    
+    return [sys.executable, '-c', '; '.join(f'import {m}' for m in modules)]
+
+
+def bench_imports(quick):
+    
+    for module in CORE_MODULES:
+        
+        def run(module=module):
+            subprocess.run(_import_command([module]), check=True)
+        
+        yield f'import/{module}', run
+
+
+def check_imports():
+    """Return the lazily imported modules that are loaded by the core
+    modules (an empty list if there are none)."""
+    
+    code = ('import sys; ' +
+            '; '.join(f'import {m}' for m in CORE_MODULES) +
+            '; print("\\n".join(sys.modules))')
+    output = subprocess.run([sys.executable, '-c', code], check=True,
+                            capture_output=True, text=True).stdout
+    
+    return sorted(m for m in output.split()
+                  if any(m == lazy or m.startswith(lazy + '.')
+                         for lazy in LAZY_MODULES))
+
+
+def run_benchmarks(quick=False, repeat=5, pattern=None):
+    """Run all benchmarks and return the results as a dict."""
+    
+    results = {}
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        
+        benchmarks = [bench_imports(quick), bench_simulation(quick),
+                      bench_recognition(quick), bench_pseudometric(quick),
+                      bench_io(quick, tmpdir), bench_tree_io(quick, tmpdir)]
+        
+        for generator in benchmarks:
+            for name, func in generator:
+                if pattern and pattern not in name:
+                    continue
+                times = _time(func, repeat)
+                results[name] = {'min': min(times),
+                                 'median': statistics.median(times),
+                                 'repeat': repeat}
+                print(f'{name:<75} {min(times):12.6f} s', flush=True)
+    
+    meta = {'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'quick': quick,
+            'seed': SEED}
+    
+    return {'meta': meta, 'results': results}
+
+
+def compare(baseline, current, threshold=1.25):
+    """Compare two result dicts and return the names of regressions.
+    
+    A benchmark is a regression if its minimal time exceeds the baseline
+    by more than the factor threshold.
+    """
+    
+    regressions = []
+    
+    for name in sorted(set(baseline['results']) & set(current['results'])):
+        old = baseline['results'][name]['min']
+        new = current['results'][name]['min']
+        ratio = new / old if old > 0 else float('inf')
+        flag = ''
+        if ratio > threshold:
+            regressions.append(name)
+            flag = 'REGRESSION'
+        elif ratio < 1 / threshold:
+            flag = 'improved'
+        print(f'{name:<75} {old:10.6f} {new:10.6f} {ratio:7.2f}x {flag}')
+    
+    for name in sorted(set(baseline['results']) - set(current['results'])):
+        print(f'{name:<75} missing in current results')
+    
+    return regressions
+
+
+def main(argv=None):
+    
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    run_parser = subparsers.add_parser('run', help='run the benchmarks')
+    run_parser.add_argument('--output', default='bench_results.json',
+                            help='JSON file for the results')
+    run_parser.add_argument('--quick', action='store_true',
+                            help='only run the smaller instances')
+    run_parser.add_argument('--repeat', type=int, default=5,
+                            help='number of repetitions per benchmark')
+    run_parser.add_argument('--filter', default=None,
+                            help='only run benchmarks containing this string')
+    
+    cmp_parser = subparsers.add_parser('compare',
+                                       help='compare against a baseline')
+    cmp_parser.add_argument('baseline', help='JSON file of the baseline')
+    cmp_parser.add_argument('current', help='JSON file of the new results')
+    cmp_parser.add_argument('--threshold', type=float, default=1.25,
+                            help='slowdown factor reported as regression')
+    
+    subparsers.add_parser('check-imports',
+                          help='check that the simulation and recognition '
+                               'modules do not import plotting or file '
+                               'output modules')
+    
+    args = parser.parse_args(argv)
+    
+    if args.command == 'check-imports':
+        loaded = check_imports()
+        if loaded:
+            print('imported by ' + ', '.join(CORE_MODULES) + ':')
+            print('\n'.join(loaded))
+            return 1
+        print('ok')
+        return 0
+    
+    if args.command == 'run':
+        results = run_benchmarks(quick=args.quick, repeat=args.repeat,
+                                 pattern=args.filter)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        return 0
+    
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    
+    regressions = compare(baseline, current, threshold=args.threshold)
+    if regressions:
+        print(f'\n{len(regressions)} regression(s) found')
+        return 1
+    
+    return 0
+
+
+if __name__ == '__main__':
+    
+    sys.exit(main())
@@ -20,8 +20,11 @@ setuptools.setup(
         'Operating System :: OS Independent',
     ],
     python_requires='>=3.7',
+    entry_points={
+        'console_scripts': ['erdbeermet=erdbeermet.cli:main'],
+    },
     install_requires=[
-        'numpy>=1.16.4',
+        'numpy>=1.17',
         'scipy>=1.3.0',
         'matplotlib>=3.0',
    ],
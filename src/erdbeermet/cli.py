@@ -0,0 +1,504 @@
+# -*- coding: utf-8 -*-
+
+"""Command-line batch driver for simulations and recognitions.
+    
+    erdbeermet simulate --N 10 --count 100 --seed 0 --out histories/
+    erdbeermet --jobs 4 recognize histories/*.txt stack.npy --output res.jsonl
+    erdbeermet pipeline --N 10 --count 1000 --seed 0 --output res.jsonl
+    erdbeermet mine --N 6 7 --branching-prob 0.0 0.3 --archive dead_ends.jsonl
+    erdbeermet study --N 6 8 --circular no yes --replicates 100 --dir study/
+    erdbeermet obstructions --N 8 --count 100 --noise 0.05 --output obs.jsonl
+
+The recognition results are written as one JSON line per scenario as soon
+as they are available (not necessarily in input order). With --resume,
+scenarios whose id is already present in the output file are skipped and
+the new lines are appended. The inputs of 'recognize' are read by the
+workers; an input that cannot be read or recognized results in a line with
+its id and an 'error' message (and the exit status 1), and is retried with
+--resume. The command 'mine' runs the dead-end miner (see
+mining.mine_dead_ends()) on all combinations of the given numbers of items
+and branching probabilities, and 'study' runs (or resumes) a Monte Carlo
+study over a parameter grid (see study.run_study()). The command
+'obstructions' searches the minimal non-R submatrices of (optionally
+perturbed) simulated matrices (see obstructions.find_obstructions()) and
+writes them in the same way as the recognition results.
+"""
+
+import argparse
+import glob
+import itertools
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from erdbeermet.simulation import simulate, load
+from erdbeermet.recognition import recognize
+from erdbeermet.mining import mine_dead_ends
+from erdbeermet.study import parameter_grid, run_study
+from erdbeermet.obstructions import obstructions_for_seed
+from erdbeermet.tools.FileIO import (open_json_lines, read_json_lines,
+                                     write_history)
+
+
+__author__ = 'David Schaller'
+
+
+# --------------------------------------------------------------------------
+#                        tasks (run in the worker processes)
+# --------------------------------------------------------------------------
+
+def _simulate_scenario(N, seed, sim_params):
+    
+    np.random.seed(seed)
+    
+    return simulate(N, **sim_params)
+
+
+def _recognize_matrix(D, rec_params):
+    
+    start = time.perf_counter()
+    tree = recognize(D, **rec_params)
+    result = tree.summary()
+    result['time_recognize'] = time.perf_counter() - start
+    result['success'] = result['successes'] > 0
+    result['n'] = D.shape[0]
+    
+    return result
+
+
+def _run_simulate(task):
+    
+    scenario_id, N, seed, sim_params, out, matrix = task
+    
+    scenario = _simulate_scenario(N, seed, sim_params)
+    
+    if out is not None:
+        write_history(os.path.join(out, f'{scenario_id}.txt'),
+                      scenario.history)
+    
+    return scenario_id, scenario.D if matrix else None
+
+
+def _load_input(path, index):
+    
+    if path.endswith('.npy'):
+        stack = np.load(path, mmap_mode='r')
+        return np.array(stack if index is None else stack[index])
+    
+    return load(path).D
+
+
+def _run_recognize(task):
+    
+    scenario_id, path, index, rec_params = task
+    
+    # the input is only read in the worker, and an unreadable input only
+    # fails its own record
+    try:
+        D = _load_input(path, index)
+        result = {'id': scenario_id}
+        result.update(_recognize_matrix(D, rec_params))
+    except Exception as e:
+        return {'id': scenario_id, 'error': f'{type(e).__name__}: {e}'}
+    
+    return result
+
+
+def _run_pipeline(task):
+    
+    scenario_id, N, seed, sim_params, rec_params, out = task
+    
+    start = time.perf_counter()
+    scenario = _simulate_scenario(N, seed, sim_params)
+    D = scenario.D
+    elapsed = time.perf_counter() - start
+    
+    if out is not None:
+        write_history(os.path.join(out, f'{scenario_id}.txt'),
+                      scenario.history)
+    
+    result = {'id': scenario_id, 'seed': seed, 'time_simulate': elapsed}
+    result.update(_recognize_matrix(D, rec_params))
+    
+    return result
+
+
+def _run_obstructions(task):
+    
+    scenario_id, N, seed, sim_params, noise, max_size, all_sizes = task
+    
+    result = {'id': scenario_id}
+    result.update(obstructions_for_seed(N, seed, noise=noise,
+                                        max_size=max_size,
+                                        all_sizes=all_sizes, **sim_params))
+    
+    return result
+
+
+# --------------------------------------------------------------------------
+#                                input/output
+# --------------------------------------------------------------------------
+
+def _read_inputs(paths):
+    """Generator for (id, path, index in the stack) of all inputs.
+    
+    Files with the extension '.npy' contain a single matrix (index None) or
+    a stack of matrices (shape (k, n, n)), all other files are history files
+    (index None). Only the headers of the .npy files are read here.
+    """
+    
+    for pattern in paths:
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            if not path.endswith('.npy'):
+                yield path, path, None
+                continue
+            try:
+                shape = np.load(path, mmap_mode='r').shape
+            except (OSError, ValueError):
+                # reported by the worker
+                shape = ()
+            if len(shape) != 3:
+                yield path, path, None
+            else:
+                for i in range(shape[0]):
+                    yield f'{path}:{i}', path, i
+
+
+def _done_ids(output):
+    """Ids of the scenarios that are already present in the output file."""
+    
+    if output is None:
+        return set()
+    
+    # failed records are retried
+    return {result['id'] for result in read_json_lines(output)
+            if 'id' in result and 'error' not in result}
+
+
+def _open_output(output, resume):
+    
+    if output is None:
+        return sys.stdout
+    
+    return open_json_lines(output, append=resume)
+
+
+def _map(func, tasks, jobs):
+    """Apply func to the tasks on a pool of jobs processes (or directly)."""
+    
+    if jobs == 1:
+        yield from map(func, tasks)
+        return
+    
+    with Pool(jobs) as pool:
+        yield from pool.imap_unordered(func, tasks, chunksize=1)
+
+
+def _stream_results(results, output, resume):
+    """Write the results and return the number of failed records."""
+    
+    f = _open_output(output, resume)
+    failures = 0
+    
+    try:
+        for result in results:
+            f.write(json.dumps(result) + '\n')
+            f.flush()
+            if 'error' in result:
+                print(f"{result['id']}: {result['error']}", file=sys.stderr)
+                failures += 1
+    finally:
+        if f is not sys.stdout:
+            f.close()
+    
+    return failures
+
+
+# --------------------------------------------------------------------------
+#                                 commands
+# --------------------------------------------------------------------------
+
+def _sim_params(args):
+    
+    return {'branching_prob': args.branching_prob,
+            'circular': args.circular,
+            'clocklike': args.clocklike}
+
+
+def _rec_params(args):
+    
+    params = {'first_candidate_only': args.first_candidate_only,
+              'four_point_filter': args.four_point_filter}
+    
+    if args.circular_order:
+        params['circular_order'] = True
+    if args.beam_width is not None:
+        params['beam_width'] = args.beam_width
+    if args.max_nodes is not None:
+        params['max_nodes'] = args.max_nodes
+    if args.time_limit is not None:
+        params['time_limit'] = args.time_limit
+    
+    return params
+
+
+def _scenario_ids(args):
+    
+    # the id only depends on the seed, so that a run can be resumed with a
+    # different --count
+    return [(f'seed{args.seed + i}', args.seed + i)
+            for i in range(args.count)]
+
+
+def cmd_simulate(args):
+    
+    if args.out is None and args.matrices is None:
+        raise SystemExit('simulate: --out and/or --matrices is required')
+    
+    if args.out is not None:
+        os.makedirs(args.out, exist_ok=True)
+    
+    tasks = [(scenario_id, args.N, seed, _sim_params(args), args.out,
+              args.matrices is not None)
+             for scenario_id, seed in _scenario_ids(args)]
+    
+    matrices = dict(_map(_run_simulate, tasks, args.jobs))
+    
+    if args.matrices is not None:
+        np.save(args.matrices, np.stack([matrices[task[0]]
+                                         for task in tasks]))
+    
+    return 0
+
+
+def cmd_recognize(args):
+    
+    done = _done_ids(args.output) if args.resume else set()
+    rec_params = _rec_params(args)
+    
+    # generated while the pool is running
+    tasks = ((scenario_id, path, index, rec_params)
+             for scenario_id, path, index in _read_inputs(args.inputs)
+             if scenario_id not in done)
+    
+    failures = _stream_results(_map(_run_recognize, tasks, args.jobs),
+                               args.output, args.resume)
+    
+    return 1 if failures else 0
+
+
+def cmd_pipeline(args):
+    
+    done = _done_ids(args.output) if args.resume else set()
+    
+    if args.out is not None:
+        os.makedirs(args.out, exist_ok=True)
+    
+    tasks = [(scenario_id, args.N, seed, _sim_params(args), _rec_params(args),
+              args.out)
+             for scenario_id, seed in _scenario_ids(args)
+             if scenario_id not in done]
+    
+    _stream_results(_map(_run_pipeline, tasks, args.jobs), args.output,
+                    args.resume)
+    
+    return 0
+
+
+def cmd_obstructions(args):
+    
+    done = _done_ids(args.output) if args.resume else set()
+    
+    tasks = [(scenario_id, args.N, seed, _sim_params(args), args.noise,
+              args.max_size, args.all_sizes)
+             for scenario_id, seed in _scenario_ids(args)
+             if scenario_id not in done]
+    
+    _stream_results(_map(_run_obstructions, tasks, args.jobs), args.output,
+                    args.resume)
+    
+    return 0
+
+
+def cmd_mine(args):
+    
+    param_sets = [{'N': N, 'branching_prob': branching_prob,
+                   'circular': args.circular, 'clocklike': args.clocklike}
+                  for N, branching_prob in itertools.product(
+                                                args.N, args.branching_prob)]
+    
+    mine_dead_ends(param_sets, args.archive, workers=args.jobs,
+                   batch_size=args.batch_size, seed=args.seed,
+                   batches=args.batches, time_limit=args.time_limit,
+                   report_interval=args.report_interval)
+    
+    return 0
+
+
+def cmd_study(args):
+    
+    grid = parameter_grid(args.N, branching_prob=args.branching_prob,
+                          circular=args.circular, clocklike=args.clocklike)
+    
+    run_study(grid, args.replicates, args.dir, workers=args.jobs,
+              seed=args.seed, rec_params=_rec_params(args),
+              summary_interval=args.summary_interval)
+    
+    return 0
+
+
+def _yes_no(value):
+    
+    if value not in ('yes', 'no'):
+        raise argparse.ArgumentTypeError(f"expected 'yes' or 'no': {value}")
+    
+    return value == 'yes'
+
+
+def _add_simulation_arguments(parser):
+    
+    parser.add_argument('--N', type=int, required=True,
+                        help='number of items')
+    parser.add_argument('--count', type=int, default=1,
+                        help='number of scenarios')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the first scenario (scenario i uses '
+                             'seed + i)')
+    parser.add_argument('--branching-prob', type=float, default=0.0)
+    parser.add_argument('--circular', action='store_true')
+    parser.add_argument('--clocklike', action='store_true')
+
+
+def _add_recognition_arguments(parser, output=True):
+    
+    parser.add_argument('--first-candidate-only', action='store_true')
+    parser.add_argument('--four-point-filter', action='store_true')
+    parser.add_argument('--circular-order', action='store_true',
+                        help='infer a circular order to restrict the search')
+    parser.add_argument('--beam-width', type=int, default=None)
+    parser.add_argument('--max-nodes', type=int, default=None)
+    parser.add_argument('--time-limit', type=float, default=None,
+                        help='time limit per scenario in seconds')
+    
+    if not output:
+        return
+    
+    parser.add_argument('--output', default=None,
+                        help='JSON lines file (default: standard output)')
+    parser.add_argument('--resume', action='store_true',
+                        help='skip scenarios already present in the output')
+
+
+def main(argv=None):
+    
+    parser = argparse.ArgumentParser(
+                    prog='erdbeermet',
+                    description='Simulation and recognition of R matrices')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        help='number of worker processes')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    sim_parser = subparsers.add_parser('simulate',
+                                       help='simulate scenarios')
+    _add_simulation_arguments(sim_parser)
+    sim_parser.add_argument('--out', default=None,
+                            help='directory for the history files')
+    sim_parser.add_argument('--matrices', default=None,
+                            help='.npy file for the stack of matrices')
+    sim_parser.set_defaults(func=cmd_simulate)
+    
+    rec_parser = subparsers.add_parser('recognize',
+                                       help='recognize history files or '
+                                            'matrix stacks (.npy)')
+    rec_parser.add_argument('inputs', nargs='+',
+                            help='history files or .npy files (wildcards '
+                                 'are expanded)')
+    _add_recognition_arguments(rec_parser)
+    rec_parser.set_defaults(func=cmd_recognize)
+    
+    pipe_parser = subparsers.add_parser('pipeline',
+                                        help='simulate and recognize '
+                                             'scenarios')
+    _add_simulation_arguments(pipe_parser)
+    _add_recognition_arguments(pipe_parser)
+    pipe_parser.add_argument('--out', default=None,
+                             help='directory for the history files')
+    pipe_parser.set_defaults(func=cmd_pipeline)
+    
+    mine_parser = subparsers.add_parser('mine',
+                                        help='collect dead ends of the '
+                                             'recognition with '
+                                             '--first-candidate-only')
+    mine_parser.add_argument('--N', type=int, nargs='+', required=True,
+                             help='numbers of items')
+    mine_parser.add_argument('--branching-prob', type=float, nargs='+',
+                             default=[0.0])
+    mine_parser.add_argument('--circular', action='store_true')
+    mine_parser.add_argument('--clocklike', action='store_true')
+    mine_parser.add_argument('--archive', required=True,
+                             help='JSON lines file to which new dead ends '
+                                  'are appended')
+    mine_parser.add_argument('--batch-size', type=int, default=100)
+    mine_parser.add_argument('--seed', type=int, default=0,
+                             help='seed of the first scenario of every '
+                                  'parameter set')
+    mine_parser.add_argument('--batches', type=int, default=None,
+                             help='number of batches per parameter set '
+                                  '(default: unlimited)')
+    mine_parser.add_argument('--time-limit', type=float, default=None,
+                             help='stop after this many seconds')
+    mine_parser.add_argument('--report-interval', type=float, default=60.0,
+                             help='seconds between progress reports')
+    mine_parser.set_defaults(func=cmd_mine)
+    
+    study_parser = subparsers.add_parser('study',
+                                         help='run or resume a Monte Carlo '
+                                              'study over a parameter grid')
+    study_parser.add_argument('--N', type=int, nargs='+', required=True,
+                              help='numbers of items')
+    study_parser.add_argument('--branching-prob', type=float, nargs='+',
+                              default=[0.0])
+    study_parser.add_argument('--circular', type=_yes_no, nargs='+',
+                              default=[False], help="'yes' and/or 'no'")
+    study_parser.add_argument('--clocklike', type=_yes_no, nargs='+',
+                              default=[False], help="'yes' and/or 'no'")
+    study_parser.add_argument('--replicates', type=int, required=True,
+                              help='number of replicates per grid cell')
+    study_parser.add_argument('--seed', type=int, default=0)
+    study_parser.add_argument('--dir', required=True,
+                              help='study directory (an existing study is '
+                                   'resumed)')
+    study_parser.add_argument('--summary-interval', type=float, default=60.0,
+                              help='seconds between updates of the summary')
+    _add_recognition_arguments(study_parser, output=False)
+    study_parser.set_defaults(func=cmd_study)
+    
+    obs_parser = subparsers.add_parser('obstructions',
+                                       help='find minimal non-R submatrices '
+                                            'of simulated matrices')
+    _add_simulation_arguments(obs_parser)
+    obs_parser.add_argument('--noise', type=float, default=0.0,
+                            help='relative noise added to the distances')
+    obs_parser.add_argument('--max-size', type=int, default=None,
+                            help='maximal size of the obstructions')
+    obs_parser.add_argument('--all-sizes', action='store_true',
+                            help='also report larger minimal obstructions')
+    obs_parser.add_argument('--output', default=None,
+                            help='JSON lines file (default: standard output)')
+    obs_parser.add_argument('--resume', action='store_true',
+                            help='skip scenarios already present in the '
+                                 'output')
+    obs_parser.set_defaults(func=cmd_obstructions)
+    
+    args = parser.parse_args(argv)
+    
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    
+    sys.exit(main())
@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+
+"""Mining of dead ends of the greedy recognition.
+
+A dead end is a matrix that is recognized as an R matrix by the exhaustive
+search, but for which the recognition with `first_candidate_only=True`
+does not find a successful path. The miner simulates and recognizes
+scenarios in seeded batches on a pool of worker processes, deduplicates the
+dead ends up to relabelling of the items (see dead_end_key()), and appends
+every new one to an archive (JSON lines) together with the parameters and
+the seed that produced it.
+    
+    from erdbeermet.mining import mine_dead_ends
+    
+    mine_dead_ends([{'N': 6}, {'N': 7, 'branching_prob': 0.3}],
+                   'dead_ends.jsonl', time_limit=3600)
+
+Scenario i of batch b of a parameter set is simulated right after
+np.random.seed(seed + b * batch_size + i) and can thus be reproduced.
+"""
+
+import hashlib
+import itertools
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from erdbeermet.simulation import check_simulation_params, simulate
+from erdbeermet.recognition import recognize
+from erdbeermet.tools.Condensed import as_square
+from erdbeermet.tools.FileIO import (history_to_json, open_json_lines,
+                                     read_json_lines)
+
+
+__author__ = 'David Schaller'
+
+
+# --------------------------------------------------------------------------
+#                             canonical forms
+# --------------------------------------------------------------------------
+
+def canonical_order(D, decimals=8, max_orders=100000):
+    """Canonical order of the items of a distance matrix.
+    
+    The items are sorted by their sorted (rounded) distances to the other
+    items. Among the orders that only permute items with equal sorted
+    distances, the one yielding the lexicographically smallest condensed
+    matrix is chosen. Hence, all relabellings of D result in the same
+    reordered matrix (up to rounding).
+    
+    Parameters
+    ----------
+    D : numpy array
+        Square or condensed distance matrix.
+    decimals : int, optional
+        Number of decimals to which the distances are rounded. The default
+        is 8.
+    max_orders : int, optional
+        Maximal number of orders that are compared. The default is 100000.
+    
+    Returns
+    -------
+    list
+        The items in canonical order.
+    
+    Raises
+    ------
+    ValueError
+        If more than `max_orders` orders would have to be compared (i.e.,
+        for highly symmetric matrices).
+    """
+    
+    D = np.round(as_square(D), decimals) + 0.0      # no negative zeros
+    n = D.shape[0]
+    
+    groups = {}
+    for i in range(n):
+        groups.setdefault(tuple(np.sort(D[i]).tolist()), []).append(i)
+    groups = [groups[invariant] for invariant in sorted(groups)]
+    
+    count = 1
+    for group in groups:
+        count *= math.factorial(len(group))
+    if count > max_orders:
+        raise ValueError(f'too many orders to compare: {count}')
+    
+    orders = np.array([sum(perms, ()) for perms in
+                       itertools.product(*(itertools.permutations(group)
+                                           for group in groups))],
+                      dtype=np.intp).reshape((count, n))
+    
+    # condensed matrices of all orders, the first column is the primary key
+    i, j = np.triu_indices(n, k=1)
+    C = D[orders[:, i], orders[:, j]]
+    best = np.lexsort(C.T[::-1])[0] if C.shape[1] else 0
+    
+    return orders[best].tolist()
+
+
+def canonical_form(D, decimals=8, max_orders=100000):
+    """Rounded condensed matrix of D in canonical order (see
+    canonical_order())."""
+    
+    order = canonical_order(D, decimals=decimals, max_orders=max_orders)
+    i, j = np.triu_indices(len(order), k=1)
+    order = np.array(order, dtype=np.intp)
+    
+    return np.round(as_square(D), decimals)[order[i], order[j]] + 0.0
+
+
+def canonical_key(D, decimals=8, max_orders=100000):
+    """Hash of the canonical form of D, i.e., equal for all relabellings.
+    
+    Raises ValueError for highly symmetric matrices (see canonical_order()),
+    for which invariant_key() can be used instead.
+    """
+    
+    C = np.ascontiguousarray(canonical_form(D, decimals=decimals,
+                                            max_orders=max_orders),
+                             dtype=np.float64)
+    
+    h = hashlib.sha256()
+    h.update(str(len(C)).encode())
+    h.update(C.tobytes())
+    
+    return h.hexdigest()
+
+
+def invariant_key(D, decimals=8):
+    """Hash of the rows of D, each sorted, in lexicographic order.
+    
+    Equal for all relabellings of D and cheap to compute, but (unlike
+    canonical_key()) possibly also equal for matrices that are not
+    relabellings of each other. The key is prefixed with 'invariant:'.
+    """
+    
+    D = np.round(as_square(D), decimals) + 0.0      # no negative zeros
+    rows = np.sort(D, axis=1)
+    rows = np.ascontiguousarray(rows[np.lexsort(rows.T[::-1])],
+                                dtype=np.float64)
+    
+    h = hashlib.sha256()
+    h.update(str(rows.shape[0]).encode())
+    h.update(rows.tobytes())
+    
+    return 'invariant:' + h.hexdigest()
+
+
+def dead_end_key(D, decimals=8, max_orders=100000):
+    """Key for the deduplication of dead ends.
+    
+    The key is canonical_key() of D, or invariant_key() (prefixed with
+    'invariant:') if D has too many tied items for the canonical order.
+    """
+    
+    try:
+        return canonical_key(D, decimals=decimals, max_orders=max_orders)
+    except ValueError:
+        return invariant_key(D, decimals=decimals)
+
+
+# --------------------------------------------------------------------------
+#                                 mining
+# --------------------------------------------------------------------------
+
+def _mine_batch(task):
+    """Simulate and recognize a batch of scenarios (in a worker process)."""
+    
+    index, params, seed, batch_size, decimals = task
+    params = dict(params)
+    N = params.pop('N')
+    
+    dead_ends = []
+    rejected = 0
+    fallbacks = 0
+    
+    for scenario_seed in range(seed, seed + batch_size):
+        
+        np.random.seed(scenario_seed)
+        scenario = simulate(N, **params)
+        D = scenario.D
+        
+        if recognize(D, first_candidate_only=True).successes:
+            continue
+        
+        # e.g. simulations with branching events do not always yield
+        # pseudometrics, such matrices are rejected by both searches
+        if not recognize(D).successes:
+            rejected += 1
+            continue
+        
+        key = dead_end_key(D, decimals=decimals)
+        if key.startswith('invariant:'):
+            # too many tied items for the canonical order
+            fallbacks += 1
+        
+        dead_ends.append({'key': key,
+                          'seed': scenario_seed,
+                          'history': history_to_json(scenario.history),
+                          'matrix': D.tolist()})
+    
+    return index, batch_size, rejected, fallbacks, dead_ends
+
+
+def _format_params(params):
+    
+    return ' '.join(f'{key}={value}' for key, value in params.items())
+
+
+def _report(counters, elapsed, file):
+    
+    print(f'--- {elapsed:.1f} s', file=file)
+    
+    for counter in counters:
+        scenarios = counter['scenarios']
+        rate = 1000 * counter['dead_ends'] / scenarios if scenarios else 0.0
+        print(f"{_format_params(counter['params'])}: {scenarios} scenarios "
+              f"({scenarios / elapsed if elapsed else 0.0:.1f}/s), "
+              f"{counter['dead_ends']} dead ends ({rate:.3f} per 1000), "
+              f"{counter['new']} new, {counter['rejected']} not recognized, "
+              f"{counter['fallbacks']} invariant keys",
+              file=file)
+    
+    file.flush()
+
+
+def mine_dead_ends(param_sets, archive, workers=None, batch_size=100, seed=0,
+                   batches=None, time_limit=None, report_interval=60.0,
+                   decimals=8, file=sys.stderr):
+    """Collect dead ends of the recognition with `first_candidate_only`.
+    
+    The batches of the parameter sets are processed in turns, and at most
+    two batches per worker are pending at any time, so that the miner can
+    run indefinitely. It stops after the given number of batches per
+    parameter set, after the time limit (the pending batches are still
+    completed), or on KeyboardInterrupt.
+    
+    Parameters
+    ----------
+    param_sets : list of dict
+        Simulation parameters 'N' (required), 'branching_prob', 'circular'
+        and 'clocklike' (see simulation.simulate()).
+    archive : str
+        Path of the archive (JSON lines). New dead ends are appended, dead
+        ends already present in the archive (up to relabelling) are only
+        counted.
+    workers : int, optional
+        Number of worker processes. The default is None, in which case the
+        number of CPUs is used.
+    batch_size : int, optional
+        Number of scenarios per batch. The default is 100.
+    seed : int, optional
+        Seed of the first scenario of every parameter set. The default is 0.
+    batches : int, optional
+        Number of batches per parameter set. The default is None (no
+        limit).
+    time_limit : float, optional
+        Time in seconds after which no new batches are started. The default
+        is None (no limit).
+    report_interval : float, optional
+        Seconds between two progress reports. The default is 60.0.
+    decimals : int, optional
+        Number of decimals for the deduplication (see canonical_key()). The
+        default is 8.
+    file : file-like object, optional
+        Output of the progress reports. The default is sys.stderr; None to
+        suppress them.
+    
+    Returns
+    -------
+    list of dict
+        For every parameter set, the parameters and the numbers of
+        scenarios, scenarios whose matrix is not recognized at all
+        ('rejected'), dead ends, new (i.e., archived) dead ends, and dead
+        ends that were deduplicated with invariant_key() since their
+        canonical form is too expensive ('fallbacks').
+    """
+    
+    param_sets = [check_simulation_params(params) for params in param_sets]
+    workers = workers if workers else os.cpu_count()
+    
+    known = {record['key'] for record in read_json_lines(archive)
+             if 'key' in record}
+    counters = [{'params': params, 'scenarios': 0, 'rejected': 0,
+                 'dead_ends': 0, 'new': 0, 'fallbacks': 0}
+                for params in param_sets]
+    
+    tasks = ((index, params, seed + b * batch_size, batch_size, decimals)
+             for b in (range(batches) if batches is not None
+                       else itertools.count())
+             for index, params in enumerate(param_sets))
+    
+    start = time.perf_counter()
+    last_report = start
+    
+    f = open_json_lines(archive)
+    executor = ProcessPoolExecutor(max_workers=workers)
+    pending = set()
+    
+    try:
+        while True:
+            
+            elapsed = time.perf_counter() - start
+            while (len(pending) < 2 * workers and
+                   (time_limit is None or elapsed < time_limit)):
+                task = next(tasks, None)
+                if task is None:
+                    break
+                pending.add(executor.submit(_mine_batch, task))
+            
+            if not pending:
+                break
+            
+            done, pending = wait(pending, timeout=report_interval,
+                                 return_when=FIRST_COMPLETED)
+            
+            for future in done:
+                index, count, rejected, fallbacks, dead_ends = \
+                    future.result()
+                counter = counters[index]
+                counter['scenarios'] += count
+                counter['rejected'] += rejected
+                counter['fallbacks'] += fallbacks
+                counter['dead_ends'] += len(dead_ends)
+                
+                for dead_end in dead_ends:
+                    if dead_end['key'] in known:
+                        continue
+                    known.add(dead_end['key'])
+                    counter['new'] += 1
+                    record = {'key': dead_end['key'],
+                              'params': counter['params'],
+                              'seed': dead_end['seed'],
+                              'history': dead_end['history'],
+                              'matrix': dead_end['matrix']}
+                    f.write(json.dumps(record) + '\n')
+            
+            f.flush()
+            
+            now = time.perf_counter()
+            if file is not None and now - last_report >= report_interval:
+                _report(counters, now - start, file)
+                last_report = now
+    
+    except KeyboardInterrupt:
+        pass
+    
+    finally:
+        # only the pending batches were submitted, so cancelling them is
+        # equivalent to shutdown(cancel_futures=True) of Python >= 3.9
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+        f.close()
+    
+    if file is not None:
+        _report(counters, time.perf_counter() - start, file)
+    
+    return counters
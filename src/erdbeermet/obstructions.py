@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+
+"""Minimal obstructions of distance matrices that are not R matrices.
+
+An obstruction is a subset of items such that the restriction of the
+distance matrix to it is not an R matrix, while its restrictions to all
+proper subsets are. Since restrictions of R matrices are again R matrices
+(cf. the four-point condition used by recognize()), every matrix that is
+rejected by the recognition contains an obstruction, and so does every
+superset of an obstruction.
+
+The search proceeds level by level (Apriori-like): pairs and triples are
+checked for the pseudometric axioms (every pseudometric on at most three
+items is an R matrix), quadruples with four_point_profile(), and a subset
+of k >= 5 items is only recognized if all its subsets of k-1 items passed
+the previous level, i.e., supersets of known obstructions are never tested.
+"""
+
+import itertools
+import time
+
+import numpy as np
+
+from erdbeermet.simulation import simulate
+from erdbeermet.recognition import recognize, four_point_profile
+
+
+__author__ = 'David Schaller'
+
+
+def _close_or_less(a, b, rtol=1e-05, atol=1e-08):
+    
+    return (a <= b) | np.isclose(a, b, rtol=rtol, atol=atol)
+
+
+def _singleton_level(D):
+    
+    return [(i,) for i in range(D.shape[0]) if D[i, i]]
+
+
+def _pair_level(D, valid):
+    
+    obstructions = []
+    
+    for i, j in itertools.combinations(range(D.shape[0]), 2):
+        if (i,) not in valid or (j,) not in valid:
+            continue
+        if (not np.isclose(D[i, j], D[j, i]) or
+            not _close_or_less(0.0, D[i, j])):
+            obstructions.append((i, j))
+    
+    return obstructions
+
+
+def _triple_level(D, valid):
+    
+    triples = np.array([t for t in itertools.combinations(range(D.shape[0]), 3)
+                        if all(p in valid for p in
+                               itertools.combinations(t, 2))],
+                       dtype=np.intp).reshape((-1, 3))
+    
+    x, y, z = triples[:, 0], triples[:, 1], triples[:, 2]
+    xy, xz, yz = D[x, y], D[x, z], D[y, z]
+    
+    # triangle inequality for all three sides at once
+    metric = (_close_or_less(xy, xz + yz) & _close_or_less(xz, xy + yz) &
+              _close_or_less(yz, xy + xz))
+    
+    return [tuple(t) for t in triples[~metric].tolist()]
+
+
+def _quadruple_level(D, valid):
+    
+    obstructions = []
+    quadruples, r_map, _, _ = four_point_profile(D, params=False)
+    
+    for q, is_r_map in zip(quadruples.tolist(), r_map.tolist()):
+        if not is_r_map and all(t in valid for t in
+                                itertools.combinations(q, 3)):
+            obstructions.append(tuple(q))
+    
+    return obstructions
+
+
+def _is_R_matrix(D):
+    
+    # a success of the greedy search is conclusive
+    return (recognize(D, first_candidate_only=True).successes > 0 or
+            recognize(D).successes > 0)
+
+
+def _candidates(valid):
+    """Subsets of k items whose subsets of k-1 items are all valid."""
+    
+    # join the valid subsets sharing all but the last item
+    prefixes = {}
+    for s in sorted(valid):
+        prefixes.setdefault(s[:-1], []).append(s[-1])
+    
+    for prefix, lasts in prefixes.items():
+        for a, b in itertools.combinations(lasts, 2):
+            candidate = prefix + (a, b)
+            if all(candidate[:i] + candidate[i+1:] in valid
+                   for i in range(len(prefix))):
+                yield candidate
+
+
+def find_obstructions(D, max_size=None, all_sizes=False):
+    """Minimal subsets of items whose restriction is not an R matrix.
+    
+    Parameters
+    ----------
+    D : 2-dimensional numpy array
+        A distance matrix.
+    max_size : int, optional
+        Maximal size of the obstructions. The default is None, in which case
+        subsets of up to all items are considered.
+    all_sizes : bool, optional
+        If True, the search continues with larger subsets after obstructions
+        were found, i.e., all minimal obstructions up to `max_size` are
+        returned. The default is False, in which case only the smallest
+        obstructions are returned.
+    
+    Returns
+    -------
+    list of tuple
+        The obstructions (sorted tuples of items) ordered by size. An empty
+        list if D is an R matrix (or has no obstruction of at most
+        `max_size` items). Note that in this case subsets of all sizes
+        were recognized, so it is advisable to call recognize() first.
+    """
+    
+    n = D.shape[0]
+    max_size = n if max_size is None else min(max_size, n)
+    
+    obstructions = []
+    valid = None
+    
+    for k in range(1, max_size+1):
+        
+        if k == 1:
+            found = _singleton_level(D)
+            subsets = [(i,) for i in range(n)]
+        elif k == 2:
+            found = _pair_level(D, valid)
+            subsets = _candidates(valid)
+        elif k == 3:
+            found = _triple_level(D, valid)
+            subsets = _candidates(valid)
+        elif k == 4:
+            found = _quadruple_level(D, valid)
+            subsets = _candidates(valid)
+        else:
+            found = []
+            subsets = list(_candidates(valid))
+            for s in subsets:
+                if not _is_R_matrix(D[np.ix_(s, s)]):
+                    found.append(s)
+        
+        obstructions.extend(found)
+        if found and not all_sizes:
+            break
+        
+        found = set(found)
+        valid = {s for s in subsets if s not in found}
+        if not valid:
+            break
+    
+    return obstructions
+
+
+def _perturb(D, noise):
+    
+    n = D.shape[0]
+    factors = np.triu(1.0 + noise * np.random.uniform(-1.0, 1.0, (n, n)), 1)
+    
+    return D * (factors + factors.T)
+
+
+def obstructions_for_seed(N, seed, noise=0.0, max_size=None,
+                          all_sizes=False, **sim_params):
+    """Simulate a scenario and search obstructions in its matrix.
+    
+    Parameters
+    ----------
+    N : int
+        Number of items.
+    seed : int
+        Seed passed to np.random.seed() before the simulation.
+    noise : float, optional
+        If positive, every distance is multiplied by an independent factor
+        drawn uniformly from [1-noise, 1+noise] after the simulation. The
+        default is 0.0.
+    max_size : int, optional
+        See find_obstructions(). The default is None.
+    all_sizes : bool, optional
+        See find_obstructions(). The default is False.
+    sim_params : keyword arguments
+        Parameters of simulation.simulate().
+    
+    Returns
+    -------
+    dict
+        The seed, whether the matrix is recognized as an R matrix, the
+        obstructions (empty if it is recognized) and the run time.
+    """
+    
+    start = time.perf_counter()
+    
+    np.random.seed(seed)
+    D = simulate(N, **sim_params).D
+    if noise:
+        D = _perturb(D, noise)
+    
+    recognized = recognize(D).successes > 0
+    obstructions = ([] if recognized else
+                    find_obstructions(D, max_size=max_size,
+                                      all_sizes=all_sizes))
+    
+    return {'seed': seed,
+            'recognized': recognized,
+            'obstruction_size': (min(len(s) for s in obstructions)
+                                 if obstructions else None),
+            'obstructions': [list(s) for s in obstructions],
+            'time': time.perf_counter() - start}
@@ -1,14 +1,28 @@
 # -*- coding: utf-8 -*-
 
-from itertools import combinations, permutations
+from itertools import combinations, islice, permutations
+from time import perf_counter
 import numpy as np
 
 from erdbeermet.tools.Tree import Tree, TreeNode
+from erdbeermet.tools.Stats import RecognitionStats
+from erdbeermet.tools.CircularOrder import infer_circular_order
+from erdbeermet.tools.Condensed import (as_square, condense, num_items,
+                                        pair_index, remove_item,
+                                        subtract_from_row,
+                                        satisfies_triangle_inequality,
+                                        first_triangle_violation)
+from erdbeermet.visualize.BoxGraphVis import solve_boxes
 
 
 __author__ = 'David Schaller'
 
 
+# version of the recognition algorithm, to be increased whenever a change
+# may alter the resulting recognition trees (used by tools.Cache)
+ALGORITHM_VERSION = 3
+
+
 def is_pseudometric(D, rtol=1e-05, atol=1e-08, print_info=False, V=None,
                     return_info=False):
     """Check whether a given distance matrix is a pseudometric.
@@ -16,7 +30,9 @@ def is_pseudometric(D, rtol=1e-05, atol=1e-08, print_info=False, V=None,
     Parameters
     ----------
     D : 2-dimensional numpy array
-        Distance matrix
+        Distance matrix, or its condensed form (1-dimensional array, see
+        tools.Condensed), in which case only the non-negativity and the
+        triangle inequality have to be checked.
     rtol : float, optional
         Relative tolerance for equality. The default is 1e-05.
     atol : float, optional
@@ -36,6 +52,10 @@ def is_pseudometric(D, rtol=1e-05, atol=1e-08, print_info=False, V=None,
         True if D is a pseudometric and optionally an info string.
     """
     
+    if D.ndim == 1:
+        return _is_condensed_pseudometric(D, rtol, atol, print_info, V,
+                                          return_info)
+    
     N = D.shape[0]
     
     # check whether all entries are non-negative
@@ -52,6 +72,9 @@ def is_pseudometric(D, rtol=1e-05, atol=1e-08, print_info=False, V=None,
         return False if not return_info else (False, 'not symmetric')
     
     # check the triangle inequality
+    if not (print_info or return_info):
+        return satisfies_triangle_inequality(D, rtol=rtol, atol=atol)
+    
     for i in range(N-1):
         for j in range(i+1, N):
             minimum = np.min(D[i, :] + D[:, j])
@@ -59,19 +82,50 @@ def is_pseudometric(D, rtol=1e-05, atol=1e-08, print_info=False, V=None,
                                                     rtol=rtol, atol=atol):
                 if print_info or return_info:
                     argmin = np.argmin(D[i, :] + D[:, j])
-                    if not V:
-                        info = f'triangle inequality violation: D[{i},'\
-                               f'{j}]={D[i,j]} > {minimum} over {argmin}'
-                    else:
-                        info = f'triangle inequality violation: D[v{V[i]},'\
-                               f'v{V[j]}]={D[i,j]} > {minimum} over v{V[argmin]}'
-                        if print_info:
-                            print(info)
+                    info = _triangle_info(i, j, D[i, j], minimum, argmin,
+                                          V, print_info)
                 return False if not return_info else (False, info)
             
     return True if not return_info else (True, 'passed')
 
 
+def _triangle_info(i, j, d_ij, minimum, argmin, V, print_info):
+    
+    if not V:
+        return f'triangle inequality violation: D[{i},'\
+               f'{j}]={d_ij} > {minimum} over {argmin}'
+    
+    info = f'triangle inequality violation: D[v{V[i]},'\
+           f'v{V[j]}]={d_ij} > {minimum} over v{V[argmin]}'
+    if print_info:
+        print(info)
+    
+    return info
+
+
+def _is_condensed_pseudometric(C, rtol, atol, print_info, V, return_info):
+    
+    N = num_items(C)
+    
+    # check whether all entries are non-negative
+    if not np.all(np.logical_or(np.isclose(C, 0.0, rtol=rtol, atol=atol),
+                                C > 0.0)):
+        return False if not return_info else (False, 'negative distances')
+    
+    # check the triangle inequality (all pairs at once for every detour)
+    if not (print_info or return_info):
+        return satisfies_triangle_inequality(C, N, rtol=rtol, atol=atol)
+    
+    violation = first_triangle_violation(C, N, rtol=rtol, atol=atol)
+    if violation is not None:
+        i, j, minimum, argmin = violation
+        info = _triangle_info(i, j, C[pair_index(N, i, j)], minimum, argmin,
+                              V, print_info)
+        return False if not return_info else (False, info)
+    
+    return True if not return_info else (True, 'passed')
+
+
 def distance_sums_matrix(D, x, y, z, u):
     
     xy_zu = D[x,y] + D[z,u]
@@ -129,6 +183,109 @@ def recognize4_matrix_only(D):
     return recognize4_new(D, 0, 1, 2, 3)
 
 
+# the six pairs of a quadruple in the order xy, xz, xu, yz, yu, zu
+_PAIRS = list(combinations(range(4), 2))
+
+
+def _quadruple_chunks(n, chunk_size):
+    
+    quadruples = combinations(range(n), 4)
+    
+    while True:
+        chunk = np.array(list(islice(quadruples, chunk_size)),
+                         dtype=np.int32).reshape((-1, 4))
+        if chunk.shape[0] == 0:
+            break
+        yield chunk
+
+
+def _profile_chunk(D, Q, rtol=1e-05, atol=1e-08):
+    """R-map test and box graphs for the quadruples in the rows of Q."""
+    
+    B = np.stack([D[Q[:, i], Q[:, j]] for i, j in _PAIRS], axis=1)
+    
+    # non-negativity
+    pseudometric = np.all(np.isclose(B, 0.0, rtol=rtol, atol=atol) | (B > 0.0),
+                          axis=1)
+    
+    # triangle inequality D[i,j] <= D[i,k] + D[k,j] for every pair and k
+    pair_index = {pair: col for col, pair in enumerate(_PAIRS)}
+    for (i, j), col in pair_index.items():
+        for k in range(4):
+            if k in (i, j):
+                continue
+            detour = (B[:, pair_index[tuple(sorted((i, k)))]] +
+                      B[:, pair_index[tuple(sorted((k, j)))]])
+            pseudometric &= ((B[:, col] <= detour) |
+                             np.isclose(detour, B[:, col],
+                                        rtol=rtol, atol=atol))
+    
+    modes, params, r_metric = solve_boxes(B)
+    
+    return pseudometric & r_metric, modes, params
+
+
+def four_point_profile(D, chunk_size=100000, params=True):
+    """Four-point profile of a distance matrix.
+    
+    Determines for every quadruple of items whether the restriction of D is
+    a pseudometric R-map (cf. recognize4_new() and Box4.is_R_metric()), and
+    its box graph. The quadruples are processed in vectorized chunks. D is
+    assumed to be symmetric.
+    
+    Parameters
+    ----------
+    D : 2-dimensional numpy array
+        Distance matrix.
+    chunk_size : int, optional
+        Number of quadruples processed at once. The default is 100000.
+    params : bool, optional
+        If True (default), the box parameters are returned as well.
+    
+    Returns
+    -------
+    quadruples : numpy array of shape (C(n,4), 4)
+        The quadruples (x, y, z, u) in lexicographic order.
+    r_map : numpy array of shape (C(n,4),)
+        Boolean array indicating whether the quadruples are R-maps.
+    modes : numpy array of shape (C(n,4),)
+        The diagonal modes of the box graphs (see BoxGraphVis.solve_boxes).
+    params : numpy array of shape (C(n,4), 6) or None
+        The box parameters dx, dy, dz, du, r, s (see
+        BoxGraphVis.solve_boxes); None if the parameter `params` is False.
+    """
+    
+    results = [[], [], [], []]
+    
+    for Q in _quadruple_chunks(D.shape[0], chunk_size):
+        r_map, modes, box_params = _profile_chunk(D, Q)
+        results[0].append(Q)
+        results[1].append(r_map)
+        results[2].append(modes.astype(np.int8))
+        if params:
+            results[3].append(box_params)
+    
+    if not results[0]:
+        return (np.zeros((0, 4), dtype=np.int32), np.zeros((0,), dtype=bool),
+                np.zeros((0,), dtype=np.int8),
+                np.zeros((0, 6)) if params else None)
+    
+    return (np.concatenate(results[0]), np.concatenate(results[1]),
+            np.concatenate(results[2]),
+            np.concatenate(results[3]) if params else None)
+
+
+def _first_non_R_quadruple(D, chunk_size=100000):
+    """First quadruple that is not an R-map or None if there is none."""
+    
+    for Q in _quadruple_chunks(D.shape[0], chunk_size):
+        r_map, _, _ = _profile_chunk(D, Q)
+        if not np.all(r_map):
+            return tuple(Q[np.argmin(r_map)].tolist())
+    
+    return None
+
+
 def _compute_delta_x(alpha, xz, d_xy, delta_z):
     
     return xz - (1-alpha) * d_xy - delta_z
@@ -192,14 +349,17 @@ def _compute_alpha(V, D, x, y, z, u, v):
         return np.nan
 
     
-def _find_candidates(D, V, print_info):
+def _find_candidates(D, V, print_info, triples=None):
     
     candidates = []
     n = len(V)
     
     if print_info: print(f'-----> n = {n}, V = {V} ---> Candidates')
     
-    for x, y, z in permutations(V, 3):
+    if triples is None:
+        triples = permutations(V, 3)
+    
+    for x, y, z in triples:
         
         # considering x < y suffices
         if x > y:
@@ -228,9 +388,10 @@ def _find_candidates(D, V, print_info):
             
             if alpha[0] >= 0.0 and alpha[0] <= 1.0:
                 candidates.append((x, y, z, u_witness, alpha[0]))
-                deltas = _compute_deltas(V, D, alpha[0], x, y, z, u_witness)
                 
                 if print_info: 
+                    deltas = _compute_deltas(V, D, alpha[0], x, y, z,
+                                             u_witness)
                     print(f'({x}, {y}: {z}) alpha={alpha}', end='   ')
                     print('δx = {:.3f}, δy = {:.3f}, '\
                           'δz = {:.3f}, dxy = {:.3f}'.format(deltas[2],
@@ -260,6 +421,38 @@ def _find_candidates(D, V, print_info):
     return candidates
 
 
+def _circular_triples(order):
+    """Triples (x, y, z) such that x and y are the neighbors of z.
+    
+    If the matrix is of circular type with the given circular order, only
+    neighbors of z can be its parents in the last R-step. The triples are
+    sorted in the same order in which _find_candidates() processes them
+    otherwise.
+    """
+    
+    n = len(order)
+    triples = []
+    
+    for i, z in enumerate(order):
+        x, y = order[i-1], order[(i+1) % n]
+        triples.append((min(x, y), max(x, y), z))
+    
+    triples.sort()
+    
+    return triples
+
+
+def _check_circular_order(circular_order, n):
+    
+    order = [int(i) for i in circular_order]
+    
+    if sorted(order) != list(range(n)):
+        raise ValueError('circular order must be a permutation of the '
+                         f'{n} items')
+    
+    return order
+
+
 def _compute_deltas(V, D, alpha, x, y, z, u):
     
     x = V.index(x)
@@ -280,172 +473,766 @@ def _compute_deltas(V, D, alpha, x, y, z, u):
     return delta_z, d_xy, delta_x, delta_y
 
 
+def _subtract_from_item(D, n, i, delta):
+    
+    if D.ndim == 1:
+        subtract_from_row(D, n, i, delta)
+    else:
+        D[:, i] -= delta
+        D[i, :] -= delta
+        D[i, i] = 0.0
+
+
 def _update_matrix(V, D, x, y, delta_x, delta_y):
+    """Subtract the deltas from the distances of x and y in the square or
+    condensed matrix D (in place)."""
     
-    x = V.index(x)
-    y = V.index(y)
+    n = len(V)
     
     if delta_x:             # if not 0.0
-        D[:, x] -= delta_x
-        D[x, :] -= delta_x
-        D[x, x] = 0.0
+        _subtract_from_item(D, n, V.index(x), delta_x)
     
     if delta_y:             # if not 0.0
-        D[:, y] -= delta_y
-        D[y, :] -= delta_y
-        D[y, y] = 0.0
+        _subtract_from_item(D, n, V.index(y), delta_y)
         
         
-def _matrix_without_index(D, index):
+def _matrix_without_index(D, n, index):
     
-    n = D.shape[0]
+    if D.ndim == 1:
+        return remove_item(D, n, index)
     
     if index < 0 or index >= n:
         raise IndexError(f"Index {index} is out of range!")
     
-    D_new = np.zeros((n-1, n-1))
+    keep = np.arange(n) != index
     
-    indices = [i for i in range(n) if i != index]
+    return D[np.ix_(keep, keep)]
+
+
+def _node_matrix(D, n, condensed):
+    """The distance matrix of a node in the requested form."""
     
-    for i in range(n-1):
-        for j in range(n-1):
-            D_new[i, j] = D[indices[i], indices[j]]
+    if condensed:
+        return D if D.ndim == 1 else condense(D)
     
-    return D_new
+    return as_square(D, n)
 
 
-def _finalize_tree(recognition_tree):
+def _add_child(parent, child):
+    """Insert the child such that the children remain sorted by R-step."""
     
-    def _sort_children(v):
-        v.children.sort(key=lambda c: c.R_step)
-        for c in v.children:
-            _sort_children(c)
+    children = parent.children
     
-    for v in recognition_tree.postorder():
-        if v.valid_ways and v.parent:
-            v.parent.valid_ways += v.valid_ways
-            
+    # the candidates are usually found in sorted order, i.e., this is an
+    # append in almost all cases
+    i = len(children)
+    while i > 0 and children[i-1].R_step > child.R_step:
+        i -= 1
+    
+    children.insert(i, child)
+    child.parent = parent
+
+
+def _add_success(v):
+    """Count a successful recognition path in v and all its ancestors."""
+    
+    while v is not None:
+        v.valid_ways += 1
+        v = v.parent
+
+
+def _complete_subtree(v, pending, writer):
+    """Mark the subtree of v as completed and continue with its ancestors.
+    
+    Every node whose subtree is completed is handed to the writer (if any).
+    """
+    
+    while v is not None:
+        
+        if writer is not None:
+            writer.write_node(v)
+        
+        parent = v.parent
+        if parent is None:
+            break
+        
+        pending[parent] -= 1
+        if pending[parent]:
+            break
+        
+        del pending[parent]
+        v = parent
+
+
+def _finalize_tree(recognition_tree, exhaustive=True):
+    
+    # the success counts were already propagated and the children inserted
+    # in sorted order during the search
     recognition_tree.valid_ways = recognition_tree.root.valid_ways
     recognition_tree.successes = recognition_tree.root.valid_ways
-            
-    _sort_children(recognition_tree.root)
+    recognition_tree.exhaustive = exhaustive
     
     
-def recognize(D, first_candidate_only=False, print_info=False):
+def recognize(D, first_candidate_only=False, print_info=False, writer=None,
+              cache=None, four_point_filter=False, stats=False,
+              circular_order=None, beam_width=None, beam_score='margin',
+              max_nodes=None, time_limit=None, max_bytes=None,
+              condensed=None):
     """Recognition of type R matrices.
     
     Parameters
     ----------
     D : 2-dimensional numpy array
-        A distance matrix.
+        A distance matrix, or its condensed form (1-dimensional array of the
+        entries above the diagonal, see tools.Condensed).
     first_candidate_only : bool, optional
         If True, only consider the first found candidate for a merge event.
         The default is False.
     print_info : bool, True
         If True, print the recognition history. The default is False.
+    writer : tools.FileIO.RecognitionWriter, optional
+        If given, every node is passed to `writer.write_node()` as soon as
+        its subtree is completed (i.e., in postorder). The writer is not
+        closed by this function. Since successes are counted in all
+        ancestors as soon as they are found, `valid_ways` of every node
+        (in particular the root) is the running number of successful paths
+        found so far. The default is None.
+    cache : tools.Cache.RecognitionCache, optional
+        If given, the result is looked up in (and afterwards added to) this
+        persistent cache. On a hit, the cached tree is returned directly
+        (which only contains an accepting path unless the cache stores
+        complete trees) and `print_info` and `writer` have no effect. The
+        default is None.
+    four_point_filter : bool, optional
+        If True, first check whether the restrictions of D to all
+        quadruples of items are R-maps (see four_point_profile()), which is
+        necessary for D to be an R matrix, and reject D without the search
+        otherwise. The default is False.
+    stats : bool or tools.Stats.RecognitionStats, optional
+        If True, counters and the cumulative time per phase of the algorithm
+        are collected in a RecognitionStats instance which is attached to
+        the returned tree as attribute `stats`. An existing instance can be
+        passed to accumulate the numbers over several calls. The default is
+        False, in which case `stats` of the tree is None.
+    circular_order : list or bool, optional
+        A circular order of the items 0, ..., n-1 (e.g. from
+        `Scenario.get_circular_order()`). If given, D is assumed to be a
+        circular type R matrix w.r.t. this order, and only the two
+        neighbors of z in the (remaining) circular order are considered as
+        parents x and y of a candidate (x, y: z), i.e., only n instead of
+        n(n-1)(n-2)/2 triples per node. The order is maintained as items
+        are removed, and the search is not exhaustive (i.e., a failure is
+        only conclusive w.r.t. this order). If True, a circular order is
+        inferred heuristically (see
+        tools.CircularOrder.infer_circular_order()); if no Kalmanson order
+        is found or the restricted search does not succeed, the
+        unrestricted search is run instead (and the nodes are only passed
+        to the writer once the final tree is known, the statistics of the
+        discarded search are kept apart in `stats.restricted`). Hence, the
+        returned tree is only exhaustive if it stems from the unrestricted
+        search. The default is None, in which case all triples are
+        considered.
+    beam_width : int, optional
+        If given, the search proceeds level by level and only the
+        `beam_width` best children (according to `beam_score`) of all
+        nodes of a level are expanded further; the other ones are marked
+        as 'pruned'. This bounds the number of expanded nodes by
+        beam_width * (n-4) + 1. Cannot be combined with
+        `first_candidate_only`. The default is None (no beam search).
+    beam_score : str, optional
+        Score of the candidates in the beam search: 'margin' (default) for
+        the minimum of the deltas and dxy, i.e., the margin to negative
+        distances, or 'dispersion' for the (negated) spread of alpha over
+        all witness pairs.
+    max_nodes : int, optional
+        Maximal number of nodes expanded by the (depth-first) search. The
+        default is None (no limit).
+    time_limit : float, optional
+        Maximal wall-clock time of the call in seconds, i.e., a single
+        deadline for the restricted search and the unrestricted fallback of
+        `circular_order=True`. The default is None (no limit).
+    max_bytes : int, optional
+        Maximal total size of the distance matrices held in the recognition
+        tree. The default is None (no limit).
+    condensed : bool, optional
+        If True, the distance matrices of the nodes are stored in condensed
+        form, which halves the memory of the recognition tree (the
+        candidate search still uses a square copy of the matrix of every
+        expanded node). The default is None, in which case the form of D
+        is kept.
     
     Returns
     -------
     Tree
-        The recognition tree.
+        The recognition tree. Its attribute `exhaustive` is False if
+        candidates were skipped (due to `first_candidate_only`,
+        `beam_width` or `circular_order`), in which case a recognition tree
+        without successes does not imply that D is not an R matrix. If one
+        of the budgets `max_nodes`, `time_limit` or `max_bytes` was
+        exceeded, the attribute `complete` is False, the success counts
+        only refer to the part searched so far, and the attribute
+        `checkpoint` holds the state of the search (saved together with the
+        tree by Tree.save()), which can be continued with
+        resume_recognition().
     
     See also
     --------
     tools.Tree
     """
     
-    n = D.shape[0]
-    V = [i for i in range(n)]
+    if beam_width is not None:
+        if first_candidate_only:
+            raise ValueError("'beam_width' cannot be combined with "
+                             "'first_candidate_only'")
+        if beam_width < 1:
+            raise ValueError(f'beam width must be positive: {beam_width}')
+        if beam_score not in ('margin', 'dispersion'):
+            raise ValueError(f"unknown beam score '{beam_score}'")
+    
+    budget = None
+    if (max_nodes, time_limit, max_bytes) != (None, None, None):
+        if beam_width is not None:
+            raise ValueError("budgets cannot be combined with 'beam_width'")
+        budget = _budget(max_nodes, time_limit, max_bytes)
+    
+    if circular_order is not None and circular_order is not True:
+        circular_order = _check_circular_order(circular_order, num_items(D))
+    
+    if condensed is None:
+        condensed = (D.ndim == 1)
+    
+    if cache is not None:
+        cache_key = cache.key(D, first_candidate_only=first_candidate_only,
+                              four_point_filter=four_point_filter,
+                              circular_order=circular_order,
+                              beam_width=beam_width,
+                              beam_score=(beam_score if beam_width is not None
+                                          else None),
+                              condensed=condensed,
+                              rtol=1e-05, atol=1e-08,
+                              version=ALGORITHM_VERSION)
+        cached_tree = cache.get(cache_key)
+        if cached_tree is not None:
+            return cached_tree
+    
+    if stats is True:
+        stats = RecognitionStats()
+    elif stats is False:
+        stats = None
+    
+    recognition_tree = None
+    
+    if circular_order is True:
+        circular_order = infer_circular_order(as_square(D))
+        
+        if circular_order is not None:
+            # the numbers of the restricted search are kept apart until it
+            # is clear whether its tree is returned
+            restricted_stats = (RecognitionStats() if stats is not None
+                                else None)
+            recognition_tree = _recognize(D, first_candidate_only,
+                                          print_info, None,
+                                          four_point_filter, restricted_stats,
+                                          circular_order,
+                                          beam_width=beam_width,
+                                          beam_score=beam_score,
+                                          budget=budget, condensed=condensed)
+            
+            # fall back to the unrestricted search unless D was rejected
+            # independently of the circular order (or the search was
+            # interrupted)
+            if (recognition_tree.complete and
+                not recognition_tree.successes and
+                recognition_tree.root.info not in ('no pseudometric',
+                                                   'no R-map on quadruple')):
+                if print_info: print('circular order inconsistent')
+                recognition_tree = None
+                if stats is not None:
+                    stats.discard_restricted(restricted_stats)
+            else:
+                if stats is not None:
+                    stats.merge(restricted_stats)
+                    recognition_tree.stats = stats
+                if writer is not None:
+                    for v in recognition_tree.postorder():
+                        writer.write_node(v)
+        
+        elif print_info:
+            print('no circular order found')
+        
+        if recognition_tree is None:
+            circular_order = None
     
-    recognition_tree = Tree(TreeNode(n, V, D=D))
-    stack = []
+    if recognition_tree is None:
+        recognition_tree = _recognize(D, first_candidate_only, print_info,
+                                      writer, four_point_filter, stats,
+                                      circular_order, beam_width=beam_width,
+                                      beam_score=beam_score, budget=budget,
+                                      condensed=condensed)
+    
+    if cache is not None and recognition_tree.complete:
+        cache.put(cache_key, recognition_tree)
+    
+    return recognition_tree
+
+
+def _check_root(root, print_info, four_point_filter, stats):
+    """Checks of the input matrix; returns True if the search is required.
+    """
+    
+    D, V, n = root.D, root.V, root.n
+    
+    if stats is not None: t = stats.start()
+    root_metric = is_pseudometric(D)
+    if stats is not None: t = stats.lap('pseudometric', t)
+    
+    non_R_quadruple = None
+    if root_metric and four_point_filter and n > 4:
+        non_R_quadruple = _first_non_R_quadruple(as_square(D, n))
+        if stats is not None: t = stats.lap('four_point_filter', t)
     
     # trivial failure if not a pseudometric
-    if not is_pseudometric(D):
+    if not root_metric:
         if print_info: print('no pseudometric')
-        recognition_tree.root.info = 'no pseudometric'
+        root.info = 'no pseudometric'
+    
+    # necessary condition: all restrictions to four items are R-maps
+    elif non_R_quadruple is not None:
+        if print_info: print(f'NO R-MAP on quadruple {non_R_quadruple}')
+        root.info = 'no R-map on quadruple'
     
     # every pseudometric is additve and thus also an R matrix
     elif n <= 3:
         if print_info: print(print(f'SUCCESS on {V}'))
-        recognition_tree.root.valid_ways = 1
+        root.valid_ways = 1
     
     # otherwise start the recognition algorithm
     else:
-        stack.append(recognition_tree.root)
+        return True
+    
+    if stats is not None:
+        if root.info:
+            stats.rejected(root.info)
+        stats.successes += root.valid_ways
+    
+    return False
+
+
+def _valid_children(parent, S, candidates, print_info, writer, stats):
+    """Generator for the children of a node that pass all checks.
+    
+    A child is added to the parent for every candidate. Children with
+    negative deltas or without a pseudometric are marked and handed to the
+    writer (if any), the others are yielded together with their deltas.
+    Since the children are created lazily, the caller may stop early.
+    S is the square form of the distance matrix of the parent, the matrices
+    of the children are computed in the form of the parent's matrix.
+    """
+    
+    V, D = parent.V, parent.D
+    n = len(V)
+    
+    for x, y, z, u_witness, alpha in candidates:
+        
+        V_copy = V.copy()
+        V_copy.remove(z)
+        
+        child = TreeNode(n-1, V_copy, R_step=(x, y, z, alpha))
+        _add_child(parent, child)
+        
+        if stats is not None: t = stats.start()
+        deltas = _compute_deltas(V, S, alpha, x, y, z, u_witness)
+        if stats is not None: t = stats.lap('deltas', t)
+        
+        if print_info:
+            print('({}, {}: {}) alpha={:.5f}'.format(x, y, z, alpha),
+                  end='   ')
+            print('δx = {:.3f}, δy = {:.3f}, '\
+                  'δz = {:.3f}, dxy = {:.3f}'.format(deltas[2],
+                                                     deltas[3],
+                                                     deltas[0],
+                                                     deltas[1]))
+        
+        if not _all_non_negative(deltas):
+            if print_info: print('         |___ negative δ/dxy')
+            child.info = 'negative delta/dxy'
+            if stats is not None: stats.rejected(child.info)
+            if writer is not None:
+                writer.write_node(child)
+            continue
+        
+        child.D = _matrix_without_index(D, n, V.index(z))
+        _update_matrix(V_copy, child.D, x, y, deltas[2], deltas[3])
+        if stats is not None: t = stats.lap('matrix_copy', t)
+        
+        # the info string is only built if it is printed
+        if print_info:
+            still_metric, metric_info = is_pseudometric(
+                                            child.D, return_info=True,
+                                            V=V_copy)
+        else:
+            still_metric = is_pseudometric(child.D)
+        if stats is not None: t = stats.lap('pseudometric', t)
+        
+        if not still_metric:
+            if print_info: print( '         |___ no pseudometric')
+            if print_info: print(f'         |___ {metric_info}')
+            child.info = 'no pseudometric'
+            if stats is not None:
+                stats.stored(child.D)
+                stats.rejected(child.info)
+            if writer is not None:
+                writer.write_node(child)
+            continue
+        
+        yield child, deltas
+
+
+def _test_leaf(parent, print_info, stats):
+    """R-map test for a node on four items."""
+    
+    V, D = parent.V, parent.D
+    
+    if print_info: print(f'-----> n = {len(V)} R-map test')
+    if stats is not None: t = stats.start()
+    r_map = recognize4_matrix_only(as_square(D, len(V)))
+    if stats is not None: t = stats.lap('four_point', t)
+    
+    if r_map:
+        if print_info: print(f'SUCCESS on {V}')
+        _add_success(parent)
+        if stats is not None: stats.successes += 1
+    else:
+        if print_info: print(f'NO R-MAP on {V}')
+        parent.info = 'spikes too short'
+        if stats is not None: stats.rejected(parent.info)
+
+
+def _recognize(D, first_candidate_only, print_info, writer,
+               four_point_filter, stats, circular_order, beam_width=None,
+               beam_score='margin', budget=None, condensed=False):
+    """Depth-first search for recognition paths (see recognize())."""
+    
+    if beam_width is not None:
+        return _recognize_beam(D, beam_width, beam_score, print_info, writer,
+                               four_point_filter, stats, circular_order,
+                               condensed)
+    
+    n = num_items(D)
+    V = [i for i in range(n)]
+    
+    recognition_tree = Tree(TreeNode(n, V, D=D))
+    recognition_tree.stats = stats
+    
+    # the state of the search is kept in a dict that can be stored as a
+    # checkpoint if the search is interrupted:
+    # stack - nodes that still have to be expanded
+    # pending - number of stacked children whose subtree is not completed
+    # orders - remaining circular orders of the stacked nodes
+    state = {'stack': [], 'pending': {}, 'orders': {},
+             'first_candidate_only': first_candidate_only}
+    
+    search = _check_root(recognition_tree.root, print_info,
+                         four_point_filter, stats)
+    recognition_tree.root.D = _node_matrix(D, n, condensed)
+    
+    if search:
+        state['stack'].append(recognition_tree.root)
+        if stats is not None: stats.stacked(recognition_tree.root.D)
+        if circular_order is not None:
+            state['orders'][recognition_tree.root] = circular_order
+    else:
+        _complete_subtree(recognition_tree.root, state['pending'], writer)
+    
+    return _depth_first_search(recognition_tree, state, print_info, writer,
+                               stats, budget)
+
+
+def _budget(max_nodes, time_limit, max_bytes):
+    
+    # the time limit is converted into a deadline, which is shared by all
+    # searches of a call (e.g. the fallback of circular_order=True)
+    deadline = perf_counter() + time_limit if time_limit is not None else None
+    
+    return (max_nodes, deadline, max_bytes)
+
+
+def _budget_exceeded(budget, expanded, matrix_bytes):
+    
+    if budget is None:
+        return False
     
+    max_nodes, deadline, max_bytes = budget
+    
+    return ((max_nodes is not None and expanded >= max_nodes) or
+            (deadline is not None and perf_counter() >= deadline) or
+            (max_bytes is not None and matrix_bytes > max_bytes))
+
+
+def _depth_first_search(recognition_tree, state, print_info, writer, stats,
+                        budget):
+    """Run (or continue) the depth-first search until the stack is empty or
+    the budget (max_nodes, deadline, max_bytes) is exceeded.
+    """
+    
+    stack, pending, orders = state['stack'], state['pending'], state['orders']
+    first_candidate_only = state['first_candidate_only']
+    
+    root_n = recognition_tree.root.n
+    expanded = 0
+    matrix_bytes = 0
+    if budget is not None and budget[2] is not None:
+        matrix_bytes = sum(v.D.nbytes for v in recognition_tree.preorder()
+                           if v.D is not None)
     
     while stack:
         
+        if _budget_exceeded(budget, expanded, matrix_bytes):
+            if print_info: print('BUDGET EXCEEDED')
+            break
+        
         parent = stack.pop()
         V, D = parent.V, parent.D
         n = len(V)
+        expanded += 1
         
-        if n > 4:
+        if stats is not None:
+            stats.popped(D)
+            stats.expanded(root_n - n)
         
-            candidates = _find_candidates(D, V, print_info)
+        order = orders.pop(parent, None)
+        
+        if n > 4:
+            
+            if stats is not None: t = stats.start()
+            S = as_square(D, n)
+            triples = _circular_triples(order) if order is not None else None
+            candidates = _find_candidates(S, V, print_info, triples=triples)
+            if stats is not None: t = stats.lap('candidates', t)
+            
+            # the triples that do not fit the circular order are skipped
+            if order is not None:
+                recognition_tree.exhaustive = False
             
             found_valid = False
+            stacked = 0
             
             if print_info: 
                 print(f'-----> n = {n}, V = {V} ---> R-steps actually carried out')
-            for x, y, z, u_witness, alpha in candidates:
-                
-                V_copy = V.copy()
-                V_copy.remove(z)
-                
-                child = TreeNode(n-1, V_copy, R_step=(x, y, z, alpha))
-                parent.add_child(child)
-                
-                deltas = _compute_deltas(V, D, alpha, x, y, z, u_witness)
-                
-                if print_info:
-                    print('({}, {}: {}) alpha={:.5f}'.format(x, y, z, alpha),
-                          end='   ')
-                    print('δx = {:.3f}, δy = {:.3f}, '\
-                          'δz = {:.3f}, dxy = {:.3f}'.format(deltas[2],
-                                                             deltas[3],
-                                                             deltas[0],
-                                                             deltas[1]))
-                
-                if not _all_non_negative(deltas):
-                    if print_info: print('         |___ negative δ/dxy')
-                    child.info = 'negative delta/dxy'
-                    continue
-                
-                D_copy = _matrix_without_index(D, V.index(z))
-                _update_matrix(V_copy, D_copy, x, y, deltas[2], deltas[3])
-                child.D = D_copy
-                
-                still_metric, metric_info = is_pseudometric(D_copy,
-                                                            return_info=True,
-                                                            V=V_copy)
-                
-                if not still_metric:
-                    if print_info: print( '         |___ no pseudometric')
-                    if print_info: print(f'         |___ {metric_info}')
-                    child.info = 'no pseudometric'
-                    continue
+            for child, _ in _valid_children(parent, S, candidates,
+                                            print_info, writer, stats):
                 
                 found_valid = True
-                if print_info: print(f'         |___ STACKED {V_copy}')
+                if print_info: print(f'         |___ STACKED {child.V}')
                 stack.append(child)
+                stacked += 1
+                if order is not None:
+                    z = child.R_step[2]
+                    orders[child] = [i for i in order if i != z]
+                if stats is not None: stats.stacked(child.D)
                 
                 # for n = 5 always check all candidates
                 if first_candidate_only and n > 5:
+                    if len(parent.children) < len(candidates):
+                        recognition_tree.exhaustive = False
                     break
                 
             if not candidates or not found_valid:
                 parent.info = 'no candidate'
+                if stats is not None: stats.rejected(parent.info)
+            
+            if budget is not None:
+                matrix_bytes += sum(child.D.nbytes
+                                    for child in parent.children
+                                    if child.D is not None)
+            
+            if stacked:
+                pending[parent] = stacked
+            else:
+                _complete_subtree(parent, pending, writer)
                 
         else:
-            if print_info: print(f'-----> n = {n} R-map test')
-            if recognize4_matrix_only(D):
-                if print_info: print(f'SUCCESS on {V}')
-                parent.valid_ways = 1
-            else:
-                if print_info: print(f'NO R-MAP on {V}')
-                parent.info = 'spikes too short'
+            _test_leaf(parent, print_info, stats)
+            _complete_subtree(parent, pending, writer)
+    
+    if stack:
+        recognition_tree.complete = False
+        recognition_tree.checkpoint = state
+    else:
+        recognition_tree.complete = True
+        recognition_tree.checkpoint = None
+    
+    _finalize_tree(recognition_tree, recognition_tree.exhaustive)
+    
+    return recognition_tree
+
+
+def resume_recognition(recognition_tree, print_info=False, writer=None,
+                       stats=False, max_nodes=None, time_limit=None,
+                       max_bytes=None):
+    """Continue an interrupted recognition.
+    
+    Parameters
+    ----------
+    recognition_tree : Tree
+        An incomplete recognition tree returned by recognize() (or
+        resume_recognition()) because a budget was exceeded, possibly saved
+        with Tree.save() and loaded with Tree.load() in the meantime.
+    print_info : bool, True
+        If True, print the recognition history. The default is False.
+    writer : tools.FileIO.RecognitionWriter, optional
+        If given, every node completed from now on is passed to
+        `writer.write_node()` (see recognize()). The default is None.
+    stats : bool or tools.Stats.RecognitionStats, optional
+        See recognize(). The default is False.
+    max_nodes : int, optional
+        See recognize(). The default is None.
+    time_limit : float, optional
+        See recognize(). The default is None.
+    max_bytes : int, optional
+        See recognize(). The default is None.
+    
+    Returns
+    -------
+    Tree
+        The same recognition tree, extended by the continued search.
+    """
+    
+    if recognition_tree.complete:
+        return recognition_tree
+    
+    if stats is True:
+        stats = RecognitionStats()
+    elif stats is False:
+        stats = None
+    recognition_tree.stats = stats
+    
+    budget = None
+    if (max_nodes, time_limit, max_bytes) != (None, None, None):
+        budget = _budget(max_nodes, time_limit, max_bytes)
+    
+    return _depth_first_search(recognition_tree,
+                               recognition_tree.checkpoint,
+                               print_info, writer, stats, budget)
+
+
+def _alpha_dispersion(D, V, x, y, z):
+    """Spread of the alpha values over all witness pairs of a candidate."""
+    
+    x, y, z = V.index(x), V.index(y), V.index(z)
+    others = np.array([i for i in range(len(V)) if i not in (x, y, z)])
+    u, v = np.triu_indices(len(others), k=1)
+    u, v = others[u], others[v]
+    
+    numerator   = (D[u,z] + D[v,y]) - (D[v,z] + D[u,y])
+    denominator = (D[u,x] + D[v,y]) - (D[v,x] + D[u,y])
+    
+    defined = ~np.isclose(denominator, 0.0)
+    if not np.any(defined):
+        return 0.0
+    
+    return np.ptp(numerator[defined] / denominator[defined])
+
+
+def _recognize_beam(D, beam_width, beam_score, print_info, writer,
+                    four_point_filter, stats, circular_order, condensed):
+    """Level-wise beam search for recognition paths (see recognize())."""
+    
+    n = num_items(D)
+    V = [i for i in range(n)]
+    
+    recognition_tree = Tree(TreeNode(n, V, D=D))
+    recognition_tree.stats = stats
+    level = []
+    orders = {}
+    
+    # becomes False as soon as a valid child is pruned (or candidates are
+    # skipped due to the circular order)
+    exhaustive = True
+    
+    search = _check_root(recognition_tree.root, print_info,
+                         four_point_filter, stats)
+    recognition_tree.root.D = _node_matrix(D, n, condensed)
+    
+    if search:
+        level.append(recognition_tree.root)
+        if stats is not None: stats.stacked(recognition_tree.root.D)
+        if circular_order is not None:
+            orders[recognition_tree.root] = circular_order
+    
+    root_n = n
+    
+    while level:
+        
+        scored_children = []
+        
+        for parent in level:
+            
+            V, D = parent.V, parent.D
+            n = len(V)
+            
+            if stats is not None:
+                stats.popped(D)
+                stats.expanded(root_n - n)
+            
+            order = orders.pop(parent, None)
+            
+            if n <= 4:
+                _test_leaf(parent, print_info, stats)
+                continue
+            
+            if stats is not None: t = stats.start()
+            S = as_square(D, n)
+            triples = _circular_triples(order) if order is not None else None
+            candidates = _find_candidates(S, V, print_info, triples=triples)
+            if stats is not None: t = stats.lap('candidates', t)
+            
+            # the triples that do not fit the circular order are skipped
+            if order is not None:
+                exhaustive = False
+            
+            found_valid = False
+            
+            for child, deltas in _valid_children(parent, S, candidates,
+                                                 print_info, None, stats):
+                
+                found_valid = True
+                x, y, z, _ = child.R_step
+                
+                # larger is better
+                if beam_score == 'margin':
+                    score = min(deltas)
+                else:
+                    score = -_alpha_dispersion(S, V, x, y, z)
+                
+                scored_children.append((score, child))
+                if order is not None:
+                    orders[child] = [i for i in order if i != z]
+                if stats is not None: stats.stacked(child.D)
+            
+            if not found_valid:
+                parent.info = 'no candidate'
+                if stats is not None: stats.rejected(parent.info)
+        
+        # keep the best children (ties in the order of the candidates)
+        scored_children.sort(key=lambda item: -item[0])
+        
+        for _, child in scored_children[beam_width:]:
+            exhaustive = False
+            if print_info: print(f'PRUNED {child}')
+            child.info = 'pruned'
+            orders.pop(child, None)
+            if stats is not None:
+                stats.popped(child.D)
+                stats.rejected(child.info)
+            child.D = None
+        
+        level = [child for _, child in scored_children[:beam_width]]
+    
+    _finalize_tree(recognition_tree, exhaustive)
+    
+    if writer is not None:
+        for v in recognition_tree.postorder():
+            writer.write_node(v)
     
-    _finalize_tree(recognition_tree)    
     return recognition_tree
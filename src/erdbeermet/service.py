@@ -0,0 +1,625 @@
+# -*- coding: utf-8 -*-
+
+"""Local recognition service.
+
+A long-running server keeps a pool of warm worker processes and accepts
+requests on a Unix socket or a localhost TCP port. The protocol consists of
+newline-delimited JSON objects. A request has the form
+    
+    {"id": 1, "op": "recognize", "matrix": [[...], ...], "params": {...},
+     "timeout": 10.0}
+
+(or with "history" instead of "matrix", cf. Scenario.history), or
+    
+    {"id": 2, "op": "simulate", "params": {"N": 10, "seed": 1, ...}},
+
+and the server answers with {"id": ..., "ok": true, "result": {...}} or
+{"id": ..., "ok": false, "error": "..."} (responses may arrive out of
+order). Start the server with
+    
+    python -m erdbeermet.service --socket /tmp/erdbeermet.sock
+
+and use RecognitionClient (asyncio) to send requests.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from erdbeermet.simulation import (Scenario, check_simulation_params,
+                                   simulate)
+from erdbeermet.recognition import recognize
+from erdbeermet.tools.FileIO import history_from_json, history_to_json
+
+
+__author__ = 'David Schaller'
+
+
+# recognition parameters that may be set by a request
+_RECOGNITION_PARAMS = ('first_candidate_only', 'four_point_filter',
+                       'circular_order', 'beam_width', 'beam_score',
+                       'max_nodes', 'max_bytes')
+
+# limit of a single line of the protocol (e.g. a large matrix)
+_LINE_LIMIT = 2**28
+
+
+# --------------------------------------------------------------------------
+#                             worker processes
+# --------------------------------------------------------------------------
+
+def _warm_up():
+    """Initializer of the worker processes."""
+    
+    D = np.array([[0.0, 2.0, 3.0, 3.0, 4.0],
+                  [2.0, 0.0, 3.0, 3.0, 4.0],
+                  [3.0, 3.0, 0.0, 2.0, 3.0],
+                  [3.0, 3.0, 2.0, 0.0, 3.0],
+                  [4.0, 4.0, 3.0, 3.0, 0.0]])
+    recognize(D)
+
+
+def _check_params(params, allowed):
+    
+    for key in params:
+        if key not in allowed:
+            raise ValueError(f"invalid parameter '{key}'")
+
+
+def _handle_recognize(request):
+    
+    params = request.get('params', {})
+    _check_params(params, _RECOGNITION_PARAMS)
+    
+    if 'matrix' in request:
+        D = np.array(request['matrix'], dtype=np.float64)
+    elif 'history' in request:
+        D = Scenario(history_from_json(request['history'])).D
+    else:
+        raise ValueError("recognition request without 'matrix' or 'history'")
+    
+    # the beam search has no time limit, its number of nodes is bounded
+    deadline = request.get('deadline')
+    if deadline is not None and params.get('beam_width') is None:
+        params = dict(params, time_limit=max(0.0, deadline - time.time()))
+    
+    return recognize(D, **params).summary()
+
+
+def _handle_simulate(request):
+    
+    params = dict(request.get('params', {}))
+    seed = params.pop('seed', None)
+    params = check_simulation_params(params)
+    
+    if seed is not None:
+        np.random.seed(seed)
+    scenario = simulate(**params)
+    
+    return {'history': history_to_json(scenario.history),
+            'matrix': scenario.D.tolist(),
+            'circular': scenario.circular}
+
+
+def _handle(request):
+    """Process a single request (in a worker process)."""
+    
+    start = time.perf_counter()
+    
+    try:
+        if request.get('op') == 'recognize':
+            result = _handle_recognize(request)
+        elif request.get('op') == 'simulate':
+            result = _handle_simulate(request)
+        else:
+            raise ValueError(f"unknown operation '{request.get('op')}'")
+    except Exception as e:
+        return {'id': request.get('id'), 'ok': False,
+                'error': f'{type(e).__name__}: {e}'}
+    
+    result['time'] = time.perf_counter() - start
+    
+    return {'id': request.get('id'), 'ok': True, 'result': result}
+
+
+def _handle_batch(requests):
+    """Process a batch of requests (in a worker process)."""
+    
+    return [_handle(request) for request in requests]
+
+
+def _shutdown(executor):
+    """Shut down an executor without waiting for pending tasks."""
+    
+    if sys.version_info >= (3, 9):
+        executor.shutdown(wait=False, cancel_futures=True)
+    else:
+        executor.shutdown(wait=False)
+
+
+# --------------------------------------------------------------------------
+#                                  server
+# --------------------------------------------------------------------------
+
+class RecognitionServer:
+    """Server that runs recognition and simulation requests on a pool of
+    warm worker processes.
+    
+    Requests without a timeout that arrive within `batch_delay` seconds are
+    combined into batches of up to `batch_size` requests, which are
+    processed by one worker. At most `max_pending` requests are accepted at
+    a time; beyond that, the server stops reading from the connections
+    (backpressure).
+    
+    A request may contain a timeout in seconds (measured from its receipt).
+    Such a request is never batched, and the time that remains when a
+    worker starts it is passed to `recognize()` as `time_limit`, which is a
+    single deadline for the whole call (including the fallback of
+    `circular_order=True`), i.e., the worker returns an incomplete result
+    (`complete` is False) and becomes free when it runs out of time. The
+    beam search (`beam_width`) does not support a time limit since its
+    number of nodes is bounded anyway. In any case, if no result is
+    available `grace` seconds after the timeout, the server responds with
+    the error 'timeout'.
+    
+    Parameters
+    ----------
+    path : str, optional
+        Path of a Unix socket. If None (default), a TCP socket on
+        host:port is used.
+    host : str, optional
+        The default is '127.0.0.1'.
+    port : int, optional
+        The default is 8765.
+    workers : int, optional
+        Number of worker processes. The default is None, i.e., the number
+        of processors.
+    batch_size : int, optional
+        Maximal number of requests per batch. The default is 16.
+    batch_delay : float, optional
+        Time in seconds to wait for further requests of a batch. The
+        default is 0.005.
+    max_pending : int, optional
+        Maximal number of accepted requests without response. The default
+        is 256.
+    grace : float, optional
+        See above. The default is 1.0.
+    """
+    
+    def __init__(self, path=None, host='127.0.0.1', port=8765, workers=None,
+                 batch_size=16, batch_delay=0.005, max_pending=256,
+                 grace=1.0):
+        
+        self.path = path
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count()
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.max_pending = max_pending
+        self.grace = grace
+        
+        self._executor = None
+        self._server = None
+        self._queue = None
+        self._pending = None
+        self._dispatcher = None
+        self._connections = set()
+    
+    
+    async def start(self):
+        """Start the worker processes and listen for connections."""
+        
+        self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                             initializer=_warm_up)
+        self._queue = asyncio.Queue()
+        self._pending = asyncio.Semaphore(self.max_pending)
+        self._dispatcher = asyncio.ensure_future(self._dispatch())
+        
+        if self.path is not None:
+            self._server = await asyncio.start_unix_server(
+                                self._client_connected, path=self.path,
+                                limit=_LINE_LIMIT)
+        else:
+            self._server = await asyncio.start_server(
+                                self._client_connected, host=self.host,
+                                port=self.port, limit=_LINE_LIMIT)
+    
+    
+    async def serve_forever(self):
+        
+        if self._server is None:
+            await self.start()
+        
+        await self._server.serve_forever()
+    
+    
+    async def close(self):
+        """Stop listening and shut down the worker processes."""
+        
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for task in list(self._connections):
+            task.cancel()
+        if self._connections:
+            await asyncio.gather(*self._connections, return_exceptions=True)
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+        if self._executor is not None:
+            _shutdown(self._executor)
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+    
+    
+    async def _client_connected(self, reader, writer):
+        
+        lock = asyncio.Lock()
+        tasks = set()
+        
+        connection = asyncio.current_task()
+        self._connections.add(connection)
+        
+        try:
+            while True:
+                
+                # backpressure: stop reading while too many are pending
+                await self._pending.acquire()
+                
+                try:
+                    line = await reader.readline()
+                except (ConnectionError, ValueError):
+                    line = b''
+                if not line:
+                    self._pending.release()
+                    break
+                
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError('request is not a JSON object')
+                    timeout = request.get('timeout')
+                    if (timeout is not None and
+                        not isinstance(timeout, (int, float))):
+                        raise ValueError('timeout is not a number')
+                except ValueError as e:
+                    self._pending.release()
+                    await self._send(writer, lock, {'id': None, 'ok': False,
+                                                    'error': f'invalid '
+                                                             f'request: {e}'})
+                    continue
+                
+                task = asyncio.ensure_future(self._respond(request, writer,
+                                                           lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        
+        except asyncio.CancelledError:
+            # the server is closed
+            for task in tasks:
+                task.cancel()
+        
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            writer.close()
+            self._connections.discard(connection)
+    
+    
+    async def _respond(self, request, writer, lock):
+        
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        received = loop.time()
+        
+        try:
+            self._queue.put_nowait((request, future, received))
+            
+            timeout = request.get('timeout')
+            try:
+                if timeout is not None:
+                    response = await asyncio.wait_for(future,
+                                                      timeout + self.grace)
+                else:
+                    response = await future
+            except asyncio.TimeoutError:
+                response = {'id': request.get('id'), 'ok': False,
+                            'error': 'timeout'}
+            
+            await self._send(writer, lock, response)
+        
+        finally:
+            self._pending.release()
+    
+    
+    @staticmethod
+    async def _send(writer, lock, response):
+        
+        async with lock:
+            writer.write(json.dumps(response).encode() + b'\n')
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+    
+    
+    async def _dispatch(self):
+        """Combine queued requests into batches and submit them."""
+        
+        loop = asyncio.get_running_loop()
+        
+        while True:
+            
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_delay
+            
+            while len(batch) < self.batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(),
+                                                        remaining))
+                except asyncio.TimeoutError:
+                    break
+            
+            # requests with a timeout are submitted on their own so that
+            # they do not wait for other requests of a batch
+            untimed = []
+            for item in batch:
+                if item[0].get('timeout') is None:
+                    untimed.append(item)
+                else:
+                    asyncio.ensure_future(self._run_batch([item]))
+            if untimed:
+                asyncio.ensure_future(self._run_batch(untimed))
+    
+    
+    async def _run_batch(self, batch):
+        
+        loop = asyncio.get_running_loop()
+        requests = []
+        
+        for request, future, received in batch:
+            if future.done():           # already timed out
+                continue
+            timeout = request.get('timeout')
+            if timeout is not None:
+                # absolute (wall-clock) deadline, the worker derives the
+                # time limit when it starts the request
+                request = dict(request, deadline=time.time() + timeout -
+                                                 (loop.time() - received))
+            requests.append((request, future))
+        
+        if not requests:
+            return
+        
+        try:
+            responses = await loop.run_in_executor(
+                                self._executor, _handle_batch,
+                                [request for request, _ in requests])
+        except Exception as e:
+            responses = [{'id': request.get('id'), 'ok': False,
+                          'error': f'{type(e).__name__}: {e}'}
+                         for request, _ in requests]
+        
+        for (_, future), response in zip(requests, responses):
+            if not future.done():
+                future.set_result(response)
+
+
+# --------------------------------------------------------------------------
+#                                  client
+# --------------------------------------------------------------------------
+
+class RecognitionClient:
+    """Asyncio client of the recognition service.
+    
+    Several requests can be sent concurrently over the same connection.
+    
+    Parameters
+    ----------
+    path : str, optional
+        Path of the Unix socket of the server. If None (default), a TCP
+        connection to host:port is established.
+    host : str, optional
+        The default is '127.0.0.1'.
+    port : int, optional
+        The default is 8765.
+    
+    Examples
+    --------
+    >>> async with RecognitionClient(path='/tmp/erdbeermet.sock') as client:
+    ...     result = await client.recognize(D, timeout=10.0)
+    """
+    
+    def __init__(self, path=None, host='127.0.0.1', port=8765):
+        
+        self.path = path
+        self.host = host
+        self.port = port
+        
+        self._reader = None
+        self._writer = None
+        self._receiver = None
+        self._futures = {}
+        self._ids = itertools.count()
+    
+    
+    async def connect(self):
+        
+        if self.path is not None:
+            self._reader, self._writer = await asyncio.open_unix_connection(
+                                            self.path, limit=_LINE_LIMIT)
+        else:
+            self._reader, self._writer = await asyncio.open_connection(
+                                            self.host, self.port,
+                                            limit=_LINE_LIMIT)
+        
+        self._receiver = asyncio.ensure_future(self._receive())
+    
+    
+    async def close(self):
+        
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+        if self._receiver is not None:
+            self._receiver.cancel()
+    
+    
+    async def __aenter__(self):
+        
+        await self.connect()
+        return self
+    
+    
+    async def __aexit__(self, *args):
+        
+        await self.close()
+    
+    
+    async def _receive(self):
+        
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                response = json.loads(line)
+                future = self._futures.pop(response.get('id'), None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        finally:
+            for future in self._futures.values():
+                if not future.done():
+                    future.set_exception(ConnectionError('connection closed'))
+            self._futures.clear()
+    
+    
+    async def request(self, request):
+        """Send a request (dict) and return the result of the response.
+        
+        Raises
+        ------
+        asyncio.TimeoutError
+            If the server answered with a timeout.
+        RuntimeError
+            If the server answered with any other error.
+        """
+        
+        request_id = next(self._ids)
+        request = dict(request, id=request_id)
+        
+        future = asyncio.get_running_loop().create_future()
+        self._futures[request_id] = future
+        
+        self._writer.write(json.dumps(request).encode() + b'\n')
+        await self._writer.drain()
+        
+        response = await future
+        
+        if not response['ok']:
+            if response['error'] == 'timeout':
+                raise asyncio.TimeoutError(f'request {request_id} timed out')
+            raise RuntimeError(response['error'])
+        
+        return response['result']
+    
+    
+    async def recognize(self, D=None, history=None, timeout=None, **params):
+        """Recognize a distance matrix or the matrix of a history.
+        
+        Parameters
+        ----------
+        D : 2-dimensional numpy array, optional
+            The distance matrix.
+        history : list, optional
+            The history of a scenario (used if D is None).
+        timeout : float, optional
+            Timeout in seconds. The default is None.
+        params : keyword arguments
+            Further parameters of recognition.recognize(), e.g.
+            `first_candidate_only` or `beam_width`.
+        
+        Returns
+        -------
+        dict
+            The summary of the recognition tree (see Tree.summary()) and the
+            processing time.
+        """
+        
+        request = {'op': 'recognize', 'params': params}
+        
+        if D is not None:
+            request['matrix'] = np.asarray(D, dtype=np.float64).tolist()
+        elif history is not None:
+            request['history'] = history_to_json(history)
+        else:
+            raise ValueError("either 'D' or 'history' must be given")
+        
+        if timeout is not None:
+            request['timeout'] = timeout
+        
+        return await self.request(request)
+    
+    
+    async def simulate(self, N, seed=None, **params):
+        """Simulate a scenario (see simulation.simulate()).
+        
+        Returns
+        -------
+        dict
+            The history, the distance matrix and whether the scenario is
+            circular.
+        """
+        
+        params = dict(params, N=N)
+        if seed is not None:
+            params['seed'] = seed
+        
+        return await self.request({'op': 'simulate', 'params': params})
+
+
+def main(argv=None):
+    
+    parser = argparse.ArgumentParser(description='Local recognition service')
+    parser.add_argument('--socket', default=None,
+                        help='path of a Unix socket (instead of TCP)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes')
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--batch-delay', type=float, default=0.005)
+    parser.add_argument('--max-pending', type=int, default=256)
+    args = parser.parse_args(argv)
+    
+    server = RecognitionServer(path=args.socket, host=args.host,
+                               port=args.port, workers=args.workers,
+                               batch_size=args.batch_size,
+                               batch_delay=args.batch_delay,
+                               max_pending=args.max_pending)
+    
+    async def run():
+        try:
+            await server.serve_forever()
+        finally:
+            await server.close()
+    
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    
+    main()
@@ -2,7 +2,9 @@
 
 import numpy as np
 
-import erdbeermet.tools.FileIO as FileIO
+
+# parameters of simulate() (see check_simulation_params())
+SIMULATION_PARAMS = ('N', 'branching_prob', 'circular', 'clocklike')
 
 
 class Scenario:
@@ -16,40 +18,155 @@ class Scenario:
         The history of merge and branching events.
     circular : bool
         Indicates whether the scenario has a circular type R matrix
+        (determined on first access).
     D : 2-dimensional numpy array
-        The distance matrix.
+        The distance matrix (a view on a larger backing buffer that leaves
+        room for further items added with `append_event()`; the buffer is
+        copied before it is updated if the matrix was accessed before, so
+        that previously returned matrices never change). It is only built
+        on first access, so that scenarios that are merely generated or
+        written to file do not pay for the matrix construction.
     
     See Also
     --------
     simulate()
+    simulate_stepwise()
     scenario_from_history()
     load()
     """
     
-    def __init__(self, history):
+    def __init__(self, history, checkpoint_interval=16):
         """Constructor for Scenario class.
         
         Parameters
         ----------
         history : list of tuples
             The history of merge and branching events.
+        checkpoint_interval : int, optional
+            Distance between the prefix lengths for which intermediate
+            distance matrices are kept once `distances(upto=k)` is called
+            with k < N. The default is 16.
         """
         
         self.N = len(history) + 1
-        self.history = history
+        self.history = list(history)
+        
+        if checkpoint_interval < 1:
+            raise ValueError('checkpoint interval must be a positive integer')
+        self.checkpoint_interval = checkpoint_interval
+        self._checkpoints = []
+        
+        # built lazily on first access
+        self._buffer = None
+        self._D = None
+        
+        # whether the matrix was handed out as a view of the buffer, which
+        # must then be copied before the next in-place update
+        self._shared = False
+        self._circular = None
+        self._circ_order = None
+    
+    
+    @property
+    def D(self):
+        """Distance matrix (built on first access)."""
+        
+        if self._D is None:
+            self._build_matrix()
+        
+        self._shared = True
+        
+        return self._D
+    
+    
+    @property
+    def circular(self):
+        """Whether the scenario is circular (determined on first access)."""
         
-        self._build_matrix()
+        if self._circular is None:
+            self._build_circular_order()
         
+        return self._circular
     
-    def distances(self):
+    
+    def distances(self, upto=None):
         """Distance matrix of the scenario.
         
+        Parameters
+        ----------
+        upto : int, optional
+            If specified, return the distance matrix on the first `upto`
+            items, i.e., the matrix after `upto`-1 R-steps (as
+            `scenario_from_history(history, stop_after=upto)` would). The
+            default is None, in which case the full matrix is returned.
+        
         Returns
         -------
         2-dimensional numpy array
         """
         
-        return self.D
+        if upto is None or upto == self.N:
+            return self.D
+        
+        if upto < 1 or upto > self.N:
+            raise ValueError(f'cannot restrict scenario on {self.N} items '\
+                             f'to {upto} items')
+        
+        return self._prefix_matrix(upto)
+    
+    
+    def append_event(self, x, y, alpha, delta):
+        """Append an R-step creating a new item and update the matrix in place.
+        
+        The new item is z = N. The distance matrix is kept in a backing
+        buffer whose capacity is doubled whenever it is exhausted, and the
+        circular order is updated incrementally (both only if they were
+        already built, otherwise the event is merely added to the history).
+        
+        Parameters
+        ----------
+        x : int
+            First parent item.
+        y : int
+            Second parent item (equal to x for a pure branching event).
+        alpha : float
+            Merge parameter (0.0 or 1.0 for a pure branching event).
+        delta : list or 1-dimensional numpy array
+            Distance increments for the N+1 items after the event.
+        
+        Returns
+        -------
+        int
+            The new item z.
+        """
+        
+        z = self.N
+        
+        for item in (x, y):
+            if item is not None and (item < 0 or item >= z):
+                raise IndexError(f'item {item} is out of range for z={z}')
+        
+        if len(delta) != z + 1:
+            raise RuntimeError(f'invalid length of delta array for z={z}')
+        
+        if self._circular:
+            self._update_circular_order(x, y, z, alpha)
+        
+        if self._D is not None:
+            if z + 1 > self._buffer.shape[0]:
+                self._grow_buffer(z + 1)
+            elif self._shared:
+                # copy on write, matrices returned earlier stay unchanged
+                self._reallocate(self._buffer.shape[0])
+            _apply_event(self._buffer, x, y, z, alpha, delta)
+        
+        self.history.append( (x, y, z, alpha, delta) )
+        self.N += 1
+        
+        if self._D is not None:
+            self._D = self._buffer[:self.N, :self.N]
+        
+        return z
     
     
     def get_history(self):
@@ -98,7 +215,9 @@ class Scenario:
             Path and filename.
         """
         
-        FileIO.write_history(filename, self.history)
+        from erdbeermet.tools.FileIO import write_history
+        
+        write_history(filename, self.history)
     
     
     def print_history(self):
@@ -111,101 +230,154 @@ class Scenario:
     
     
     def _build_matrix(self):
-        """Generate the distance matrix and determine whether it is circular.
-        """
+        """Generate the distance matrix."""
         
-        self.D = np.zeros((self.N, self.N))
-        D = self.D
+        self._buffer = np.zeros((self.N, self.N))
+        self._D = self._buffer[:self.N, :self.N]
+            
+        for x, y, z, alpha, delta in self.history:
+            _apply_event(self._D, x, y, z, alpha, delta)
+    
+    
+    def _build_circular_order(self):
+        """Determine the circular order and whether the matrix is circular."""
         
         # initialize circular as True and set to False if non-neighbor merge
         # event is encountered
-        self.circular = True
+        self._circular = True
         self._circ_order = {0: 0}
-            
+        
         for x, y, z, alpha, delta in self.history:
+            self._update_circular_order(x, y, z, alpha)
+            if not self._circular:
+                break
+    
+    
+    def _grow_buffer(self, min_capacity):
+        """Reallocate the backing buffer with (at least) doubled capacity."""
+        
+        self._reallocate(max(2 * self._buffer.shape[0], min_capacity))
+    
+    
+    def _reallocate(self, capacity):
+        """Copy the current matrix into a new backing buffer."""
+        
+        buffer = np.zeros((capacity, capacity))
+        buffer[:self.N, :self.N] = self._buffer[:self.N, :self.N]
+        
+        self._buffer = buffer
+        self._D = self._buffer[:self.N, :self.N]
+        self._shared = False
+    
+    
+    def _update_circular_order(self, x, y, z, alpha):
+        """Insert z into the circular order or set circular to False."""
+        
+        # simple duplication event
+        if _is_duplication(x, y, alpha):
             
-            # simple duplication event
-            if (x == y or
-                (x is None) or (y is None) or
-                alpha == 1.0 or alpha == 0.0):
-                
-                if x is None or alpha == 0.0:
-                    x = y
-                    
-                D[x, z] = 0.0
-                D[z, x] = 0.0
-                
-                for u in range(z):
-                    D[u, z] = D[x, z]
-                    D[z, u] = D[x, z]
-                    
-                if self.circular:
-                    old_succ = self._circ_order[x]
-                    self._circ_order[x] = z
-                    self._circ_order[z] = old_succ
-                    
-            # recombination event      
-            else:
-                if self.circular:
-                    if self._circ_order[x] == y:
-                        self._circ_order[x] = z
-                        self._circ_order[z] = y
-                    elif self._circ_order[y] == x:
-                        self._circ_order[y] = z
-                        self._circ_order[z] = x
-                    else:
-                        self.circular = False
-                
-                for u in range(z):
-                    if u != x and u != y:
-                        
-                        d = alpha * D[x, u] + (1 - alpha) * D[y, u]
-                        D[u, z] = d
-                        D[z, u] = d
-                        
-                D[z, x] = (1 - alpha) * D[x, y]
-                D[x, z] = (1 - alpha) * D[x, y]
-                D[z, y] = alpha * D[x, y]
-                D[y, z] = alpha * D[x, y]
+            if x is None or alpha == 0.0:
+                x = y
+            
+            old_succ = self._circ_order[x]
+            self._circ_order[x] = z
+            self._circ_order[z] = old_succ
             
-            # distance increment, i.e., independent evolution after event
-            if len(delta) != z + 1:
-                raise RuntimeError(f'invalid length of delta array for z={z}')
-                        
-            for p in range(z):
-                for q in range(p+1, z+1):
-                    D[p, q] += delta[p] + delta[q]
-                    D[q, p] = D[p, q]
+        # recombination event
+        elif self._circ_order[x] == y:
+            self._circ_order[x] = z
+            self._circ_order[z] = y
+        elif self._circ_order[y] == x:
+            self._circ_order[y] = z
+            self._circ_order[z] = x
+        else:
+            self._circular = False
+    
+    
+    def _prefix_matrix(self, k):
+        """Distance matrix on the first k items.
+        
+        The matrix is obtained from the largest checkpoint on at most k items
+        by replaying the remaining R-steps. Missing checkpoints are created
+        on the fly.
+        """
+        
+        step = self.checkpoint_interval
+        
+        # the i-th checkpoint holds the matrix on (i+1) * step items
+        while (len(self._checkpoints) + 1) * step <= k:
+            start = len(self._checkpoints) * step
+            D = np.zeros((start + step, start + step))
+            if self._checkpoints:
+                D[:start, :start] = self._checkpoints[-1]
+            self._replay(D, start, start + step)
+            self._checkpoints.append(D)
+        
+        start = (k // step) * step
+        D = np.zeros((k, k))
+        if start > 0:
+            D[:start, :start] = self._checkpoints[start // step - 1]
+        self._replay(D, start, k)
+        
+        return D
+    
+    
+    def _replay(self, D, start, stop):
+        """Apply the R-steps creating the items start, ..., stop-1 to D."""
+        
+        for x, y, z, alpha, delta in self.history[max(start-1, 0):stop-1]:
+            _apply_event(D, x, y, z, alpha, delta)
 
 
-def random_history(N, branching_prob=0.0, circular=False, clocklike=False):
-    """Generate a random history of merge and branching events.
+def _is_duplication(x, y, alpha):
     
-    Parameters
-    ----------
-    N : int
-        Number of items.
-    branching_prob : float, optional
-        Probability that an event is a pure branching event. The default is
-        0.0, i.e., pure branching events are disabled.
-    circular : bool, optional
-        If set to True, the resulting history is guaranteed to produce a
-        circular type R matrix. The default is False.
-    clocklike : bool, optional
-        If set to True, the distance increment is equal for all items within
-        each iteration (comprising a merge or branching event and the distance
-        increments) and only varies between iteration. The default is False,
-        in which case the increments are also drawn independently for the
-        items within an iteration.
-        
-    Returns
-    -------
-    list of tuples
-        Each tuple corresponds to an iteration comprising a merge or branching
-        event and the distance increments.
+    return (x == y or
+            (x is None) or (y is None) or
+            alpha == 1.0 or alpha == 0.0)
+
+
+def _apply_event(D, x, y, z, alpha, delta):
+    """Apply an R-step (x, y: z)alpha and the distance increments in place.
+    
+    D must have at least z+1 rows and columns; only the entries on the items
+    0, ..., z are accessed.
     """
     
-    history = []
+    # simple duplication event
+    if _is_duplication(x, y, alpha):
+        
+        if x is None or alpha == 0.0:
+            x = y
+        
+        D[x, z] = 0.0
+        D[z, x] = 0.0
+        
+        D[:z, z] = D[x, z]
+        D[z, :z] = D[x, z]
+        
+    # recombination event
+    else:
+        d = alpha * D[x, :z] + (1 - alpha) * D[y, :z]
+        D[:z, z] = d
+        D[z, :z] = d
+        
+        D[z, x] = (1 - alpha) * D[x, y]
+        D[x, z] = (1 - alpha) * D[x, y]
+        D[z, y] = alpha * D[x, y]
+        D[y, z] = alpha * D[x, y]
+    
+    # distance increment, i.e., independent evolution after event
+    if len(delta) != z + 1:
+        raise RuntimeError(f'invalid length of delta array for z={z}')
+    
+    delta = np.asarray(delta, dtype=float)
+    D[:z+1, :z+1] += delta[:, None] + delta[None, :]
+    np.fill_diagonal(D[:z+1, :z+1], 0.0)
+
+
+def _random_events(N, branching_prob=0.0, circular=False, clocklike=False):
+    """Generator for random merge and branching events (see random_history).
+    """
     
     if circular:
         successors = {0: 0}
@@ -241,9 +413,38 @@ def random_history(N, branching_prob=0.0, circular=False, clocklike=False):
         else:
             delta = np.random.exponential(scale=1/N) * np.ones((z+1,))
                 
-        history.append( (x, y, z, alpha, delta) )
+        yield (x, y, z, alpha, delta)
+
+
+def random_history(N, branching_prob=0.0, circular=False, clocklike=False):
+    """Generate a random history of merge and branching events.
+    
+    Parameters
+    ----------
+    N : int
+        Number of items.
+    branching_prob : float, optional
+        Probability that an event is a pure branching event. The default is
+        0.0, i.e., pure branching events are disabled.
+    circular : bool, optional
+        If set to True, the resulting history is guaranteed to produce a
+        circular type R matrix. The default is False.
+    clocklike : bool, optional
+        If set to True, the distance increment is equal for all items within
+        each iteration (comprising a merge or branching event and the distance
+        increments) and only varies between iteration. The default is False,
+        in which case the increments are also drawn independently for the
+        items within an iteration.
+        
+    Returns
+    -------
+    list of tuples
+        Each tuple corresponds to an iteration comprising a merge or branching
+        event and the distance increments.
+    """
     
-    return history
+    return list(_random_events(N, branching_prob=branching_prob,
+                               circular=circular, clocklike=clocklike))
 
 
 def simulate(N, branching_prob=0.0, circular=False, clocklike=False):
@@ -282,6 +483,77 @@ def simulate(N, branching_prob=0.0, circular=False, clocklike=False):
                                    clocklike=clocklike))
 
 
+def simulate_stepwise(N, branching_prob=0.0, circular=False,
+                      clocklike=False):
+    """Simulate a random type R matrix one R-step at a time.
+    
+    The events are drawn as in `simulate()` (with the same random numbers)
+    but the distance matrix is updated in place after each event instead of
+    being built from the complete history.
+    
+    Parameters
+    ----------
+    N : int
+        Number of items.
+    branching_prob : float, optional
+        Probability that an event is a pure branching event. The default is
+        0.0, i.e., pure branching events are disabled.
+    circular : bool, optional
+        If set to True, the resulting distance matrix is guaranteed to be a
+        circular type R matrix. The default is False.
+    clocklike : bool, optional
+        If set to True, the distance increment is equal for all items within
+        each iteration. The default is False.
+    
+    Yields
+    ------
+    Scenario
+        The same instance after each R-step, i.e., on 2, 3, ..., N items.
+    """
+    
+    scenario = Scenario([])
+    
+    for x, y, z, alpha, delta in _random_events(N,
+                                                branching_prob=branching_prob,
+                                                circular=circular,
+                                                clocklike=clocklike):
+        scenario.append_event(x, y, alpha, delta)
+        yield scenario
+
+
+def check_simulation_params(params):
+    """Validate and complete a dict of parameters for simulate().
+    
+    Parameters
+    ----------
+    params : dict
+        Has to contain 'N' and may contain 'branching_prob', 'circular' and
+        'clocklike'.
+    
+    Returns
+    -------
+    dict
+        All four parameters converted to int, float and bool, respectively,
+        where the missing ones are set to the defaults of simulate().
+    
+    Raises
+    ------
+    ValueError
+        If a parameter is unknown or 'N' is missing.
+    """
+    
+    for key in params:
+        if key not in SIMULATION_PARAMS:
+            raise ValueError(f"invalid parameter '{key}'")
+    if 'N' not in params:
+        raise ValueError("parameter 'N' is missing")
+    
+    return {'N': int(params['N']),
+            'branching_prob': float(params.get('branching_prob', 0.0)),
+            'circular': bool(params.get('circular', False)),
+            'clocklike': bool(params.get('clocklike', False))}
+
+
 def scenario_from_history(history, stop_after=False):
     """Generate a type R matrix from a list of merge and branching events.
     
@@ -322,7 +594,9 @@ def load(filename, stop_after=False):
         distance matrix.
     """
     
-    return scenario_from_history(FileIO.parse_history(filename),
+    from erdbeermet.tools.FileIO import parse_history
+    
+    return scenario_from_history(parse_history(filename),
                                  stop_after=stop_after)
 
 
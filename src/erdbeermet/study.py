@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+
+"""Monte Carlo studies of the recognition over simulation parameter grids.
+
+For every cell of a grid over N, branching_prob, circular and clocklike, a
+number of replicates is simulated and recognized on a process pool. Every
+task has its own seed derived from the study seed, the parameters of the
+cell and the replicate, i.e., it does not depend on the grid or on the
+order in which the tasks are processed. The study directory contains
+    
+    study.json      the configuration of the study,
+    results.jsonl   one line per task (written as soon as it is finished),
+    summary.npz     the aggregated statistics per cell, one array per column
+                    (see load_summary()), rewritten periodically.
+
+An interrupted study is resumed by calling run_study() with the same
+directory and configuration again, which skips the tasks in results.jsonl.
+A study can also be extended by more replicates in this way.
+    
+    from erdbeermet.study import parameter_grid, run_study
+    
+    grid = parameter_grid(N=[6, 8, 10], branching_prob=[0.0, 0.5],
+                          circular=[False, True])
+    summary = run_study(grid, 100, 'path/to/study')
+"""
+
+import itertools
+import json
+import os
+import tempfile
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from erdbeermet.simulation import (SIMULATION_PARAMS, check_simulation_params,
+                                   simulate)
+from erdbeermet.recognition import recognize
+from erdbeermet.tools.FileIO import open_json_lines, read_json_lines
+
+
+__author__ = 'David Schaller'
+
+
+# columns of the summary of a cell that are computed from the results
+_STATISTICS = ('valid_ways', 'nodes', 'time')
+
+
+def parameter_grid(N, branching_prob=(0.0,), circular=(False,),
+                   clocklike=(False,)):
+    """All combinations of the given simulation parameters.
+    
+    Parameters
+    ----------
+    N : list of int
+        Numbers of items.
+    branching_prob : list of float, optional
+        Branching probabilities. The default is (0.0,).
+    circular : list of bool, optional
+        The default is (False,).
+    clocklike : list of bool, optional
+        The default is (False,).
+    
+    Returns
+    -------
+    list of dict
+        The cells of the grid (keys 'N', 'branching_prob', 'circular' and
+        'clocklike').
+    """
+    
+    return [{'N': int(n), 'branching_prob': float(p), 'circular': bool(c),
+             'clocklike': bool(k)}
+            for n, p, c, k in itertools.product(N, branching_prob, circular,
+                                                clocklike)]
+
+
+def task_seed(seed, cell, replicate):
+    """Seed of a replicate of a grid cell (for np.random.seed())."""
+    
+    entropy = [seed, cell['N'], int(round(cell['branching_prob'] * 10**9)),
+               int(cell['circular']), int(cell['clocklike']), replicate]
+    
+    return int(np.random.SeedSequence(entropy).generate_state(1)[0])
+
+
+def _cell_key(cell):
+    
+    return tuple(cell[key] for key in SIMULATION_PARAMS)
+
+
+def _run_task(task):
+    """Simulate and recognize a single replicate (in a worker process)."""
+    
+    cell, replicate, seed, rec_params = task
+    
+    start = time.perf_counter()
+    np.random.seed(seed)
+    scenario = simulate(cell['N'], branching_prob=cell['branching_prob'],
+                        circular=cell['circular'],
+                        clocklike=cell['clocklike'])
+    time_simulate = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    tree = recognize(scenario.D, **rec_params)
+    time_recognize = time.perf_counter() - start
+    
+    summary = tree.summary()
+    
+    result = dict(cell)
+    result.update({'replicate': replicate, 'seed': seed,
+                   'success': summary['successes'] > 0,
+                   'valid_ways': summary['successes'],
+                   'nodes': summary['nodes'],
+                   'exhaustive': summary['exhaustive'],
+                   'complete': summary['complete'],
+                   'time_simulate': time_simulate,
+                   'time': time_recognize})
+    
+    return result
+
+
+class _CellStatistics:
+    """Results of a grid cell.
+    
+    The counts are updated incrementally. All values of the statistics are
+    kept (for the exact medians and percentiles), and their aggregates are
+    only recomputed after new results were added.
+    """
+    
+    __slots__ = ('replicates', 'successes', 'inconclusive', 'values',
+                 '_aggregates')
+    
+    def __init__(self):
+        
+        self.replicates = 0
+        self.successes = 0
+        
+        # failures that do not imply that the matrix is not an R matrix
+        self.inconclusive = 0
+        
+        self.values = {name: [] for name in _STATISTICS}
+        self._aggregates = None
+    
+    
+    def add(self, result):
+        
+        self.replicates += 1
+        if result['success']:
+            self.successes += 1
+        elif not (result['exhaustive'] and result['complete']):
+            self.inconclusive += 1
+        
+        for name in _STATISTICS:
+            self.values[name].append(result[name])
+        
+        self._aggregates = None
+    
+    
+    def aggregates(self):
+        """Mean, median, 90th percentile and maximum of every statistic."""
+        
+        if self._aggregates is None:
+            self._aggregates = {}
+            for name in _STATISTICS:
+                values = np.array(self.values[name], dtype=np.float64)
+                if not self.replicates:
+                    values = np.full((1,), np.nan)
+                median, q90 = np.percentile(values, [50, 90])
+                self._aggregates.update({f'{name}_mean': np.mean(values),
+                                         f'{name}_median': median,
+                                         f'{name}_q90': q90,
+                                         f'{name}_max': np.max(values)})
+        
+        return self._aggregates
+
+
+def _summary_columns(cells, statistics):
+    
+    columns = {key: np.array([cell[key] for cell in cells])
+               for key in SIMULATION_PARAMS}
+    
+    replicates = np.array([statistics[_cell_key(cell)].replicates
+                           for cell in cells], dtype=np.int64)
+    successes = np.array([statistics[_cell_key(cell)].successes
+                          for cell in cells], dtype=np.int64)
+    
+    columns['replicates'] = replicates
+    columns['successes'] = successes
+    columns['inconclusive'] = np.array([statistics[_cell_key(cell)]
+                                        .inconclusive for cell in cells],
+                                       dtype=np.int64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        columns['success_rate'] = successes / replicates
+    
+    aggregates = [statistics[_cell_key(cell)].aggregates() for cell in cells]
+    for name in _STATISTICS:
+        for stat in ('mean', 'median', 'q90', 'max'):
+            column = f'{name}_{stat}'
+            columns[column] = np.array([a[column] for a in aggregates],
+                                       dtype=np.float64)
+    
+    return columns
+
+
+def _write_summary(path, columns):
+    
+    # write to a temporary file first such that the summary is never
+    # incomplete
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                                    suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **columns)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def load_summary(path):
+    """Load the summary of a study.
+    
+    Parameters
+    ----------
+    path : str
+        Path of the study directory or of its file summary.npz.
+    
+    Returns
+    -------
+    dict
+        One numpy array per column: the parameters of the cells ('N',
+        'branching_prob', 'circular', 'clocklike'), the numbers of
+        'replicates', 'successes' and 'inconclusive' failures (with
+        skipped candidates or an exceeded budget), the 'success_rate',
+        and the mean, median, 90th percentile and maximum of
+        'valid_ways', 'nodes' and 'time' (the recognition time in seconds),
+        e.g. 'nodes_median'.
+    """
+    
+    if os.path.isdir(path):
+        path = os.path.join(path, 'summary.npz')
+    
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+
+def _check_config(path, config):
+    
+    if os.path.exists(path):
+        with open(path) as f:
+            previous = json.load(f)
+        if previous != config:
+            raise ValueError('the study directory contains a study with a '
+                             'different configuration')
+    else:
+        with open(path, 'w') as f:
+            json.dump(config, f, indent=2)
+
+
+def run_study(grid, replicates, directory, workers=None, seed=0,
+              rec_params=None, summary_interval=60.0, chunksize=1):
+    """Run (or resume) a Monte Carlo study.
+    
+    Parameters
+    ----------
+    grid : list of dict
+        The cells of the parameter grid (see parameter_grid()).
+    replicates : int
+        Number of replicates per cell (may be increased when a study is
+        resumed).
+    directory : str
+        The study directory (created if it does not exist).
+    workers : int, optional
+        Number of worker processes. The default is None, in which case the
+        number of CPUs is used.
+    seed : int, optional
+        Seed of the study (see task_seed()). The default is 0.
+    rec_params : dict, optional
+        Keyword arguments of recognition.recognize(), e.g.
+        {'first_candidate_only': True}. The default is None.
+    summary_interval : float, optional
+        Seconds between two updates of the summary file. The default is
+        60.0.
+    chunksize : int, optional
+        Number of tasks sent to a worker at once. The default is 1.
+    
+    Returns
+    -------
+    dict
+        The summary (see load_summary()).
+    
+    Raises
+    ------
+    ValueError
+        If the directory contains a study with a different grid, seed or
+        recognition parameters.
+    """
+    
+    grid = [check_simulation_params(cell) for cell in grid]
+    rec_params = dict(rec_params) if rec_params else {}
+    
+    os.makedirs(directory, exist_ok=True)
+    _check_config(os.path.join(directory, 'study.json'),
+                  {'grid': grid, 'seed': seed, 'rec_params': rec_params})
+    
+    results_path = os.path.join(directory, 'results.jsonl')
+    summary_path = os.path.join(directory, 'summary.npz')
+    
+    statistics = {_cell_key(cell): _CellStatistics() for cell in grid}
+    done = set()
+    for result in read_json_lines(results_path):
+        key = _cell_key(result)
+        if key in statistics and (key, result['replicate']) not in done:
+            done.add((key, result['replicate']))
+            statistics[key].add(result)
+    
+    tasks = [(cell, r, task_seed(seed, cell, r), rec_params)
+             for r in range(replicates) for cell in grid
+             if (_cell_key(cell), r) not in done]
+    
+    last_summary = time.perf_counter()
+    
+    with open_json_lines(results_path) as f:
+        if tasks:
+            with Pool(workers) as pool:
+                for result in pool.imap_unordered(_run_task, tasks,
+                                                  chunksize=chunksize):
+                    f.write(json.dumps(result) + '\n')
+                    f.flush()
+                    statistics[_cell_key(result)].add(result)
+                    
+                    if time.perf_counter() - last_summary >= summary_interval:
+                        _write_summary(summary_path,
+                                       _summary_columns(grid, statistics))
+                        last_summary = time.perf_counter()
+    
+    columns = _summary_columns(grid, statistics)
+    _write_summary(summary_path, columns)
+    
+    return columns
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from erdbeermet.tools.FileIO import save_recognition, load_recognition
+from erdbeermet.tools.Tree import Tree, TreeNode
+
+
+__author__ = 'David Schaller'
+
+
+class RecognitionCache:
+    """Persistent content-addressed cache of recognition results.
+    
+    Every result is stored in a separate file in the cache directory whose
+    name is a hash of the distance matrix and the recognition parameters
+    (including the version of the recognition algorithm). Files are
+    written to a temporary file first and then atomically renamed, and
+    missing or unreadable entries are treated as cache misses, so that
+    several processes can share the same directory without locking.
+    
+    If the total size of the cache exceeds `max_bytes`, the least recently
+    used entries (by modification time, which is updated on every hit) are
+    removed.
+    
+    Parameters
+    ----------
+    directory : str
+        Path of the cache directory (created if it does not exist).
+    max_bytes : int, optional
+        Size limit of the cache in bytes. The default is 2^30 (1 GiB).
+    store : str, optional
+        'tree' to store the complete recognition tree, or 'summary'
+        (default) to only store the root and the first successful
+        recognition path (i.e., the success count, and an accepting path if
+        there is any).
+    matrices : bool, optional
+        If True, the distance matrices of the stored nodes are kept. The
+        default is False.
+    
+    See Also
+    --------
+    recognition.recognize()
+    """
+    
+    suffix = '.npz'
+    
+    def __init__(self, directory, max_bytes=2**30, store='summary',
+                 matrices=False):
+        
+        if store not in ('tree', 'summary'):
+            raise ValueError(f"invalid cache store mode '{store}'")
+        
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.store = store
+        self.matrices = matrices
+        
+        os.makedirs(directory, exist_ok=True)
+    
+    
+    def key(self, D, **params):
+        """Hash of a distance matrix and the recognition parameters.
+        
+        Parameters
+        ----------
+        D : 2-dimensional numpy array
+            The distance matrix.
+        params : keyword arguments
+            Recognition parameters (must be JSON-serializable).
+        
+        Returns
+        -------
+        str
+        """
+        
+        D = np.ascontiguousarray(D, dtype=np.float64)
+        
+        h = hashlib.sha256()
+        h.update(str(D.shape).encode())
+        h.update(D.tobytes())
+        h.update(json.dumps(params, sort_keys=True).encode())
+        h.update(f'{self.store},{self.matrices}'.encode())
+        
+        return h.hexdigest()
+    
+    
+    def _path(self, key):
+        
+        return os.path.join(self.directory, key + RecognitionCache.suffix)
+    
+    
+    def get(self, key):
+        """Cached recognition tree for the key or None if there is none."""
+        
+        path = self._path(key)
+        
+        try:
+            tree = load_recognition(path)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # corrupted entry, e.g. written by an incompatible version
+            self._remove(path)
+            return None
+        
+        return tree
+    
+    
+    def put(self, key, tree):
+        """Store a recognition tree and evict old entries if necessary."""
+        
+        if self.store == 'summary':
+            tree = _accepting_path_tree(tree)
+        
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(fd)
+        try:
+            save_recognition(tmp_path, tree, matrices=self.matrices,
+                             compress=True)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            self._remove(tmp_path)
+            raise
+        
+        self._evict()
+    
+    
+    def clear(self):
+        """Remove all entries of the cache."""
+        
+        for entry in self._entries():
+            self._remove(entry.path)
+    
+    
+    def _entries(self):
+        
+        try:
+            with os.scandir(self.directory) as it:
+                return [entry for entry in it
+                        if entry.name.endswith(RecognitionCache.suffix)]
+        except FileNotFoundError:
+            return []
+    
+    
+    def _evict(self):
+        
+        files = []
+        for entry in self._entries():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        
+        total = sum(size for _, size, _ in files)
+        files.sort()
+        
+        for _, size, path in files:
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+    
+    
+    @staticmethod
+    def _remove(path):
+        
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _accepting_path_tree(tree):
+    """Copy of the root and the first successful path of the tree."""
+    
+    v = tree.root
+    root = TreeNode(v.n, v.V, D=v.D)
+    root.valid_ways, root.info = v.valid_ways, v.info
+    
+    copy = root
+    while v.valid_ways and v.children:
+        v = next(c for c in v.children if c.valid_ways)
+        child = TreeNode(v.n, v.V, D=v.D, R_step=v.R_step)
+        child.valid_ways, child.info = v.valid_ways, v.info
+        copy.add_child(child)
+        copy = child
+    
+    summary = Tree(root)
+    summary.valid_ways = summary.successes = root.valid_ways
+    summary.exhaustive = tree.exhaustive
+    
+    return summary
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+
+__author__ = 'David Schaller'
+
+
+def nearest_neighbor_order(D, start=0):
+    """Hamiltonian cycle by the nearest-neighbor heuristic.
+    
+    Parameters
+    ----------
+    D : 2-dimensional numpy array
+        Distance matrix.
+    start : int, optional
+        The first item of the cycle. The default is 0.
+    
+    Returns
+    -------
+    list
+        The items in the order in which they are visited.
+    """
+    
+    n = D.shape[0]
+    visited = np.zeros(n, dtype=bool)
+    order = [start]
+    visited[start] = True
+    
+    for _ in range(n-1):
+        distances = np.where(visited, np.inf, D[order[-1]])
+        nearest = int(np.argmin(distances))
+        order.append(nearest)
+        visited[nearest] = True
+    
+    return order
+
+
+def cycle_length(D, order):
+    """Total length of the Hamiltonian cycle given by the order."""
+    
+    order = np.asarray(order)
+    
+    return D[order, np.roll(order, -1)].sum()
+
+
+def two_opt(D, order, max_iter=None, atol=1e-12):
+    """Improve a Hamiltonian cycle by 2-opt moves.
+    
+    In every iteration, the gains of all 2-opt moves (replacing the edges
+    {a_i, a_i+1} and {a_j, a_j+1} by {a_i, a_j} and {a_i+1, a_j+1}, i.e.,
+    reversing the segment between them) are computed at once and the best
+    move is applied, until no move shortens the cycle by more than atol.
+    
+    Parameters
+    ----------
+    D : 2-dimensional numpy array
+        Distance matrix.
+    order : list
+        The initial cycle.
+    max_iter : int, optional
+        Maximal number of moves. The default is None (no limit).
+    atol : float, optional
+        Minimal gain of a move. The default is 1e-12.
+    
+    Returns
+    -------
+    list
+        The improved cycle.
+    """
+    
+    order = np.array(order)
+    n = len(order)
+    
+    if n < 4:
+        return order.tolist()
+    
+    # only pairs of non-adjacent edges i < j
+    i_idx, j_idx = np.triu_indices(n, k=2)
+    keep = ~((i_idx == 0) & (j_idx == n-1))
+    i_idx, j_idx = i_idx[keep], j_idx[keep]
+    
+    iteration = 0
+    while max_iter is None or iteration < max_iter:
+        
+        succ = np.roll(order, -1)
+        a, b = order[i_idx], succ[i_idx]
+        c, d = order[j_idx], succ[j_idx]
+        gain = D[a, b] + D[c, d] - D[a, c] - D[b, d]
+        
+        best = np.argmax(gain)
+        if gain[best] <= atol:
+            break
+        
+        i, j = i_idx[best], j_idx[best]
+        order[i+1:j+1] = order[i+1:j+1][::-1]
+        iteration += 1
+    
+    return order.tolist()
+
+
+def is_kalmanson(D, order, rtol=1e-05, atol=1e-08):
+    """Check whether D is a Kalmanson matrix w.r.t. a circular order.
+    
+    D is Kalmanson (i.e., circular decomposable if it is a pseudometric)
+    w.r.t. the order if, for all items i, j, k, l in this circular order,
+    D[i,k] + D[j,l] >= max(D[i,j] + D[k,l], D[i,l] + D[j,k]). It suffices
+    to check this for the quadruples of consecutive pairs (r, r+1, c, c+1),
+    which is done in a vectorized way in O(n^2).
+    
+    Parameters
+    ----------
+    D : 2-dimensional numpy array
+        Distance matrix.
+    order : list
+        A circular order of all items.
+    rtol : float, optional
+        Relative tolerance for equality. The default is 1e-05.
+    atol : float, optional
+        Absolute tolerance for equality. The default is 1e-08.
+    
+    Returns
+    -------
+    bool
+    """
+    
+    n = D.shape[0]
+    if n < 4:
+        return True
+    
+    order = np.asarray(order)
+    P = D[np.ix_(order, order)]
+    P_next = np.roll(P, -1, axis=0)
+    
+    # S[r, c] = P[r,c] + P[r+1,c+1] - P[r,c+1] - P[r+1,c] (indices mod n)
+    left = P + np.roll(P_next, -1, axis=1)
+    right = np.roll(P, -1, axis=1) + P_next
+    
+    # exclude the pairs (r, c) with c in {r-1, r, r+1}
+    offset = (np.arange(n)[None, :] - np.arange(n)[:, None]) % n
+    mask = (offset > 1) & (offset < n-1)
+    
+    valid = (left >= right) | np.isclose(left, right, rtol=rtol, atol=atol)
+    
+    return bool(np.all(valid[mask]))
+
+
+def infer_circular_order(D, starts=1, rtol=1e-05, atol=1e-08):
+    """Infer a circular order w.r.t. which D is a Kalmanson matrix.
+    
+    For a Kalmanson matrix, its circular order is a shortest Hamiltonian
+    cycle. Hence, a short cycle is computed heuristically by the
+    nearest-neighbor heuristic followed by 2-opt moves, and is accepted if D
+    is Kalmanson w.r.t. it.
+    
+    Parameters
+    ----------
+    D : 2-dimensional numpy array
+        Distance matrix.
+    starts : int, optional
+        Number of start items tried for the nearest-neighbor heuristic. The
+        default is 1.
+    rtol : float, optional
+        Relative tolerance for the Kalmanson check. The default is 1e-05.
+    atol : float, optional
+        Absolute tolerance for the Kalmanson check. The default is 1e-08.
+    
+    Returns
+    -------
+    list or None
+        The circular order (starting with item 0), or None if no consistent
+        order was found.
+    """
+    
+    n = D.shape[0]
+    
+    for start in range(min(starts, n)):
+        order = two_opt(D, nearest_neighbor_order(D, start=start))
+        if is_kalmanson(D, order, rtol=rtol, atol=atol):
+            i = order.index(0)
+            return order[i:] + order[:i]
+    
+    return None
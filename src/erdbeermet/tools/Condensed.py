@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+"""Condensed representation of symmetric distance matrices.
+
+A symmetric matrix with zero diagonal on n items is represented by the
+1-dimensional array of its n(n-1)/2 entries above the diagonal in row-major
+order (D[0,1], D[0,2], ..., D[0,n-1], D[1,2], ..., D[n-2,n-1]), i.e., the
+same layout as in scipy.spatial.distance.squareform().
+"""
+
+from functools import lru_cache
+
+import numpy as np
+
+
+__author__ = 'David Schaller'
+
+
+def condensed_size(n):
+    """Length of the condensed form of a matrix on n items."""
+    
+    return n * (n-1) // 2
+
+
+def condensed_n(m):
+    """Number of items of a condensed matrix of length m."""
+    
+    n = int(round((1 + np.sqrt(1 + 8 * m)) / 2))
+    
+    if condensed_size(n) != m:
+        raise ValueError(f'invalid length of a condensed matrix: {m}')
+    
+    return n
+
+
+def num_items(D):
+    """Number of items of a square or condensed distance matrix."""
+    
+    return D.shape[0] if D.ndim == 2 else condensed_n(D.shape[0])
+
+
+def pair_index(n, i, j):
+    """Position of the entry D[i,j] (i != j) in the condensed form."""
+    
+    if i > j:
+        i, j = j, i
+    
+    return i * (2*n - i - 1) // 2 + j - i - 1
+
+
+@lru_cache(maxsize=64)
+def _index_matrix(n):
+    # positions of all entries in the condensed form, the diagonal points to
+    # an additional zero entry at position n(n-1)/2
+    i, j = np.triu_indices(n, k=1)
+    P = np.full((n, n), condensed_size(n), dtype=np.intp)
+    P[i, j] = np.arange(len(i))
+    P[j, i] = P[i, j]
+    P.setflags(write=False)
+    
+    return P
+
+
+def row_indices(n, i):
+    """Positions of the entries D[i,j] for all j != i (in the order of j)."""
+    
+    P = _index_matrix(n)
+    
+    return np.concatenate((P[i, :i], P[i, i+1:]))
+
+
+def condense(D):
+    """Condensed form of a square distance matrix (upper triangle)."""
+    
+    i, j = np.triu_indices(D.shape[0], k=1)
+    
+    return np.asarray(D, dtype=np.float64)[i, j]
+
+
+def squareform(C, n=None):
+    """Square distance matrix of a condensed matrix.
+    
+    Parameters
+    ----------
+    C : 1-dimensional numpy array
+        Condensed distance matrix.
+    n : int, optional
+        Number of items (computed from the length of C if not given).
+    
+    Returns
+    -------
+    2-dimensional numpy array
+        The symmetric matrix with zero diagonal.
+    """
+    
+    if n is None:
+        n = condensed_n(C.shape[0])
+    
+    return np.append(C, 0.0)[_index_matrix(n)]
+
+
+def as_square(D, n=None):
+    """The matrix D itself if it is square, otherwise its square form."""
+    
+    return D if D.ndim == 2 else squareform(D, n)
+
+
+def subtract_from_row(C, n, i, delta):
+    """Subtract delta from all distances of item i (in place)."""
+    
+    C[row_indices(n, i)] -= delta
+
+
+def remove_item(C, n, index):
+    """Condensed matrix without the item at the given index.
+    
+    Since the remaining pairs keep their relative order, this is a single
+    masked copy.
+    """
+    
+    if index < 0 or index >= n:
+        raise IndexError(f"Index {index} is out of range!")
+    
+    keep = np.ones(C.shape, dtype=bool)
+    keep[row_indices(n, index)] = False
+    
+    return C[keep]
+
+
+def _detour_blocks(S, max_entries=2**22):
+    """Shortest detours S[i,k] + S[k,j] over blocks of items k.
+    
+    Yields, for consecutive blocks of items k (of at most max_entries
+    entries of the 3-dimensional sums), the minima over the block for all
+    pairs (i, j) as a square matrix.
+    """
+    
+    n = S.shape[0]
+    step = max(1, max_entries // max(n * n, 1))
+    
+    for k in range(0, n, step):
+        yield (S[:, k:k+step, None] + S[None, k:k+step, :]).min(axis=1)
+
+
+def satisfies_triangle_inequality(D, n=None, rtol=1e-05, atol=1e-08):
+    """Check the triangle inequality for a square or condensed matrix.
+    
+    The detours D[i,k] + D[k,j] over a block of items k are compared with
+    D[i,j] for all pairs at once, and the check stops at the first block
+    that yields a violation.
+    """
+    
+    S = as_square(D, n)
+    
+    for detour in _detour_blocks(S):
+        if np.any((detour < S) & ~np.isclose(detour, S, rtol=rtol,
+                                             atol=atol)):
+            return False
+    
+    return True
+
+
+def first_triangle_violation(C, n, rtol=1e-05, atol=1e-08):
+    """First pair violating the triangle inequality in a condensed matrix.
+    
+    Returns
+    -------
+    tuple or None
+        The first pair (i, j), i < j, in lexicographic order for which
+        D[i,j] exceeds the shortest detour, together with the length of the
+        detour and the (first) item k realizing it; None if there is no
+        such pair.
+    """
+    
+    P = _index_matrix(n)
+    padded = np.append(C, 0.0)
+    i, j = np.triu_indices(n, k=1)
+    
+    minimum = np.full(C.shape, np.inf)
+    argmin = np.zeros(C.shape, dtype=np.intp)
+    
+    for k in range(n):
+        row = padded[P[k]]
+        detour = row[i] + row[j]
+        shorter = detour < minimum
+        minimum[shorter] = detour[shorter]
+        argmin[shorter] = k
+    
+    violated = (minimum < C) & ~np.isclose(minimum, C, rtol=rtol, atol=atol)
+    
+    if not np.any(violated):
+        return None
+    
+    p = np.argmax(violated)
+    
+    return int(i[p]), int(j[p]), minimum[p], int(argmin[p])
@@ -1,6 +1,16 @@
 # -*- coding: utf-8 -*-
 
+import gc
+import gzip
+import json
+import os
 import re
+import zlib
+
+import numpy as np
+
+from erdbeermet.tools.Condensed import as_square, squareform
+from erdbeermet.tools.Tree import Tree, TreeNode
 
 
 def write_history(filename, history):
@@ -49,12 +59,89 @@ def parse_history(filename):
     return history
 
 
+def history_to_json(history):
+    """JSON-serializable form of a history (list of lists).
+    
+    A parent that is None (e.g. of a pure branching event) is kept as None.
+    """
+    
+    def item(x):
+        return None if x is None else int(x)
+    
+    return [[item(x), item(y), int(z), float(alpha),
+             np.asarray(delta).tolist()]
+            for x, y, z, alpha, delta in history]
+
+
+def history_from_json(history):
+    """History from its JSON-serializable form (see history_to_json())."""
+    
+    return [(x, y, z, alpha, np.array(delta, dtype=np.float64))
+            for x, y, z, alpha, delta in history]
+
+
+def read_json_lines(filename):
+    """Generator for the objects in a JSON lines file.
+    
+    Lines that cannot be parsed (e.g. an incomplete last line after an
+    abort) are skipped. Nothing is yielded if the file does not exist.
+    """
+    
+    if not os.path.exists(filename):
+        return
+    
+    with open(filename) as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def open_json_lines(filename, append=True):
+    """Open a JSON lines file for writing.
+    
+    If append is True, the new lines are appended and an incomplete last
+    line of an aborted run is terminated first.
+    """
+    
+    f = open(filename, 'a' if append else 'w')
+    
+    if append and f.tell() > 0:
+        with open(filename, 'rb') as g:
+            g.seek(-1, os.SEEK_END)
+            if g.read(1) != b'\n':
+                f.write('\n')
+    
+    return f
+
+
+def _format_matrix(V, D):
+    
+    # one format call for the whole matrix (row label followed by the row)
+    n = len(V)
+    template = ''.join(f'\n{v}  ' + n * '% 12.8f' for v in V)
+    
+    return template % tuple(D.ravel().tolist())
+
+
 def _write_matrix(f, V, D):
     
-    for i in range(len(V)):
-        f.write(f'\n{V[i]}  ')
-        for j in range(len(V)):
-            f.write('{: 12.8f}'.format(D[i,j]))
+    f.write(_format_matrix(V, D))
+
+
+def _write_node(f, v, matrices=True):
+    
+    f.write(f'n={v.n}\n')
+    if v.R_step is not None:
+        f.write('(result of R-step: ({},{}:{}){:.8f})\n'.format(*v.R_step))
+    f.write(f'V={v.V}\n')
+    f.write(f'total successes of this branch: {v.valid_ways}\n')
+    
+    if matrices and v.D is not None:
+        f.write(f'Matrix on {v.n} elements:\n')
+        _write_matrix(f, v.V, as_square(v.D, v.n))
+        f.write('\n')
 
 
 def write_recognition(filename, tree, matrices=True):
@@ -71,18 +158,525 @@ def write_recognition(filename, tree, matrices=True):
             else:
                 start = False
                 
-            f.write(f'n={v.n}\n')
-            if v.R_step is not None:
-                f.write('(result of R-step: ({},{}:{}){:.8f})\n'.format(*v.R_step))
-            f.write(f'V={v.V}\n')
-            f.write(f'total successes of this branch: {v.valid_ways}\n')
-            
-            if matrices and v.D is not None:
-                f.write(f'Matrix on {v.n} elements:\n')
-                _write_matrix(f, v.V, v.D)
-                f.write('\n')
+            _write_node(f, v, matrices=matrices)
                 
             if not v.valid_ways:
                 f.write(f'reason of abort: {v.info}\n')
+
+
+class RecognitionWriter:
+    """Streaming output of a recognition tree.
+    
+    Nodes are written one at a time via `write_node()`, e.g., by passing an
+    instance to `recognition.recognize(D, writer=...)`, which emits every
+    node as soon as its subtree is completed (i.e., in postorder). Every
+    record is therefore preceded by the id of the node and the id of its
+    parent.
+    
+    Parameters
+    ----------
+    filename : str
+        Path and filename of the text output.
+    matrices : str or bool, optional
+        'text' (default) to write the distance matrices into the text file,
+        'binary' to append them to a binary side-file (the record then
+        contains their byte offset and length; condensed matrices are
+        written in condensed form), or False to omit them.
+    matrix_file : str, optional
+        Path and filename of the binary side-file. The default is filename
+        with the suffix '.matrices'.
+    compress : bool, optional
+        If True, the text file is gzip-compressed and the matrices in the
+        binary side-file are compressed individually with zlib. The default
+        is False.
+    
+    See Also
+    --------
+    read_matrix()
+    """
+    
+    def __init__(self, filename, matrices='text', matrix_file=None,
+                 compress=False):
+        
+        if matrices not in ('text', 'binary', False):
+            raise ValueError(f"invalid matrix output mode '{matrices}'")
+        
+        self.matrices = matrices
+        self.compress = compress
+        
+        if compress:
+            self._f = gzip.open(filename, 'wt')
+        else:
+            self._f = open(filename, 'w')
+        
+        self._mf = None
+        if matrices == 'binary':
+            self.matrix_file = matrix_file if matrix_file else \
+                               filename + '.matrices'
+            self._mf = open(self.matrix_file, 'wb')
+        
+        # ids of nodes that were seen but not written yet
+        self._ids = {}
+        self._counter = 0
+        self._start = True
+        
+    
+    def __enter__(self):
+        
+        return self
+    
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        
+        self.close()
+    
+    
+    def _node_id(self, v, pop=False):
+        
+        key = id(v)
+        if key not in self._ids:
+            self._ids[key] = self._counter
+            self._counter += 1
+        
+        return self._ids.pop(key) if pop else self._ids[key]
+    
+    
+    def write_node(self, v):
+        """Write a single node of the recognition tree."""
+        
+        f = self._f
+        
+        if not self._start:
+            f.write('\n')
+            f.write(80 * '-')
+            f.write('\n')
+        else:
+            self._start = False
+        
+        node_id = self._node_id(v, pop=True)
+        if v.parent is not None:
+            f.write(f'node {node_id} (child of {self._node_id(v.parent)})\n')
+        else:
+            f.write(f'node {node_id} (root)\n')
+        
+        _write_node(f, v, matrices=(self.matrices == 'text'))
+        
+        if self.matrices == 'binary' and v.D is not None:
+            data = np.ascontiguousarray(v.D, dtype=np.float64).tobytes()
+            if self.compress:
+                data = zlib.compress(data)
+            f.write(f'matrix on {v.n} elements at byte offset '\
+                    f'{self._mf.tell()} (length {len(data)})\n')
+            self._mf.write(data)
+        
+        if not v.valid_ways:
+            f.write(f'reason of abort: {v.info}\n')
+    
+    
+    def close(self):
+        """Close the output file(s)."""
+        
+        self._f.close()
+        if self._mf is not None:
+            self._mf.close()
+
+
+def read_matrix(filename, n, offset, length, compressed=False):
+    """Read a single matrix from a binary side-file of RecognitionWriter.
+    
+    Parameters
+    ----------
+    filename : str
+        Path and filename of the binary side-file.
+    n : int
+        Number of items of the matrix.
+    offset : int
+        Byte offset of the matrix.
+    length : int
+        Length in bytes of the (possibly compressed) matrix.
+    compressed : bool, optional
+        Whether the side-file was written with compression. The default is
+        False.
+    
+    Returns
+    -------
+    2-dimensional numpy array
+        The square matrix (also if it was written in condensed form).
+    """
+    
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        data = f.read(length)
+    
+    if compressed:
+        data = zlib.decompress(data)
+    
+    D = np.frombuffer(data, dtype=np.float64)
+    
+    if D.shape[0] != n * n:
+        return squareform(D, n)
+    
+    return D.reshape((n, n)).copy()
+
+
+# version of the binary recognition tree format
+_TREE_FORMAT_VERSION = 1
+
+
+def save_recognition(filename, tree, matrices=True, compress=False):
+    """Save a recognition tree in a compact binary format.
+    
+    The nodes are stored in preorder in columnar numpy arrays (parent
+    indices, R-steps, success counts, info codes, and optionally the
+    distance matrices), so that neither saving nor loading is recursive.
+    The checkpoint of an incomplete tree (see recognition.recognize()) is
+    stored as well, including the matrices of the stacked nodes.
+    
+    Parameters
+    ----------
+    filename : str
+        Path and filename.
+    tree : Tree
+        The recognition tree.
+    matrices : bool, optional
+        If True (default), the distance matrices are stored as well.
+    compress : bool, optional
+        If True, the arrays are compressed. The default is False.
+    
+    See Also
+    --------
+    load_recognition()
+    """
+    
+    nodes = []
+    parent = []
+    index = {}
+    stack = [(tree.root, -1)] if tree.root else []
+    while stack:
+        v, p = stack.pop()
+        index[id(v)] = len(nodes)
+        nodes.append(v)
+        parent.append(p)
+        i = index[id(v)]
+        for child in reversed(v.children):
+            stack.append((child, i))
+    
+    m = len(nodes)
+    info_strings = sorted({v.info for v in nodes})
+    info_index = {info: i for i, info in enumerate(info_strings)}
+    
+    R_steps = [v.R_step if v.R_step is not None else (-1, -1, -1, np.nan)
+               for v in nodes]
+    
+    arrays = {'version': np.array(_TREE_FORMAT_VERSION),
+              'parent': np.array(parent, dtype=np.int64),
+              'n': np.array([v.n for v in nodes], dtype=np.int64),
+              'root_V': np.array(tree.root.V if m else [], dtype=np.int64),
+              'xyz': np.array([step[:3] for step in R_steps],
+                              dtype=np.int64).reshape((m, 3)),
+              'alpha': np.array([step[3] for step in R_steps],
+                                dtype=np.float64),
+              'valid_ways': np.array([v.valid_ways for v in nodes],
+                                     dtype=np.int64),
+              'info_codes': np.array([info_index[v.info] for v in nodes],
+                                     dtype=np.int32),
+              'info_strings': np.array(info_strings, dtype=str),
+              'exhaustive': np.array(tree.exhaustive),
+              'complete': np.array(tree.complete)}
+    
+    checkpoint = tree.checkpoint
+    if checkpoint is not None:
+        _add_checkpoint_arrays(arrays, checkpoint, index)
+        # the matrices of the stacked nodes are required for resuming
+        stacked = {id(v) for v in checkpoint['stack']}
+    
+    if matrices or checkpoint is not None:
+        # matrices in condensed form keep their size
+        sizes = np.array([v.D.size if v.D is not None and
+                          (matrices or id(v) in stacked) else -1
+                          for v in nodes], dtype=np.int64)
+        offsets = np.zeros((m+1,), dtype=np.int64)
+        np.cumsum(np.maximum(sizes, 0), out=offsets[1:])
+        data = np.empty((offsets[-1],), dtype=np.float64)
+        for i, v in enumerate(nodes):
+            if sizes[i] >= 0:
+                data[offsets[i]:offsets[i+1]] = np.ravel(v.D)
+        arrays['matrix_offsets'] = offsets
+        arrays['has_matrix'] = sizes >= 0
+        arrays['matrix_data'] = data
+    
+    with open(filename, 'wb') as f:
+        if compress:
+            np.savez_compressed(f, **arrays)
+        else:
+            np.savez(f, **arrays)
+
+
+def _add_checkpoint_arrays(arrays, checkpoint, index):
+    """Store the state of an interrupted search by node indices."""
+    
+    orders = checkpoint['orders']
+    order_nodes = [index[id(v)] for v in orders]
+    order_data = [i for order in orders.values() for i in order]
+    
+    arrays['checkpoint_stack'] = np.array([index[id(v)] for v in
+                                           checkpoint['stack']],
+                                          dtype=np.int64)
+    arrays['checkpoint_pending'] = np.array([(index[id(v)], count) for v, count
+                                             in checkpoint['pending'].items()],
+                                            dtype=np.int64).reshape((-1, 2))
+    arrays['checkpoint_order_nodes'] = np.array(order_nodes, dtype=np.int64)
+    arrays['checkpoint_order_data'] = np.array(order_data, dtype=np.int64)
+    arrays['checkpoint_first_candidate_only'] = np.array(
+                                        checkpoint['first_candidate_only'])
+
+
+def _read_checkpoint_arrays(data):
+    
+    return (data['checkpoint_stack'].tolist(),
+            data['checkpoint_pending'].tolist(),
+            data['checkpoint_order_nodes'].tolist(),
+            data['checkpoint_order_data'].tolist(),
+            bool(data['checkpoint_first_candidate_only']))
+
+
+def _restore_checkpoint(checkpoint, stored):
+    """Map the node indices of a stored checkpoint back to the nodes."""
+    
+    stack, pending, order_nodes, order_data, first_candidate_only = checkpoint
+    
+    orders = {}
+    pos = 0
+    for i in order_nodes:
+        v = stored.node(i)
+        orders[v] = order_data[pos:pos+v.n]
+        pos += v.n
+    
+    return {'stack': [stored.node(i) for i in stack],
+            'pending': {stored.node(i): count for i, count in pending},
+            'orders': orders,
+            'first_candidate_only': first_candidate_only}
+
+
+class _StoredTree:
+    """Columnar node data of a loaded recognition tree.
+    
+    The nodes are only built when the children of their parent are accessed
+    for the first time (see _StoredTreeNode).
+    """
+    
+    def __init__(self, data):
+        
+        parent = data['parent']
+        m = parent.shape[0]
+        
+        # the children of every node in stored order (CSR layout)
+        self.child_order = np.argsort(parent[1:], kind='stable') + 1
+        self.child_start = np.zeros((m+1,), dtype=np.int64)
+        np.cumsum(np.bincount(parent[1:], minlength=m),
+                  out=self.child_start[1:])
+        self.child_start = self.child_start.tolist()
+        self.child_order = self.child_order.tolist()
+        
+        self.parent = parent.tolist()
+        self.n = data['n'].tolist()
+        self.root_V = data['root_V'].tolist()
+        xyz = data['xyz']
+        self.x = xyz[:, 0].tolist()
+        self.y = xyz[:, 1].tolist()
+        self.z = xyz[:, 2].tolist()
+        self.alpha = data['alpha'].tolist()
+        self.valid_ways = data['valid_ways'].tolist()
+        info_strings = data['info_strings'].tolist()
+        self.infos = [info_strings[code]
+                      for code in data['info_codes'].tolist()]
+        
+        if 'matrix_data' in data:
+            self.matrix_data = data['matrix_data']
+            self.offsets = data['matrix_offsets'].tolist()
+            self.has_matrix = data['has_matrix'].tolist()
+        else:
+            self.matrix_data = None
+    
+    
+    def matrix(self, i):
+        
+        if self.matrix_data is None or not self.has_matrix[i]:
+            return None
+        
+        D = self.matrix_data[self.offsets[i]:self.offsets[i+1]]
+        n = self.n[i]
+        
+        return D.reshape((n, n)) if D.shape[0] == n * n else D
+    
+    
+    def children(self, v):
+        
+        i = v._index
+        
+        return [_StoredTreeNode(self, j, v) for j in
+                self.child_order[self.child_start[i]:self.child_start[i+1]]]
+    
+    
+    def build_all(self):
+        """Build all nodes that were not built yet (in stored order)."""
+        
+        nodes = [self.root]
         
-        
\ No newline at end of file
+        for i in range(1, len(self.parent)):
+            parent = nodes[self.parent[i]]
+            if parent._children is None:
+                parent._children = []
+            v = _StoredTreeNode(self, i, parent)
+            parent._children.append(v)
+            nodes.append(v)
+    
+    
+    def node(self, i):
+        """The node with index i (building its ancestors if necessary)."""
+        
+        path = []
+        while i > 0:
+            path.append(i)
+            i = self.parent[i]
+        
+        v = self.root
+        for i in reversed(path):
+            siblings = self.child_order[self.child_start[self.parent[i]]:
+                                        self.child_start[self.parent[i]+1]]
+            v = v.children[siblings.index(i)]
+        
+        return v
+
+
+class _StoredTreeNode(TreeNode):
+    """Node of a loaded recognition tree.
+    
+    The children and the item list V are built on first access, V from the
+    item list of the parent and the removed item z.
+    """
+    
+    __slots__ = ('_stored', '_index', '_children', '_V')
+    
+    def __init__(self, stored, index, parent):
+        
+        self._stored = stored
+        self._index = index
+        
+        # None until the children of an inner node are built
+        self._children = (None if stored.child_start[index] <
+                          stored.child_start[index+1] else [])
+        
+        self.parent = parent
+        self.n = stored.n[index]
+        self.D = (stored.matrix(index) if stored.matrix_data is not None
+                  else None)
+        self.valid_ways = stored.valid_ways[index]
+        self.info = stored.infos[index]
+        
+        if parent is None:
+            self._V = stored.root_V
+            self.R_step = None
+        else:
+            self._V = None
+            self.R_step = (stored.x[index], stored.y[index], stored.z[index],
+                           stored.alpha[index])
+    
+    
+    @property
+    def children(self):
+        
+        if self._children is None:
+            self._children = self._stored.children(self)
+        
+        return self._children
+    
+    
+    @children.setter
+    def children(self, children):
+        
+        self._children = children
+    
+    
+    @property
+    def V(self):
+        
+        if self._V is None:
+            V = self.parent.V.copy()
+            V.remove(self.R_step[2])
+            self._V = V
+        
+        return self._V
+    
+    
+    @V.setter
+    def V(self, V):
+        
+        self._V = V
+
+
+def load_recognition(filename, lazy=True):
+    """Load a recognition tree saved with save_recognition().
+    
+    Parameters
+    ----------
+    filename : str
+        Path and filename.
+    lazy : bool, optional
+        If True (default), only the root is built when the tree is loaded,
+        every other node is built on the first access to the children of
+        its parent, so that loading large trees is fast and traversals only
+        pay for the visited nodes. If False, all nodes are built at once,
+        which is faster if the whole tree is traversed afterwards. In both
+        cases, the item list V of a node is built on first access.
+    
+    Returns
+    -------
+    Tree
+        The recognition tree.
+    """
+    
+    # the cyclic garbage collector would repeatedly scan the growing lists
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        with np.load(filename, allow_pickle=False) as data:
+            
+            version = int(data['version'])
+            if version != _TREE_FORMAT_VERSION:
+                raise RuntimeError(f'unsupported tree format version '
+                                   f'{version}')
+            
+            exhaustive = (bool(data['exhaustive']) if 'exhaustive' in data
+                          else True)
+            complete = bool(data['complete']) if 'complete' in data else True
+            checkpoint = (_read_checkpoint_arrays(data) if not complete
+                          else None)
+            
+            stored = _StoredTree(data) if data['parent'].shape[0] else None
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    
+    root = None
+    if stored is not None:
+        root = _StoredTreeNode(stored, 0, None)
+        stored.root = root
+        if not lazy:
+            gc.disable()
+            try:
+                stored.build_all()
+            finally:
+                if gc_was_enabled:
+                    gc.enable()
+    
+    tree = Tree(root)
+    tree.exhaustive = exhaustive
+    tree.complete = complete
+    if checkpoint is not None:
+        tree.checkpoint = _restore_checkpoint(checkpoint, stored)
+    if root is not None:
+        tree.valid_ways = root.valid_ways
+        tree.successes = root.valid_ways
+    
+    return tree
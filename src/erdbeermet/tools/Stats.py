@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+from time import perf_counter
+
+
+__author__ = 'David Schaller'
+
+
+class RecognitionStats:
+    """Counters and timings of a recognition run.
+    
+    An instance is attached to the recognition tree (attribute `stats`) if
+    `recognize()` is called with `stats=True` (or with an instance of this
+    class, in which case the numbers of several runs are accumulated).
+    
+    Attributes
+    ----------
+    times : dict
+        Cumulative time in seconds per phase ('pseudometric',
+        'four_point_filter', 'candidates', 'deltas', 'matrix_copy',
+        'four_point').
+    calls : dict
+        Number of executions per phase.
+    nodes_per_depth : list of int
+        Number of expanded nodes for every depth of the recognition tree.
+    rejections : dict
+        Number of nodes per reason of abort.
+    successes : int
+        Number of successful recognition paths.
+    matrix_bytes : int
+        Total size of the distance matrices stored in the tree nodes.
+    peak_stack_bytes : int
+        Maximal total size of the distance matrices of the nodes waiting on
+        the stack of the depth-first search.
+    restricted : RecognitionStats
+        The numbers of the searches restricted to an inferred circular order
+        that were discarded in favor of the unrestricted search (see
+        `circular_order=True` in recognize()), None if there are none. They
+        are not included in the other attributes.
+    """
+    
+    phases = ('pseudometric', 'four_point_filter', 'candidates', 'deltas',
+              'matrix_copy', 'four_point')
+    
+    def __init__(self):
+        
+        self.times = {phase: 0.0 for phase in RecognitionStats.phases}
+        self.calls = {phase: 0 for phase in RecognitionStats.phases}
+        self.nodes_per_depth = []
+        self.rejections = {}
+        self.successes = 0
+        self.matrix_bytes = 0
+        self.peak_stack_bytes = 0
+        self.restricted = None
+        
+        self._stack_bytes = 0
+    
+    
+    @staticmethod
+    def start():
+        """Start time for a subsequent call of lap()."""
+        
+        return perf_counter()
+    
+    
+    def lap(self, phase, start):
+        """Add the time since start to the phase and return the current time.
+        """
+        
+        now = perf_counter()
+        self.times[phase] += now - start
+        self.calls[phase] += 1
+        
+        return now
+    
+    
+    def expanded(self, depth):
+        """Count an expanded node at the given depth."""
+        
+        while len(self.nodes_per_depth) <= depth:
+            self.nodes_per_depth.append(0)
+        self.nodes_per_depth[depth] += 1
+    
+    
+    def rejected(self, reason):
+        """Count a node that was rejected for the given reason."""
+        
+        self.rejections[reason] = self.rejections.get(reason, 0) + 1
+    
+    
+    def stacked(self, D):
+        """Account for a new matrix that is put on the stack."""
+        
+        self.matrix_bytes += D.nbytes
+        self._stack_bytes += D.nbytes
+        if self._stack_bytes > self.peak_stack_bytes:
+            self.peak_stack_bytes = self._stack_bytes
+    
+    
+    def stored(self, D):
+        """Account for a new matrix that is stored but not stacked."""
+        
+        self.matrix_bytes += D.nbytes
+    
+    
+    def popped(self, D):
+        """Account for a matrix that is removed from the stack."""
+        
+        self._stack_bytes -= D.nbytes
+    
+    
+    def merge(self, other):
+        """Add the numbers of another instance to this one."""
+        
+        for phase in RecognitionStats.phases:
+            self.times[phase] += other.times[phase]
+            self.calls[phase] += other.calls[phase]
+        for depth, count in enumerate(other.nodes_per_depth):
+            while len(self.nodes_per_depth) <= depth:
+                self.nodes_per_depth.append(0)
+            self.nodes_per_depth[depth] += count
+        for reason, count in other.rejections.items():
+            self.rejections[reason] = self.rejections.get(reason, 0) + count
+        self.successes += other.successes
+        self.matrix_bytes += other.matrix_bytes
+        self.peak_stack_bytes = max(self.peak_stack_bytes,
+                                    other.peak_stack_bytes)
+        
+        if other.restricted is not None:
+            self.discard_restricted(other.restricted)
+    
+    
+    def discard_restricted(self, other):
+        """Record the numbers of a discarded restricted search."""
+        
+        if self.restricted is None:
+            self.restricted = RecognitionStats()
+        self.restricted.merge(other)
+    
+    
+    def as_dict(self):
+        """All counters and timings as a (JSON-serializable) dict."""
+        
+        return {'times': dict(self.times),
+                'calls': dict(self.calls),
+                'nodes_per_depth': list(self.nodes_per_depth),
+                'rejections': dict(self.rejections),
+                'successes': self.successes,
+                'matrix_bytes': self.matrix_bytes,
+                'peak_stack_bytes': self.peak_stack_bytes,
+                'restricted': (self.restricted.as_dict()
+                               if self.restricted is not None else None)}
+    
+    
+    def __str__(self):
+        
+        total = sum(self.times.values())
+        lines = ['phase               calls     time [s]   share']
+        for phase in RecognitionStats.phases:
+            share = self.times[phase] / total if total else 0.0
+            lines.append(f'{phase:<18}{self.calls[phase]:>7}'
+                         f'{self.times[phase]:>13.6f}{share:>8.1%}')
+        lines.append(f'expanded nodes per depth: {self.nodes_per_depth}')
+        lines.append(f'rejections: {self.rejections}')
+        lines.append(f'successes: {self.successes}')
+        lines.append(f'matrix memory: {self.matrix_bytes} bytes in total, '
+                     f'{self.peak_stack_bytes} bytes peak on the stack')
+        
+        if self.restricted is not None:
+            lines.append('discarded search restricted to a circular order: '
+                         f'{sum(self.restricted.nodes_per_depth)} expanded '
+                         f'nodes, {sum(self.restricted.times.values()):.6f} s')
+        
+        return '\n'.join(lines)
@@ -1,8 +1,5 @@
 # -*- coding: utf-8 -*-
 
-from erdbeermet.visualize.RecognitionVis import Visualizer
-from erdbeermet.tools.FileIO import write_recognition
-
 
 __author__ = 'David Schaller'
 
@@ -22,8 +19,9 @@ class TreeNode:
         Number of items remaining after removal of z.
     V : list
         List of items after removal of z.
-    D : 2-dimensional numpy array
-        Distance matrix after removal of z and update of the distances.
+    D : numpy array
+        Distance matrix after removal of z and update of the distances,
+        either square or in condensed form (see tools.Condensed).
     R_step : tuple
         x, y, z, and alpha representing the R-step (x, y: z)alpha that was
         applied last.
@@ -35,6 +33,9 @@ class TreeNode:
         this R-step (if this is the case).
     """
     
+    __slots__ = ('parent', 'children', 'n', 'V', 'D', 'R_step',
+                 'valid_ways', 'info')
+    
     def __init__(self, n, V, D=None, R_step=None):
         
         self.parent = None
@@ -81,108 +82,238 @@ class Tree:
     def __init__(self, root):
         
         self.root = root
+        
+        # statistics of the recognition (see recognition.recognize())
+        self.stats = None
+        
+        # False if the recognition skipped candidates
+        self.exhaustive = True
+        
+        # False if the recognition was interrupted, in which case checkpoint
+        # holds the state of the search (see recognition.recognize())
+        self.complete = True
+        self.checkpoint = None
+        
+        # optional flat node orders, see precompute_order()
+        self._preorder = None
+        self._postorder = None
+    
+    
+    def precompute_order(self):
+        """Store the pre- and postorder of the nodes in flat lists.
+        
+        Subsequent traversals via preorder() and postorder() iterate over
+        these lists. The method has to be called again (or clear_order())
+        whenever the tree is modified afterwards.
+        """
+        
+        self._preorder = list(self._iter_preorder())
+        self._postorder = list(self._iter_postorder())
+    
+    
+    def clear_order(self):
+        """Discard the flat node orders stored by precompute_order()."""
+        
+        self._preorder = None
+        self._postorder = None
     
     
     def preorder(self):
         """Generator for preorder traversal of the tree."""
         
-        def _preorder(node):
-            yield node
-            for child in node.children:
-                yield from _preorder(child)
+        if self._preorder is not None:
+            return iter(self._preorder)
         
-        if self.root:
-            yield from _preorder(self.root)
-        else:
-            yield from []
+        return self._iter_preorder()
+    
+    
+    def _iter_preorder(self):
+        
+        stack = [self.root] if self.root else []
+        
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
     
     
     def postorder(self):
         """Generator for postorder traversal of the tree."""
         
-        def _postorder(node):
-            for child in node.children:
-                yield from _postorder(child)
-            yield node
+        if self._postorder is not None:
+            return iter(self._postorder)
+        
+        return self._iter_postorder()
+    
+    
+    def _iter_postorder(self):
+        
+        # the flag indicates whether the children were already stacked
+        stack = [(self.root, False)] if self.root else []
         
-        if self.root:
-            yield from _postorder(self.root)
-        else:
-            yield from []
+        while stack:
+            node, expanded = stack.pop()
+            if expanded or not node.children:
+                yield node
+            else:
+                stack.append((node, True))
+                stack.extend((child, False)
+                             for child in reversed(node.children))
             
     
     def inner_vertices(self):
         """Generator for inner vertices in preorder."""
         
-        def _inner_vertices(node):
-            if node.children:
-                yield node
-                for child in node.children:
-                    yield from _inner_vertices(child)
+        stack = [self.root] if self.root and self.root.children else []
         
-        if self.root:
-            yield from _inner_vertices(self.root)
-        else:
-            yield from []
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(child for child in reversed(node.children)
+                         if child.children)
             
     
     def edges(self):
         """Generator for all edges of the tree."""
         
-        def _edges(node):
-            for child in node.children:
-                yield (node, child)
-                yield from _edges(child)
+        stack = [(self.root, child) for child in reversed(self.root.children)]\
+                if self.root else []
         
-        if self.root:
-            yield from _edges(self.root)
-        else:
-            yield from []
+        while stack:
+            node, child = stack.pop()
+            yield (node, child)
+            stack.extend((child, c) for c in reversed(child.children))
             
     
     def inner_edges(self):
         """Generator for all inner edges of the tree."""
         
-        def _inner_edges(node):
-            for child in node.children:
-                if child.children:
-                    yield (node, child)
-                    yield from _inner_edges(child)
+        stack = [(self.root, child) for child in reversed(self.root.children)
+                 if child.children] if self.root else []
         
-        if self.root:
-            yield from _inner_edges(self.root)
-        else:
-            yield from []
+        while stack:
+            node, child = stack.pop()
+            yield (node, child)
+            stack.extend((child, c) for c in reversed(child.children)
+                         if c.children)
 
 
     def to_newick(self, node=None):
-        """Recursive Tree --> Newick (str) function."""
+        """Tree --> Newick (str) function.
         
-        def _to_newick(node):
-            if not node.children:
-                return str(node)
-            else:
-                s = ''
-                for child in node.children:
-                    s += _to_newick(child) + ','
-                return "({}){}".format(s[:-1], node)
-        
-        if self.root:
-            return _to_newick(self.root) + ';'
-        else:
+        Parameters
+        ----------
+        node : TreeNode, optional
+            Root of the subtree to be exported. The default is None, in which
+            case the whole tree is exported.
+        """
+        
+        if node is None:
+            node = self.root
+        
+        if not node:
             return ';'
         
+        # the stack contains nodes and pending tokens (closing brackets with
+        # the label of the inner node, and commas); all tokens are joined at
+        # the end
+        tokens = []
+        stack = [node]
+        
+        while stack:
+            item = stack.pop()
+            
+            if isinstance(item, str):
+                tokens.append(item)
+            elif not item.children:
+                tokens.append(str(item))
+            else:
+                tokens.append('(')
+                stack.append(')' + str(item))
+                for i in range(len(item.children)-1, -1, -1):
+                    stack.append(item.children[i])
+                    if i > 0:
+                        stack.append(',')
+        
+        tokens.append(';')
+        
+        return ''.join(tokens)
+        
     
-    def visualize(self, decimal_prec=4, save_as=None):
+    def visualize(self, decimal_prec=4, save_as=None, show=True,
+                  max_labels=1000):
+        
+        # matplotlib is only imported when needed
+        from erdbeermet.visualize.RecognitionVis import Visualizer
         
-        Visualizer(self, decimal_prec=decimal_prec, save_as=save_as)
+        Visualizer(self, decimal_prec=decimal_prec, save_as=save_as,
+                   show=show, max_labels=max_labels)
+    
+    
+    def to_svg(self, filename, decimal_prec=4, html=None, labels=True):
+        """Export the tree as SVG (or HTML) without using matplotlib."""
+        
+        from erdbeermet.visualize.SVGExport import write_svg
+        
+        write_svg(self, filename, decimal_prec=decimal_prec, html=html,
+                  labels=labels)
     
     
     def write_to_file(self, filename):
         
+        from erdbeermet.tools.FileIO import write_recognition
+        
         write_recognition(filename, self)
     
     
+    def save(self, filename, matrices=True, compress=False):
+        """Save the tree in a compact binary format (see load())."""
+        
+        from erdbeermet.tools.FileIO import save_recognition
+        
+        save_recognition(filename, self, matrices=matrices, compress=compress)
+    
+    
+    @staticmethod
+    def load(filename, lazy=True):
+        """Load a tree that was saved with save().
+        
+        With lazy=True (default), the nodes are only built on first access
+        (see FileIO.load_recognition()).
+        """
+        
+        from erdbeermet.tools.FileIO import load_recognition
+        
+        return load_recognition(filename, lazy=lazy)
+    
+    
+    def summary(self):
+        """Compact (JSON-serializable) summary of the recognition result.
+        
+        Returns
+        -------
+        dict
+            The number of successful paths, the flags `exhaustive` and
+            `complete`, the number of nodes, the info string of the root,
+            and the R-steps (x, y, z, alpha) of the first successful path
+            (empty if there is none).
+        """
+        
+        accepting_path = []
+        v = self.root
+        while v.valid_ways and v.children:
+            v = next(c for c in v.children if c.valid_ways)
+            x, y, z, alpha = v.R_step
+            accepting_path.append([int(x), int(y), int(z), float(alpha)])
+        
+        return {'successes': int(self.root.valid_ways),
+                'exhaustive': self.exhaustive,
+                'complete': self.complete,
+                'nodes': sum(1 for _ in self.preorder()),
+                'info': self.root.info,
+                'accepting_path': accepting_path}
+    
+    
     def _assert_integrity(self):
         
         for v in self.preorder():
@@ -1,8 +1,6 @@
 # -*- coding: utf-8 -*-
 
 import numpy as np
-from scipy.linalg import solve
-import matplotlib.pyplot as plt
 
 
 def plot_box_graph(distances, labels=None):
@@ -37,6 +35,112 @@ def distance_sums(b):
     return xy_zu, xz_uy, xu_yz
 
 
+def distance_vectors(metrics):
+    """Distance vectors (xy, xz, xu, yz, yu, zu) of a stack of metrics.
+    
+    Parameters
+    ----------
+    metrics : numpy array
+        Array of shape (k, 6) (distance vectors) or (k, 4, 4) (matrices).
+    
+    Returns
+    -------
+    numpy array of shape (k, 6)
+    """
+    
+    metrics = np.asarray(metrics, dtype=float)
+    
+    if metrics.ndim == 2 and metrics.shape[1] == 6:
+        return metrics
+    elif metrics.ndim == 3 and metrics.shape[1:] == (4, 4):
+        rows, cols = np.triu_indices(4, k=1)
+        return metrics[:, rows, cols]
+    else:
+        raise ValueError(f"Metrics of invalid dimension: {metrics.shape}!")
+
+
+def _solve_all_batch(B):
+    """Box parameters for all three diagonal modes of k distance vectors.
+    
+    Returns an array of shape (k, 3, 6) with the solutions (dx, dy, dz, du,
+    r, s) and a boolean array of shape (k, 3) indicating which of them are
+    valid, i.e., belong to a maximal distance sum and are non-negative.
+    """
+    
+    sums = np.stack((B[:, 0] + B[:, 5],
+                     B[:, 1] + B[:, 4],
+                     B[:, 2] + B[:, 3]), axis=1)
+    is_max = sums == np.max(sums, axis=1, keepdims=True)
+    
+    X = np.einsum('mij,kj->kmi', Box4.A_inv, B)
+    X[np.isclose(X, 0.0)] = 0.0     # avoid -0.0
+    
+    valid = is_max & np.all(X >= 0.0, axis=2)
+    
+    return X, valid
+
+
+def _r_metric_condition(modes, params):
+    """Boolean array indicating which box graphs belong to R metrics.
+    
+    The modes (0 if there is no valid box graph) and the box parameters
+    have shapes (k,) and (k, 6), see solve_boxes().
+    """
+    
+    dx, dy, dz, du, r, s = params.T
+    
+    # the two spike pairs on the diagonal for each mode
+    max_product = np.select([modes == 1, modes == 2, modes == 3],
+                            [np.maximum(dx * dy, dz * du),
+                             np.maximum(dx * dz, dy * du),
+                             np.maximum(dx * du, dy * dz)],
+                            default=np.nan)
+    
+    # r * s is the product of the isolation indices in any case
+    with np.errstate(invalid='ignore'):
+        return (modes > 0) & (np.isclose(r * s, max_product) |
+                              (r * s < max_product))
+
+
+def solve_boxes(metrics):
+    """Box graphs of a stack of metrics on four items.
+    
+    Vectorized equivalent of constructing Box4 for every metric and calling
+    its functions first_solution() and is_R_metric().
+    
+    Parameters
+    ----------
+    metrics : numpy array
+        Array of shape (k, 6) (distance vectors in the order xy, xz, xu, yz,
+        yu, zu) or (k, 4, 4) (distance matrices).
+    
+    Returns
+    -------
+    modes : numpy array of shape (k,)
+        The diagonal modes (1: xy and zu, 2: xz and yu, 3: xu and yz on the
+        diagonal), and 0 if there is no valid box graph.
+    params : numpy array of shape (k, 6)
+        The spikes and box sides dx, dy, dz, du, r, s (NaN if the mode is 0).
+    r_metric : numpy array of shape (k,)
+        Boolean array indicating whether the metrics are R metrics.
+    """
+    
+    B = distance_vectors(metrics)
+    k = B.shape[0]
+    
+    X, valid = _solve_all_batch(B)
+    
+    has_mode = np.any(valid, axis=1)
+    modes = np.where(has_mode, np.argmax(valid, axis=1) + 1, 0)
+    
+    params = X[np.arange(k), np.maximum(modes - 1, 0)]
+    params[~has_mode] = np.nan
+    
+    r_metric = _r_metric_condition(modes, params)
+    
+    return modes, params, r_metric
+
+
 class Box4:
     
     # in each matrix: dx, dy, dz, du, r, s
@@ -66,6 +170,9 @@ class Box4:
                    [0, 0, 1, 1, 0, 1],])
         ]
     
+    # precomputed inverses of the three matrices, shape (3, 6, 6)
+    A_inv = np.stack([np.linalg.inv(A_i) for A_i in A])
+    
     
     def __init__(self, metric4, labels=None):
         
@@ -74,7 +181,7 @@ class Box4:
         elif metric4.shape == (4, 4):
             self.b = distance_vector_from_matrix(metric4)
         else:
-            return ValueError(f"Metric of invalid dimension: {metric4.shape}!")
+            raise ValueError(f"Metric of invalid dimension: {metric4.shape}!")
         
         self.labels = labels
                 
@@ -90,28 +197,10 @@ class Box4:
     
     def _solve_all(self):
         
-        self.solutions = []
-    
-        for i in range(3):
-            
-            if self.distance_sums[i] == max(self.distance_sums):
-                
-                x = solve(Box4.A[i], self.b)
-                
-                all_positive = True
-                for j in range(6):
-                    if np.isclose(x[j], 0.0):   # avoid -0.0
-                        x[j] = 0.0
-                    elif x[j] < 0.0:
-                        all_positive = False
-                
-                if all_positive:
-                    self.solutions.append(x)
-                else:
-                    self.solutions.append(False)
-                
-            else:
-                self.solutions.append(False)
+        X, valid = _solve_all_batch(np.asarray(self.b, dtype=float)[None, :])
+        
+        self.solutions = [X[0, i] if valid[0, i] else False
+                          for i in range(3)]
     
     
     def _get_diagonal_mode(self):
@@ -137,30 +226,19 @@ class Box4:
         
         if self._diagonal_mode is None:
             return False
-    
-        dx, dy, dz, du, r, s = self.solutions[self._diagonal_mode-1]
-        
-        # (1) xy and zu on diagonal
-        if self._diagonal_mode == 1:
-            max_product = max(dx * dy, dz * du)
         
-        # (2) xz and yu on diagonal
-        elif self._diagonal_mode == 2:
-            max_product = max(dx * dz, dy * du)
+        # reuse the solution of the constructor
+        params = self.solutions[self._diagonal_mode-1]
         
-        # (3) xu and yz on diagonal
-        elif self._diagonal_mode == 3:
-            max_product = max(dx * du, dy * dz)
-            
-        # r * s is the product of the isolation indices in any case
-        if np.isclose(r * s, max_product) or r * s < max_product:
-            return True
-        else:
-            return False
+        return bool(_r_metric_condition(np.array([self._diagonal_mode]),
+                                        params[None, :])[0])
     
     
     def plot(self):
         
+        # matplotlib is only imported when needed
+        import matplotlib.pyplot as plt
+        
         if self._diagonal_mode is None:
             return
         
@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 
 import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
+from matplotlib.collections import EllipseCollection, LineCollection
+from matplotlib.figure import Figure
+
+from erdbeermet.visualize.TreeLayout import TreeLayout
 
 from matplotlib import rc
 rc('font',**{'family':'sans-serif','sans-serif':['Helvetica']})
@@ -12,16 +15,44 @@ __author__ = 'David Schaller'
 
 
 class Visualizer:
+    """Visualization of a recognition tree.
+    
+    Edges and nodes are drawn as one collection each. Labels are only drawn
+    for the nodes in the topmost levels of the tree such that at most
+    `max_labels` nodes are labeled.
+    
+    Parameters
+    ----------
+    tree : Tree
+        The recognition tree.
+    decimal_prec : int, optional
+        Number of decimal places of alpha. The default is 4.
+    save_as : str, optional
+        Path and filename to save the figure to. The default is None.
+    show : bool, optional
+        If True (default), show the figure using pyplot. Otherwise, the
+        figure is drawn without pyplot (i.e., without a GUI backend), which
+        is only useful together with `save_as`.
+    max_labels : int, optional
+        Maximal number of labeled nodes. The default is 1000.
+    max_size_inches : float, optional
+        Maximal width and height of the figure (at the expense of the
+        aspect ratio). The default is 300.
+    """
     
     info_dict = {'no pseodometric': r'no pseodometric',
                  'negative delta/dxy': r'negative $\delta$/$d_{xy}$',
                  'no candidate': r'no candidate',
                  'spikes too short': r'spikes too short'}
     
-    def __init__(self, tree, decimal_prec=4, save_as=None):
+    def __init__(self, tree, decimal_prec=4, save_as=None, show=True,
+                 max_labels=1000, max_size_inches=300):
         
         self.tree = tree
         self.decimal_prec = decimal_prec
+        self.show = show
+        self.max_labels = max_labels
+        self.max_size_inches = max_size_inches
         
         self.edge_length = 0.5
         self.symbolsize = 0.03
@@ -32,25 +63,28 @@ class Visualizer:
         
         # print(tree.to_newick())
         
-        self.distance_dict = {}
         self.colors = {}
-        self.leaf_counter = 0
-        self.node_positions = {}
         
         self.draw()
         
         if save_as:
             self.fig.savefig(save_as)
         
+        if self.show:
+            plt.show()
+        
     
     def draw(self):
         
-        self.fig, self.ax = plt.subplots()
+        if self.show:
+            self.fig, self.ax = plt.subplots()
+        else:
+            self.fig = Figure()
+            self.ax = self.fig.add_subplot(111)
         self.ax.set_aspect('equal')
         self.ax.invert_yaxis()
         
-        self.initial_traversal()
-        self.assign_positions()
+        self.compute_layout()
         self.draw_edges()
         self.draw_nodes()
         
@@ -63,104 +97,89 @@ class Visualizer:
         
         xmin, xmax = self.ax.get_xlim()
         ymin, ymax = self.ax.get_ylim()
-        self.fig.set_size_inches(5*abs(xmax-xmin), 5*abs(ymax-ymin)+0.4)
-        plt.tight_layout()
-        plt.show()
+        width, height = 5*abs(xmax-xmin), 5*abs(ymax-ymin)+0.4
         
-    
-    def initial_traversal(self):
+        if max(width, height) > self.max_size_inches:
+            self.ax.set_aspect('auto')
+            width = min(width, self.max_size_inches)
+            height = min(height, self.max_size_inches)
+        self.fig.set_size_inches(width, height)
         
-        xmax = 0.0
+        if self.label_depth < len(self.layout.level_sizes):
+            # the layout computation would measure every text object
+            self.fig.subplots_adjust(left=0.01, right=0.99,
+                                     bottom=0.01, top=0.99)
+        else:
+            self.fig.tight_layout()
         
-        for v in self.tree.preorder():
-            if not v.parent:
-                self.distance_dict[v] = self.edge_length
-            else:
-                self.distance_dict[v] = (self.distance_dict[v.parent] +
-                                         self.edge_length)
-                if self.distance_dict[v] > xmax:
-                    xmax = self.distance_dict[v]
-
-            if not v.children:
-                self.leaf_counter += 1
-                
-        self.ax.set_xlim(-0.1,xmax+0.5)
-    
     
-    def assign_positions(self):
-        
-        ymax = (self.leaf_counter-1)/self.leafs_per_vertical_unit
-        self.ax.set_ylim(ymax+self.symbolsize*0.6, -self.symbolsize*0.6)
-        
-        yposition = 0
-        for v in self.tree.postorder():
-            if not v.children:
-                self.node_positions[v] = (self.distance_dict[v],
-                                          yposition)
-                yposition += 1/self.leafs_per_vertical_unit
-            else:
-                ymean = (self.node_positions[v.children[0]][1] +
-                         self.node_positions[v.children[-1]][1])/2
-                self.node_positions[v] = (self.distance_dict[v],
-                                          ymean)
+    def compute_layout(self):
+        
+        self.layout = TreeLayout(self.tree, edge_length=self.edge_length,
+                                 leafs_per_vertical_unit=
+                                     self.leafs_per_vertical_unit)
+        self.distance_dict = self.layout.distance_dict
+        self.node_positions = self.layout.node_positions
+        self.leaf_counter = self.layout.leaf_counter
+        self.label_depth = self.layout.label_depth(self.max_labels)
+        
+        self.ax.set_xlim(-0.1, self.layout.xmax+0.5)
+        self.ax.set_ylim(self.layout.ymax+self.symbolsize*0.6,
+                         -self.symbolsize*0.6)
     
     
     def draw_edges(self):
         
+        segments = []
+        
         for v in self.tree.preorder():
+            x, y = self.node_positions[v]
             if v.parent:
-                self.ax.plot([self.node_positions[v.parent][0],
-                              self.node_positions[v][0]],
-                             [self.node_positions[v][1],
-                              self.node_positions[v][1]],
-                     color='black',
-                     linestyle='-', linewidth=1)
+                segments.append([(self.node_positions[v.parent][0], y),
+                                 (x, y)])
             else:
-                self.ax.plot([self.node_positions[v][0]-self.edge_length,
-                              self.node_positions[v][0]],
-                             [self.node_positions[v][1],
-                              self.node_positions[v][1]],
-                     color='black',
-                     linestyle='-', linewidth=1)
+                segments.append([(x-self.edge_length, y), (x, y)])
             if v.children:
-                self.ax.plot([self.node_positions[v][0],
-                              self.node_positions[v][0]],
-                             [self.node_positions[v.children[0]][1],
-                              self.node_positions[v.children[-1]][1]],
-                     color='black',
-                     linestyle='-', linewidth=1)
+                segments.append([(x, self.node_positions[v.children[0]][1]),
+                                 (x, self.node_positions[v.children[-1]][1])])
+        
+        self.ax.add_collection(LineCollection(segments, colors='black',
+                                              linestyles='-', linewidths=1))
     
     
     def draw_nodes(self):
         
+        offsets, colors = [], []
+        
         for v in self.tree.preorder():
             
             x, y = self.node_positions[v]
             
-            color = 'red'
-            if v.valid_ways:
-                color = 'lightgreen'
-            
-            self.draw_circle(x, y, color=color)
-            self.write_V_and_R_step(v)
+            offsets.append((x, y))
+            colors.append('lightgreen' if v.valid_ways else 'red')
             
-            if not v.children:
-                self.write_abort_info(v)
+            if self.layout.depth(v) < self.label_depth:
+                self.write_V_and_R_step(v)
+                if not v.children:
+                    self.write_abort_info(v)
+        
+        # the keyword was renamed in matplotlib 3.6
+        if hasattr(EllipseCollection, 'set_offset_transform'):
+            transform = {'offset_transform': self.ax.transData}
+        else:
+            transform = {'transOffset': self.ax.transData}
+        
+        self.ax.add_collection(EllipseCollection(self.symbolsize,
+                                                 self.symbolsize, 0.0,
+                                                 units='xy', offsets=offsets,
+                                                 facecolors=colors,
+                                                 edgecolors='black',
+                                                 linewidths=(self.symbolsize /
+                                                             self.symbollw),
+                                                 zorder=self.symbol_zorder,
+                                                 **transform))
                 
     
-    def draw_circle(self, x, y, color='white'):
-        
-        fill = mpatches.Circle((x, y), self.symbolsize/2,
-                               color=color, fill=True,
-                               zorder=self.symbol_zorder)
-        self.ax.add_patch(fill)
-        outer = mpatches.Circle((x, y), self.symbolsize/2,
-                                color='black', fill=False,
-                                lw=self.symbolsize/self.symbollw,
-                                zorder=self.symbol_zorder)
-        self.ax.add_patch(outer)
-    
-    
     def write_V_and_R_step(self, v):
         
         x, y = self.node_positions[v]
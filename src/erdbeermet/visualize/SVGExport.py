@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+from xml.sax.saxutils import escape
+
+from erdbeermet.visualize.TreeLayout import TreeLayout
+
+
+__author__ = 'David Schaller'
+
+
+_STYLE = '''
+line { stroke: black; stroke-width: 1; }
+circle { stroke: black; stroke-width: 0.75; }
+circle.success { fill: lightgreen; }
+circle.failure { fill: red; }
+text { font-family: sans-serif; font-size: 9pt; }
+text.V { text-anchor: end; }
+text.info { dominant-baseline: middle; }
+'''
+
+
+def write_svg(tree, filename, decimal_prec=4, html=None, labels=True,
+              scale=360):
+    """Export a recognition tree as SVG (or HTML) without matplotlib.
+    
+    The layout is the same as in `RecognitionVis.Visualizer`. The elements
+    are written to the file while traversing the tree (first all edges,
+    then all nodes and labels), i.e., the figure is never held in memory as
+    a whole.
+    
+    Parameters
+    ----------
+    tree : Tree
+        The recognition tree.
+    filename : str
+        Path and filename.
+    decimal_prec : int, optional
+        Number of decimal places of alpha. The default is 4.
+    html : bool, optional
+        If True, the SVG is embedded into an HTML document. The default is
+        None, in which case this is decided by the file extension ('.html'
+        or '.htm').
+    labels : bool, optional
+        If True (default), write the item lists, R-steps and abort reasons.
+    scale : float, optional
+        Number of SVG user units (pixels) per unit of the layout. The
+        default is 360 (five inches at 72 dpi, as in the Visualizer).
+    """
+    
+    if html is None:
+        html = filename.lower().endswith(('.html', '.htm'))
+    
+    layout = TreeLayout(tree, edge_length=0.5, leafs_per_vertical_unit=10)
+    exporter = _SVGExporter(tree, layout, decimal_prec=decimal_prec,
+                            labels=labels, scale=scale)
+    
+    with open(filename, 'w', encoding='utf-8') as f:
+        
+        if html:
+            f.write('<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n'
+                    '<title>Recognition tree</title>\n</head>\n<body>\n')
+        
+        exporter.write(f)
+        
+        if html:
+            f.write('</body>\n</html>\n')
+
+
+class _SVGExporter:
+    
+    def __init__(self, tree, layout, decimal_prec=4, labels=True, scale=360):
+        
+        self.tree = tree
+        self.layout = layout
+        self.labels = labels
+        self.scale = scale
+        
+        self.edge_length = layout.edge_length
+        self.symbolsize = 0.03
+        
+        self.R_step_templ = '({},{}:{})  α={:.' + str(decimal_prec) + 'f}'
+    
+    
+    def _xy(self, x, y):
+        
+        return f'{x * self.scale:.2f}', f'{y * self.scale:.2f}'
+    
+    
+    def write(self, f):
+        
+        # same margins as in the Visualizer (plus space for the labels)
+        xmin, xmax = -0.1, self.layout.xmax + 0.5
+        ymin = -self.symbolsize * 0.6 - 0.05
+        ymax = self.layout.ymax + self.symbolsize * 0.6 + 0.05
+        
+        x, y = self._xy(xmin, ymin)
+        w, h = self._xy(xmax - xmin, ymax - ymin)
+        
+        f.write(f'<svg xmlns="http://www.w3.org/2000/svg" width="{w}" '
+                f'height="{h}" viewBox="{x} {y} {w} {h}">\n')
+        f.write(f'<style>{_STYLE}</style>\n')
+        
+        f.write('<g id="edges">\n')
+        self.write_edges(f)
+        f.write('</g>\n<g id="nodes">\n')
+        self.write_nodes(f)
+        f.write('</g>\n</svg>\n')
+    
+    
+    def _line(self, f, x1, y1, x2, y2):
+        
+        x1, y1 = self._xy(x1, y1)
+        x2, y2 = self._xy(x2, y2)
+        f.write(f'<line x1="{x1}" y1="{y1}" x2="{x2}" y2="{y2}"/>\n')
+    
+    
+    def _text(self, f, x, y, text, css_class=None):
+        
+        x, y = self._xy(x, y)
+        css = f' class="{css_class}"' if css_class else ''
+        f.write(f'<text x="{x}" y="{y}"{css}>{escape(text)}</text>\n')
+    
+    
+    def write_edges(self, f):
+        
+        positions = self.layout.node_positions
+        
+        for v in self.tree.preorder():
+            x, y = positions[v]
+            if v.parent:
+                self._line(f, positions[v.parent][0], y, x, y)
+            else:
+                self._line(f, x-self.edge_length, y, x, y)
+            if v.children:
+                self._line(f, x, positions[v.children[0]][1],
+                           x, positions[v.children[-1]][1])
+    
+    
+    def write_nodes(self, f):
+        
+        positions = self.layout.node_positions
+        r = f'{self.symbolsize / 2 * self.scale:.2f}'
+        
+        for v in self.tree.preorder():
+            
+            x, y = positions[v]
+            cx, cy = self._xy(x, y)
+            css_class = 'success' if v.valid_ways else 'failure'
+            f.write(f'<circle cx="{cx}" cy="{cy}" r="{r}" '
+                    f'class="{css_class}"/>\n')
+            
+            if not self.labels:
+                continue
+            
+            self._text(f, x-self.symbolsize/2-0.005, y-0.002, f'{v.V}',
+                       css_class='V')
+            
+            if v.R_step:
+                self._text(f, x-self.edge_length+self.symbolsize/2+0.005,
+                           y-0.002, self.R_step_templ.format(*v.R_step))
+            
+            if not v.children:
+                self._text(f, x+self.symbolsize/2+0.02, y, v.info,
+                           css_class='info')
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+
+__author__ = 'David Schaller'
+
+
+class TreeLayout:
+    """Positions of the nodes of a recognition tree in the plane.
+    
+    The root is placed at x = edge_length and every level of the tree adds
+    edge_length to the x coordinate. The leaves are placed equidistantly
+    along the (downward) y axis in postorder, and every inner node is
+    centered between its first and last child. The layout does not depend
+    on matplotlib.
+    
+    Attributes
+    ----------
+    distance_dict : dict
+        The x coordinate of every node.
+    node_positions : dict
+        The (x, y) coordinates of every node.
+    leaf_counter : int
+        Number of leaves.
+    level_sizes : list of int
+        Number of nodes on each level of the tree.
+    xmax : float
+        Maximal x coordinate.
+    ymax : float
+        Maximal y coordinate.
+    """
+    
+    def __init__(self, tree, edge_length=0.5, leafs_per_vertical_unit=10):
+        
+        self.tree = tree
+        self.edge_length = edge_length
+        self.leafs_per_vertical_unit = leafs_per_vertical_unit
+        
+        self.distance_dict = {}
+        self.node_positions = {}
+        self.leaf_counter = 0
+        self.level_sizes = []
+        self.xmax = 0.0
+        self.ymax = 0.0
+        
+        self.initial_traversal()
+        self.assign_positions()
+    
+    
+    def initial_traversal(self):
+        
+        for v in self.tree.preorder():
+            if not v.parent:
+                self.distance_dict[v] = self.edge_length
+            else:
+                self.distance_dict[v] = (self.distance_dict[v.parent] +
+                                         self.edge_length)
+                if self.distance_dict[v] > self.xmax:
+                    self.xmax = self.distance_dict[v]
+            
+            depth = self.depth(v)
+            if depth == len(self.level_sizes):
+                self.level_sizes.append(0)
+            self.level_sizes[depth] += 1
+            
+            if not v.children:
+                self.leaf_counter += 1
+    
+    
+    def assign_positions(self):
+        
+        self.ymax = (self.leaf_counter-1)/self.leafs_per_vertical_unit
+        
+        yposition = 0
+        for v in self.tree.postorder():
+            if not v.children:
+                self.node_positions[v] = (self.distance_dict[v],
+                                          yposition)
+                yposition += 1/self.leafs_per_vertical_unit
+            else:
+                ymean = (self.node_positions[v.children[0]][1] +
+                         self.node_positions[v.children[-1]][1])/2
+                self.node_positions[v] = (self.distance_dict[v],
+                                          ymean)
+    
+    
+    def depth(self, v):
+        """Level of a node (0 for the root)."""
+        
+        return round(self.distance_dict[v] / self.edge_length) - 1
+    
+    
+    def label_depth(self, max_labels):
+        """Number of topmost levels with at most max_labels nodes in total."""
+        
+        depth, labeled = 0, 0
+        for size in self.level_sizes:
+            labeled += size
+            if labeled > max_labels:
+                break
+            depth += 1
+        
+        return depth
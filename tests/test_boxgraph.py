@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from erdbeermet.simulation import simulate
+from erdbeermet.visualize.BoxGraphVis import (Box4, distance_vectors,
+                                              solve_boxes)
+
+
+__author__ = 'David Schaller'
+
+
+def _scalar_box(b):
+    """Diagonal mode, box parameters and R metric flag of a distance vector
+    (solving one linear system per mode)."""
+    
+    sums = (b[0] + b[5], b[1] + b[4], b[2] + b[3])
+    
+    for i in range(3):
+        if sums[i] != max(sums):
+            continue
+        x = np.linalg.solve(Box4.A[i], b)
+        x[np.isclose(x, 0.0)] = 0.0
+        if np.all(x >= 0.0):
+            break
+    else:
+        return 0, None, False
+    
+    dx, dy, dz, du, r, s = x
+    max_product = (max(dx * dy, dz * du), max(dx * dz, dy * du),
+                   max(dx * du, dy * dz))[i]
+    
+    return i + 1, x, bool(np.isclose(r * s, max_product) or
+                          r * s < max_product)
+
+
+def _quadruples():
+    
+    rng = np.random.default_rng(42)
+    
+    # R metrics
+    np.random.seed(0)
+    matrices = [simulate(4).D for _ in range(200)]
+    vectors = list(distance_vectors(np.array(matrices)))
+    
+    # arbitrary vectors, and small integers with ties and zero distances
+    vectors.extend(rng.random((300, 6)))
+    vectors.extend(rng.integers(0, 3, (300, 6)).astype(float))
+    
+    # degenerate cases
+    vectors.extend([np.zeros(6), np.ones(6),
+                    np.array([0.0, 1.0, 1.0, 1.0, 1.0, 2.0]),
+                    np.array([1.0, 1.0, 2.0, 2.0, 1.0, 1.0])])
+    
+    return np.array(vectors)
+
+
+def test_batched_solver_agrees_with_scalar_solver():
+    
+    B = _quadruples()
+    modes, params, r_metric = solve_boxes(B)
+    
+    for k, b in enumerate(B):
+        mode, x, is_r = _scalar_box(b)
+        assert modes[k] == mode
+        assert r_metric[k] == is_r
+        if mode:
+            assert np.allclose(params[k], x)
+        else:
+            assert np.all(np.isnan(params[k]))
+    
+        box = Box4(b)
+        assert box.is_R_metric() == is_r
+        if mode:
+            assert np.allclose(box.first_solution(), x)
+        else:
+            assert box.first_solution() is None
+
+
+def test_matrices_and_vectors_give_the_same_boxes():
+    
+    np.random.seed(1)
+    matrices = np.array([simulate(4).D for _ in range(20)])
+    
+    for a, b in zip(solve_boxes(matrices),
+                    solve_boxes(distance_vectors(matrices))):
+        assert np.array_equal(a, b, equal_nan=True)
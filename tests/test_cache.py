@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import numpy as np
+import pytest
+
+import erdbeermet.recognition as recognition
+from erdbeermet.simulation import simulate
+from erdbeermet.recognition import recognize
+from erdbeermet.tools.Cache import RecognitionCache
+
+
+__author__ = 'David Schaller'
+
+
+def _simulated_matrix(N, seed):
+    
+    np.random.seed(seed)
+    
+    return simulate(N).D
+
+
+def _entries(cache):
+    
+    return sorted(name for name in os.listdir(cache.directory)
+                  if name.endswith(RecognitionCache.suffix))
+
+
+def _fail(*args, **kwargs):
+    
+    raise AssertionError('the search was run on a cache hit')
+
+
+def test_hit_and_misses(tmp_path, monkeypatch):
+    
+    cache = RecognitionCache(str(tmp_path))
+    D = _simulated_matrix(7, 1)
+    
+    expected = recognize(D, cache=cache).summary()
+    assert len(_entries(cache)) == 1
+    
+    # hit: the search is not run again
+    with monkeypatch.context() as m:
+        m.setattr(recognition, '_recognize', _fail)
+        assert recognize(D, cache=cache).summary()['successes'] == \
+            expected['successes']
+    
+    # misses: different parameters and a different algorithm version
+    recognize(D, cache=cache, first_candidate_only=True)
+    assert len(_entries(cache)) == 2
+    
+    monkeypatch.setattr(recognition, 'ALGORITHM_VERSION',
+                        recognition.ALGORITHM_VERSION + 1)
+    recognize(D, cache=cache)
+    assert len(_entries(cache)) == 3
+
+
+@pytest.mark.parametrize('corruption', ['garbage', 'truncated'])
+def test_corrupt_entries_are_ignored(tmp_path, corruption):
+    
+    cache = RecognitionCache(str(tmp_path))
+    D = _simulated_matrix(7, 1)
+    
+    expected = recognize(D, cache=cache).summary()
+    path = os.path.join(cache.directory, _entries(cache)[0])
+    
+    if corruption == 'garbage':
+        with open(path, 'wb') as f:
+            f.write(b'no recognition tree')
+    else:
+        with open(path, 'rb') as f:
+            data = f.read()
+        with open(path, 'wb') as f:
+            f.write(data[:len(data)//2])
+    
+    key = _entries(cache)[0][:-len(RecognitionCache.suffix)]
+    assert cache.get(key) is None
+    
+    # the entry is recomputed and stored again
+    assert recognize(D, cache=cache).summary() == expected
+    assert cache.get(key) is not None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    
+    cache = RecognitionCache(str(tmp_path))
+    tree = recognize(_simulated_matrix(7, 1))
+    
+    # the same tree under different keys, i.e., entries of equal size
+    cache.put('a', tree)
+    size = os.path.getsize(os.path.join(cache.directory, 'a.npz'))
+    cache.max_bytes = 3 * size
+    
+    for i, key in enumerate(['a', 'b', 'c']):
+        cache.put(key, tree)
+        os.utime(os.path.join(cache.directory, key + '.npz'),
+                 (1000 + i, 1000 + i))
+    assert _entries(cache) == ['a.npz', 'b.npz', 'c.npz']
+    
+    # a hit makes 'a' the most recently used entry
+    assert cache.get('a') is not None
+    cache.put('d', tree)
+    
+    assert _entries(cache) == ['a.npz', 'c.npz', 'd.npz']
+    assert sum(os.path.getsize(os.path.join(cache.directory, name))
+               for name in _entries(cache)) <= cache.max_bytes
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+import numpy as np
+
+from erdbeermet.simulation import simulate
+from erdbeermet.cli import main
+
+
+__author__ = 'David Schaller'
+
+
+def _read_lines(path):
+    
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_unreadable_inputs_fail_their_own_records(tmp_path):
+    
+    np.random.seed(0)
+    stack = os.path.join(tmp_path, 'stack.npy')
+    np.save(stack, np.stack([simulate(6).D for _ in range(3)]))
+    
+    broken = os.path.join(tmp_path, 'broken.npy')
+    with open(broken, 'wb') as f:
+        f.write(b'no matrix')
+    missing = os.path.join(tmp_path, 'missing.txt')
+    output = os.path.join(tmp_path, 'results.jsonl')
+    
+    status = main(['--jobs', '1', 'recognize', stack, broken, missing,
+                   '--output', output])
+    
+    assert status == 1
+    records = {record['id']: record for record in _read_lines(output)}
+    assert sorted(records) == sorted([f'{stack}:0', f'{stack}:1',
+                                      f'{stack}:2', broken, missing])
+    for i in range(3):
+        assert records[f'{stack}:{i}']['success']
+    assert 'error' in records[broken] and 'error' in records[missing]
+    
+    # the failed inputs are retried with --resume
+    np.save(broken, simulate(6).D)
+    status = main(['--jobs', '1', 'recognize', stack, broken,
+                   '--output', output, '--resume'])
+    
+    assert status == 0
+    records = _read_lines(output)
+    assert len(records) == 6
+    assert records[-1]['id'] == broken and records[-1]['success']
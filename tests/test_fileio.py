@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import numpy as np
+import pytest
+
+from erdbeermet.simulation import simulate
+from erdbeermet.recognition import recognize
+from erdbeermet.tools.Tree import Tree
+
+
+__author__ = 'David Schaller'
+
+
+@pytest.mark.parametrize('condensed', [False, True])
+@pytest.mark.parametrize('compress', [False, True])
+def test_saved_recognition_tree_is_loaded_lazily(tmp_path, condensed,
+                                                 compress):
+    
+    np.random.seed(3)
+    tree = recognize(simulate(8).D, condensed=condensed)
+    filename = os.path.join(tmp_path, 'tree.npz')
+    tree.save(filename, compress=compress)
+    
+    loaded = Tree.load(filename, lazy=True)
+    
+    assert loaded.to_newick() == tree.to_newick()
+    assert loaded.summary() == tree.summary()
+    
+    nodes = list(tree.preorder())
+    loaded_nodes = list(loaded.preorder())
+    assert len(loaded_nodes) == len(nodes)
+    
+    for v, w in zip(nodes, loaded_nodes):
+        assert w.n == v.n
+        assert list(w.V) == list(v.V)
+        assert w.R_step == v.R_step
+        assert w.valid_ways == v.valid_ways
+        assert w.info == v.info
+        assert len(w.children) == len(v.children)
+        if v.D is None:
+            assert w.D is None
+        else:
+            assert np.array_equal(w.D, v.D)
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+
+import subprocess
+import sys
+
+
+__author__ = 'David Schaller'
+
+
+# modules that are only imported on demand by the simulation and
+# recognition modules
+LAZY_MODULES = ('matplotlib', 'scipy', 'erdbeermet.tools.FileIO')
+
+
+def test_core_modules_do_not_import_lazy_modules():
+    
+    code = ('import sys\n'
+            'import erdbeermet.simulation\n'
+            'import erdbeermet.recognition\n'
+            'print("\\n".join(sys.modules))\n')
+    output = subprocess.run([sys.executable, '-c', code], check=True,
+                            capture_output=True, text=True).stdout
+    loaded = set(output.split())
+    
+    assert 'erdbeermet.recognition' in loaded
+    for module in LAZY_MODULES:
+        assert module not in loaded
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from erdbeermet.simulation import simulate
+from erdbeermet.mining import canonical_key, dead_end_key, invariant_key
+
+
+__author__ = 'David Schaller'
+
+
+def _relabel(D, rng):
+    
+    perm = rng.permutation(D.shape[0])
+    
+    return D[np.ix_(perm, perm)]
+
+
+def _graph_metric(n, edges):
+    """Shortest-path distances of a connected graph."""
+    
+    D = np.full((n, n), np.inf)
+    np.fill_diagonal(D, 0.0)
+    for u, v in edges:
+        D[u, v] = D[v, u] = 1.0
+    for k in range(n):
+        D = np.minimum(D, D[:, k, None] + D[None, k, :])
+    
+    return D
+
+
+def _with_twins(D):
+    
+    # items n and n+1 are twins of items 0 and 1 (at distance 0.5), i.e.,
+    # they have the same sorted rows
+    n = D.shape[0]
+    E = np.zeros((n + 2, n + 2))
+    E[:n, :n] = D
+    for twin, item in ((n, 0), (n + 1, 1)):
+        E[twin, :n] = E[:n, twin] = D[item]
+        E[twin, item] = E[item, twin] = 0.5
+    E[n, n + 1] = E[n + 1, n] = D[0, 1]
+    
+    return E
+
+
+def test_canonical_key_is_invariant_under_relabelling():
+    
+    rng = np.random.default_rng(0)
+    np.random.seed(0)
+    matrices = [simulate(N).D for N in (5, 6, 7, 8) for _ in range(5)]
+    matrices.extend([_with_twins(D) for D in matrices[:5]])
+    
+    keys = []
+    for D in matrices:
+        key = canonical_key(D)
+        for _ in range(5):
+            assert canonical_key(_relabel(D, rng)) == key
+        keys.append(key)
+    
+    # the simulated matrices are pairwise non-isomorphic
+    assert len(set(keys)) == len(keys)
+
+
+def test_canonical_key_distinguishes_non_isomorphic_matrices():
+    
+    # K_{3,3} and the triangular prism: both 3-regular with diameter 2,
+    # i.e., all sorted rows are equal, but not isomorphic
+    K33 = _graph_metric(6, [(u, v) for u in range(3) for v in range(3, 6)])
+    prism = _graph_metric(6, [(0, 1), (1, 2), (0, 2), (3, 4), (4, 5),
+                              (3, 5), (0, 3), (1, 4), (2, 5)])
+    
+    assert invariant_key(K33) == invariant_key(prism)
+    assert canonical_key(K33) != canonical_key(prism)
+
+
+def test_tied_items_fall_back_to_invariant_key():
+    
+    rng = np.random.default_rng(1)
+    
+    # all 9! orders of the cycle on 9 items would have to be compared
+    C9 = _graph_metric(9, [(i, (i + 1) % 9) for i in range(9)])
+    key = dead_end_key(C9)
+    
+    assert key == invariant_key(C9)
+    assert key.startswith('invariant:')
+    for _ in range(5):
+        assert dead_end_key(_relabel(C9, rng)) == key
+    
+    # without ties, the canonical key is used
+    np.random.seed(2)
+    D = simulate(7).D
+    assert dead_end_key(D) == canonical_key(D)
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from erdbeermet.simulation import simulate
+from erdbeermet.obstructions import find_obstructions
+
+
+__author__ = 'David Schaller'
+
+
+def _matrix_with_obstruction(N, seed):
+    """R matrix in which only the triple (0, 1, z) violates the triangle
+    inequality."""
+    
+    np.random.seed(seed)
+    D = simulate(N).D
+    
+    detours = D[0, 2:] + D[1, 2:]
+    first, second = np.argsort(detours)[:2]
+    z = int(first) + 2
+    
+    D[0, 1] = D[1, 0] = (detours[first] + detours[second]) / 2
+    
+    return D, (0, 1, z)
+
+
+def test_known_obstruction_is_found():
+    
+    for seed in range(5):
+        D, obstruction = _matrix_with_obstruction(7, seed)
+    
+        assert find_obstructions(D) == [obstruction]
+
+
+def test_supersets_of_obstructions_are_not_reported():
+    
+    for seed in range(5):
+        D, obstruction = _matrix_with_obstruction(7, seed)
+        obstructions = find_obstructions(D, all_sizes=True)
+    
+        assert obstruction in obstructions
+        for a in obstructions:
+            for b in obstructions:
+                assert a == b or not set(a) <= set(b)
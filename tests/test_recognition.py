@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import numpy as np
+import pytest
+
+import erdbeermet.recognition as recognition
+from erdbeermet.simulation import simulate
+from erdbeermet.recognition import recognize, resume_recognition
+from erdbeermet.tools.Condensed import as_square, condense
+from erdbeermet.tools.Tree import Tree
+
+
+__author__ = 'David Schaller'
+
+
+def _simulated_matrix(N, seed, **params):
+    
+    np.random.seed(seed)
+    
+    return simulate(N, **params).D
+
+
+def test_resumed_recognition_equals_unbudgeted():
+    
+    D = _simulated_matrix(8, 3)
+    expected = recognize(D).summary()
+    
+    tree = recognize(D, max_nodes=5)
+    assert not tree.complete
+    
+    while not tree.complete:
+        tree = resume_recognition(tree, max_nodes=5)
+    
+    summary = tree.summary()
+    assert summary['successes'] == expected['successes']
+    assert summary['nodes'] == expected['nodes']
+
+
+def test_resumed_recognition_after_save_and_load(tmp_path):
+    
+    D = _simulated_matrix(8, 3)
+    expected = recognize(D).summary()
+    
+    tree = recognize(D, max_nodes=5)
+    filename = os.path.join(tmp_path, 'tree.npz')
+    
+    while not tree.complete:
+        tree.save(filename)
+        tree = resume_recognition(Tree.load(filename), max_nodes=5)
+    
+    summary = tree.summary()
+    assert summary['successes'] == expected['successes']
+    assert summary['nodes'] == expected['nodes']
+
+
+def test_budgets_cannot_be_combined_with_beam_width():
+    
+    D = _simulated_matrix(6, 0)
+    
+    for budget in ({'max_nodes': 10}, {'time_limit': 1.0},
+                   {'max_bytes': 10**6}):
+        with pytest.raises(ValueError):
+            recognize(D, beam_width=2, **budget)
+
+
+def _random_metrics(n, count, seed):
+    
+    # all distances in [1, 2] satisfy the triangle inequality
+    rng = np.random.default_rng(seed)
+    
+    for _ in range(count):
+        D = np.triu(rng.uniform(1.0, 2.0, (n, n)), k=1)
+        yield D + D.T
+
+
+def test_four_point_filter_does_not_change_the_verdict():
+    
+    matrices = [_simulated_matrix(N, seed, circular=circular,
+                                  branching_prob=branching_prob)
+                for N in (5, 7)
+                for seed in range(5)
+                for circular, branching_prob in ((False, 0.0), (True, 0.0),
+                                                 (False, 0.3))]
+    matrices.extend(_random_metrics(6, 40, 0))
+    
+    filtered = 0
+    for D in matrices:
+        tree = recognize(D)
+        filtered_tree = recognize(D, four_point_filter=True)
+        assert filtered_tree.successes == tree.successes
+        if filtered_tree.root.info == 'no R-map on quadruple':
+            filtered += 1
+    
+    # the filter rejects some of the non-R matrices before the search
+    assert filtered > 0
+
+
+def _assert_same_trees(tree, condensed_tree):
+    
+    assert condensed_tree.summary() == tree.summary()
+    assert condensed_tree.to_newick() == tree.to_newick()
+    
+    for v, w in zip(tree.preorder(), condensed_tree.preorder()):
+        assert w.V == v.V
+        assert w.R_step == v.R_step
+        assert w.valid_ways == v.valid_ways
+        assert w.info == v.info
+        if v.D is not None:
+            assert np.array_equal(as_square(w.D, w.n), v.D)
+
+
+def test_condensed_and_square_input_give_the_same_trees():
+    
+    matrices = [_simulated_matrix(N, seed, branching_prob=branching_prob)
+                for N in (6, 7)
+                for seed in range(3)
+                for branching_prob in (0.0, 0.3)]
+    matrices.extend(_random_metrics(6, 5, 1))
+    
+    for D in matrices:
+        for params in ({}, {'first_candidate_only': True},
+                       {'four_point_filter': True}):
+            _assert_same_trees(recognize(D, **params),
+                               recognize(condense(D), **params))
+    
+    # circular order given
+    np.random.seed(4)
+    scenario = simulate(8, circular=True)
+    order = scenario.get_circular_order()
+    _assert_same_trees(recognize(scenario.D, circular_order=order),
+                       recognize(condense(scenario.D), circular_order=order))
+
+
+def test_search_restricted_to_a_circular_order_is_not_exhaustive():
+    
+    np.random.seed(5)
+    scenario = simulate(7, circular=True)
+    order = scenario.get_circular_order()
+    
+    assert recognize(scenario.D).exhaustive
+    
+    for beam_width in (None, 2):
+        tree = recognize(scenario.D, circular_order=order,
+                         beam_width=beam_width)
+        assert tree.successes > 0
+        assert not tree.exhaustive
+    
+    # a failure w.r.t. a wrong order is not conclusive
+    for seed in range(10):
+        D = _simulated_matrix(7, seed)
+        tree = recognize(D, circular_order=list(range(7)))
+        if not tree.successes:
+            assert recognize(D).successes > 0
+            assert not tree.exhaustive
+            break
+    else:
+        pytest.fail('no failure w.r.t. the identity order')
+
+
+def test_inferred_circular_order_is_not_exhaustive():
+    
+    np.random.seed(6)
+    tree = recognize(simulate(8, circular=True).D, circular_order=True,
+                     stats=True)
+    
+    # the restricted search succeeded and was not discarded
+    assert tree.successes > 0
+    assert tree.stats.restricted is None
+    assert not tree.exhaustive
+    
+    # the fallback to the unrestricted search is exhaustive
+    for D in _random_metrics(6, 20, 2):
+        tree = recognize(D, circular_order=True)
+        assert tree.exhaustive
+        assert tree.successes == recognize(D).successes
+
+
+def test_time_limit_is_shared_by_the_circular_order_fallback(monkeypatch):
+    
+    budgets = []
+    search = recognition._recognize
+    
+    def recording_search(*args, **kwargs):
+        budgets.append(kwargs['budget'])
+        return search(*args, **kwargs)
+    
+    monkeypatch.setattr(recognition, '_recognize', recording_search)
+    
+    # slightly perturbed circular R matrices, whose inferred order is
+    # (mostly) Kalmanson but for which the restricted search fails
+    rng = np.random.default_rng(0)
+    fallbacks = 0
+    for seed in range(20):
+        D = _simulated_matrix(7, seed, circular=True)
+        D = D * (1.0 + rng.normal(0.0, 0.01, D.shape))
+        D = (D + D.T) / 2
+        np.fill_diagonal(D, 0.0)
+    
+        budgets.clear()
+        recognize(D, circular_order=True, time_limit=60.0)
+        if len(budgets) == 2:
+            fallbacks += 1
+            assert budgets[0] is budgets[1]
+    
+    assert fallbacks > 0
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from erdbeermet.simulation import scenario_from_history, simulate_stepwise
+
+
+__author__ = 'David Schaller'
+
+
+def test_stepwise_snapshots_are_not_modified():
+    
+    np.random.seed(42)
+    
+    snapshots = []
+    for scenario in simulate_stepwise(20):
+        snapshots.append(scenario.D)
+        
+        # a matrix returned by distances() must not change either
+        scenario.distances()
+    
+    history = scenario.history
+    
+    for D in snapshots:
+        expected = scenario_from_history(history, stop_after=D.shape[0]).D
+        assert np.array_equal(D, expected)